@@ -1,42 +1,191 @@
 # -*- coding: utf-8 -*-
 
 from hashlib import sha256
+import struct
 import json
 
 from asyncoin.cryptocurrency.transaction import Transaction
+from asyncoin.cryptocurrency.merkle import merkle_root
+
+# version, index, previous hash, Merkle root, timestamp and nonce
+HEADER = struct.Struct('<IQ32s32sdQ')
+
+# blocks from this version on are hashed by their header, rather than by their whole body
+HEADER_VERSION = 2
+
+
+# in the order they're serialized
+HEADER_FIELDS = ('version', 'index', 'previous_hash', 'merkle_root', 'timestamp', 'nonce')
+BLOCK_FIELDS = ('index', 'nonce', 'data', 'previous_hash', 'timestamp', 'version')
+
+
+class BlockHeader:
+    """The fixed-size part of a block that proof of work is done on.
+    It commits to the block's transactions through their Merkle root, and the nonce
+    comes last so the hash state of everything before it can be reused for every nonce.
+    Attributes:
+        version (int): the block format version.
+        index (int): the index of the block in the blockchain.
+        previous_hash (str): the previous hash in the blockchain.
+        merkle_root (str): hexadecimal Merkle root of the block's transaction ids, which cover their signatures.
+        timestamp (float): the time the block was created.
+        nonce (int): arbitrary value used in proof of work.
+    """
+
+    __slots__ = HEADER_FIELDS + ('_hash',)
+
+    def __init__(self, version, index, previous_hash, merkle_root, timestamp, nonce):
+        set_ = object.__setattr__
+
+        set_(self, 'version', version)
+        set_(self, 'index', index)
+        set_(self, 'previous_hash', previous_hash)
+        set_(self, 'merkle_root', merkle_root)
+        set_(self, 'timestamp', timestamp)
+        set_(self, 'nonce', nonce)
+        set_(self, '_hash', None)
+
+    def pack(self):
+        """
+        Returns:
+            bytes: the serialized header, the nonce being the last 8 bytes.
+        """
+        # the genesis block's previous hash is 0 (or '0', once it's been through the database)
+        previous_hash = bytes(32) if str(self.previous_hash) == '0' else bytes.fromhex(self.previous_hash)
+
+        return HEADER.pack(self.version, self.index, previous_hash, bytes.fromhex(self.merkle_root), self.timestamp, self.nonce)
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            object.__setattr__(self, '_hash', sha256(self.pack()).hexdigest())
+
+        return self._hash
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in HEADER_FIELDS}
+
+    @classmethod
+    def from_dict(cls, json_dict):
+        return cls(version=json_dict['version'],
+                   index=json_dict['index'],
+                   previous_hash=json_dict['previous_hash'],
+                   merkle_root=json_dict['merkle_root'],
+                   timestamp=json_dict['timestamp'],
+                   nonce=json_dict['nonce'])
+
+    # Special class methods
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Block headers are immutable.')
+
+    def __delattr__(self, name):
+        raise AttributeError('Block headers are immutable.')
+
+    def __reduce__(self):
+        # pickled through the constructor, as the immutable attributes can't be set back one by one
+        return BlockHeader.from_dict, (self.to_dict(),)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __repr__(self):
+        __dict__ = self.to_dict()
+        __dict__['hash'] = self.hash
+
+        return json.dumps(__dict__)
+
+    def __eq__(self, other):
+        return isinstance(other, BlockHeader) and self.hash == other.hash
+
+    def __hash__(self):
+        return hash(self.hash)
 
 
 class Block:
-    """A Cryptocurrency block.
+    """A Cryptocurrency block. Blocks are immutable, so their hash and Merkle root are only computed once.
     Attributes:
+        version (int): the block format version, 1 for blocks hashed with their whole body.
         index (int): the index of the block in the blockchain.
         nonce (int): arbitrary value used in proof of work.
-        data (list): the list of data (transactions) contained in the block.
+        data (tuple): the transactions contained in the block.
         previous_hash (str): the previous hash in the blockchain.
         timestamp (int): the time the block was created.
         hash (str): hexadecimal message digest of the block's contents.
     """
 
+    __slots__ = BLOCK_FIELDS + ('_hash', '_merkle_root')
+
     def __init__(self, **kwargs):
         """
         Args:
             **kwargs:
                 index (int): the index of the block in the blockchain.
                 nonce (int): arbitrary value used in proof of work.
-                data (list): the list of data (transactions) contained in the block.
+                data (iterable): the transactions contained in the block.
                 previous_hash (str): the previous hash in the blockchain.
                 timestamp (int): the time the block was created.
+                version (int, optional): the block format version.
+        """
+        set_ = object.__setattr__
+
+        set_(self, 'index', kwargs['index'])
+        set_(self, 'nonce', kwargs['nonce'])
+        set_(self, 'data', tuple(kwargs['data']))
+        set_(self, 'previous_hash', kwargs['previous_hash'])
+        set_(self, 'timestamp', kwargs['timestamp'])
+        set_(self, 'version', kwargs.get('version', 1))
+        set_(self, '_hash', None)
+        set_(self, '_merkle_root', None)
+
+    def with_nonce(self, nonce):
+        """
+        Args:
+            nonce (int): the new nonce.
+
+        Returns:
+            Block: a copy of the block with the nonce, sharing its transactions and Merkle root.
+        """
+        block = Block(index=self.index, nonce=nonce, data=self.data,
+                      previous_hash=self.previous_hash, timestamp=self.timestamp, version=self.version)
+        object.__setattr__(block, '_merkle_root', self._merkle_root)
+
+        return block
+
+    @property
+    def merkle_root(self):
+        if self._merkle_root is None:
+            # the hash leaves the signature out, so it's the transaction ids that are committed to
+            object.__setattr__(self, '_merkle_root', merkle_root([transaction.txid for transaction in self.data]))
+
+        return self._merkle_root
+
+    def header(self):
+        """
+        Returns:
+            BlockHeader: the block's header.
         """
-        if kwargs:
-            self.index = kwargs['index']
-            self.nonce = kwargs['nonce']
-            self.data = kwargs['data']
-            self.previous_hash = kwargs['previous_hash']
-            self.timestamp = kwargs['timestamp']
+        return BlockHeader(self.version, self.index, self.previous_hash, self.merkle_root, self.timestamp, self.nonce)
 
     @property
     def hash(self):
-        return sha256('{}{}{}{}{}'.format(self.index, self.nonce, self.previous_hash, self.data, self.timestamp).encode()).hexdigest()
+        if self._hash is None:
+            if self.version >= HEADER_VERSION:
+                hash_ = self.header().hash
+
+            else:
+                # hashed as it was when data was a list
+                hash_ = sha256('{}{}{}{}{}'.format(self.index, self.nonce, self.previous_hash, list(self.data), self.timestamp).encode()).hexdigest()
+
+            object.__setattr__(self, '_hash', hash_)
+
+        return self._hash
+
+    def to_dict(self):
+        __dict__ = {field: getattr(self, field) for field in BLOCK_FIELDS}
+        __dict__['data'] = [transaction.to_dict() for transaction in self.data]
+
+        return __dict__
 
     @classmethod
     def from_dict(cls, json_dict):
@@ -45,7 +194,8 @@ class Block:
                    data=[Transaction.from_dict(dict_)
                          for dict_ in json_dict['data']],
                    previous_hash=json_dict['previous_hash'],
-                   timestamp=json_dict['timestamp'])
+                   timestamp=json_dict['timestamp'],
+                   version=json_dict.get('version', 1))
 
     @classmethod
     def from_tuple(cls, data_tuple, data):
@@ -53,18 +203,30 @@ class Block:
                    nonce=data_tuple[2],
                    data=[Transaction.from_tuple(tuple_) for tuple_ in data],
                    previous_hash=data_tuple[3],
-                   timestamp=data_tuple[4])
+                   timestamp=data_tuple[4],
+                   version=data_tuple[5] if len(data_tuple) > 5 else 1)
 
     # Special class methods
 
+    def __setattr__(self, name, value):
+        raise AttributeError('Blocks are immutable, use with_nonce or construct a new one.')
+
+    def __delattr__(self, name):
+        raise AttributeError('Blocks are immutable.')
+
+    def __reduce__(self):
+        # pickled through the constructor, as the immutable attributes can't be set back one by one
+        return Block.from_dict, (self.to_dict(),)
+
     def __str__(self):
         return self.__repr__()
 
     def __repr__(self):
-        __dict__ = dict(self.__dict__)
+        __dict__ = self.to_dict()
+
+        if self.version >= HEADER_VERSION:
+            __dict__['merkle_root'] = self.merkle_root
 
-        __dict__['data'] = [
-            transaction.__dict__ for transaction in __dict__['data']]
         __dict__['hash'] = self.hash
 
         return json.dumps(__dict__)
@@ -76,4 +238,7 @@ class Block:
         return self.data[index]
 
     def __eq__(self, other):
-        return self.hash == other.hash
+        return isinstance(other, Block) and self.hash == other.hash
+
+    def __hash__(self):
+        return hash(self.hash)
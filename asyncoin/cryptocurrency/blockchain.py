@@ -1,90 +1,342 @@
 # -*- coding: utf-8 -*-
 
+import sys
 import time
 import statistics
+import collections
 import yaml
 import os
-import decimal
-import sqlite3
-import math
+from json import loads
 
 import asyncio
-import aiosqlite
 
 from asyncoin.cryptocurrency.transaction import Transaction
-from asyncoin.cryptocurrency.block import Block
-from asyncoin.cryptocurrency.keys import Verifier
+from asyncoin.cryptocurrency.block import Block, HEADER_VERSION
+from asyncoin.cryptocurrency.keys import BatchVerifier, verify_signature
+from asyncoin.cryptocurrency.mining import Miner, TemplateManager
+from asyncoin.cryptocurrency.mempool import Mempool
+from asyncoin.cryptocurrency.merkle import merkle_proof
+from asyncoin.cryptocurrency.consensus import next_consensus
+from asyncoin.cryptocurrency.validation import well_formed, well_formed_block, check_blocks
+from asyncoin.storage.backend import StorageError
+from asyncoin.storage.sqlite import SQLiteStorage
+from asyncoin.storage.flatfile import FlatFileStorage
+from asyncoin.utilities.cache import LRUCache
 
 with open(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'config/config.yaml')) as config_file:
     config = yaml.load(config_file.read())
 
-with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/startup.sql')) as script:
-    startup_script = script.read()
+# the most headers served at once
+MAX_HEADERS = 2000
 
-with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/block_template.sql')) as script:
-    block_template = script.read()
 
-with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/transaction_template.sql')) as script:
-    transaction_template = script.read()
+def slots_size(object_):
+    return sys.getsizeof(object_) + sum(sys.getsizeof(getattr(object_, slot, None)) for slot in object_.__slots__ if slot != 'data')
+
+
+def entry_size(entry):
+    """Estimate the memory a block cache entry takes up.
+    Args:
+        entry (list): the decoded block, None if it hasn't been, and its JSON.
+
+    Returns:
+        int: the size in bytes of the JSON, and of the block, its transactions and their fields once decoded.
+    """
+    block, serialized = entry
+    size = sys.getsizeof(serialized)
+
+    if block is not None:
+        size += slots_size(block) + sys.getsizeof(block.data) + sum(slots_size(transaction) for transaction in block.data)
+
+    return size
+
+storages = {'sqlite': SQLiteStorage,
+            'flatfile': FlatFileStorage}
 
 
 class Blockchain:
     """A Cryptocurrency blockchain."""
 
-    def __init__(self, genesis_address=None, config_=config, db='blockchain.db'):
+    # blocks closer than this to the tip aren't cached
+    cache_depth = 6
+
+    def __init__(self, genesis_address=None, config_=config, db='blockchain.db', verify_state=False, cache_blocks=4096, cache_bytes=64 * 1024 * 1024, storage='sqlite', snapshot=None, mining_workers=0,
+                 mempool_entries=50000, mempool_bytes=32 * 1024 * 1024, mempool_age=3 * 60 * 60, verify_workers=0,
+                 signature_cache=65536):
         """
         Args:
-            genesis_address (str, optional): address for genesis block reward.
+            genesis_address (str, optional): address for genesis block reward, a new chain is left empty (to be synced) without one.
             config (dict, optional): configuration for your blockchain.
+            verify_state (bool, optional): replay the chain to audit the stored consensus state.
+            cache_blocks (int, optional): the most blocks to keep in the block cache.
+            cache_bytes (int, optional): the most memory the block cache takes up, serialized and decoded blocks both counted.
+            storage (str, optional): the storage backend, 'sqlite' or 'flatfile'.
+            snapshot (dict, optional): a snapshot to bootstrap a new chain from, instead of from genesis.
+            mining_workers (int, optional): number of processes to mine with, 0 to mine on the event loop.
+            mempool_entries (int, optional): the most pending transactions to hold.
+            mempool_bytes (int, optional): the most memory pending transactions may take up.
+            mempool_age (float, optional): seconds after which a pending transaction is dropped.
+            verify_workers (int, optional): number of processes to check blocks' signatures with, 0 to check them on the event loop.
+            signature_cache (int, optional): the most valid signatures to remember, so they aren't checked again.
         """
-        self.pending = []
+        self.pending = Mempool(mempool_entries, mempool_bytes, mempool_age)
+
+        self.miner = Miner(mining_workers)
+        self.verifier = BatchVerifier(verify_workers)
+        self.templates = TemplateManager(self.block_template)
+
+        # decoded blocks and their serialized JSON, by index
+        self.block_cache = LRUCache(cache_blocks, cache_bytes)
+
+        # signatures found valid when their transactions were pending, by transaction hash
+        self.signatures = LRUCache(signature_cache)
+
+        # the chain tip, kept in memory so validation doesn't have to query for it
+        self.tip = None
+        self.chain_height = 0
+        self.timestamps = collections.deque(maxlen=11)
 
         self.db = db
+        self.storage = storages[storage](self.db)
 
         self.config_ = config_
 
-        if not os.path.exists(self.db):
-            self.config_ = config_
+        # only chains bootstrapped from a snapshot are missing the blocks before it
+        self.first_block = 0
+        self.snapshot_base = None
+
+        if snapshot is not None and not self.storage.exists():
+            self.import_snapshot(snapshot)
+
+        if not self.storage.exists():
+            self.storage.create(config_)
+
             self.reward = config_['INITIAL_REWARD']
             self.difficulty = config_['INITIAL_DIFFICULTY']
-            asyncio.get_event_loop().run_until_complete(
-                self.start_db(genesis_address))
+            self.epoch_timestamp = None
+
+            if genesis_address is not None:
+                loop = asyncio.get_event_loop()
+                loop.run_until_complete(self.start_db(genesis_address))
+                # connections are reopened by whichever loop uses them next
+                loop.run_until_complete(self.storage.close())
+
+        else:
+            stored_config, state = self.storage.load()
+
+            if stored_config is None:
+                # an empty chain that's about to be synced from another node
+                self.storage.save_config(self.config_)
+
+            else:
+                self.config_ = stored_config
+
+            base = self.storage.load_base()
+
+            if base is not None:
+                self.first_block, self.snapshot_base = base[0], base[1:]
+
+            if state is None or verify_state:
+                replayed = self.replay_consensus(self.storage.headers(), self.snapshot_base)
+
+                if state is None:
+                    # first load since the consensus state table was added
+                    self.storage.save_state(replayed)
+                    state = replayed
+
+                elif state != replayed:
+                    raise ValueError('Stored consensus state {} does not match the replayed chain {}.'.format(
+                        state, replayed))
+
+            self.chain_height, self.difficulty, self.reward, self.epoch_timestamp, _ = state
+
+            if self.chain_height:
+                self.tip, timestamps = self.storage.load_tip(self.chain_height, self.timestamps.maxlen)
+                self.timestamps.extend(timestamps)
+
+    def next_consensus(self, index, timestamp, difficulty, reward, epoch_timestamp):
+        """Work out the consensus parameters that follow a block, see consensus.next_consensus."""
+        return next_consensus(self.config_, index, timestamp, difficulty, reward, epoch_timestamp)
+
+    def replay_consensus(self, blocks, base=None):
+        """Derive the consensus state by replaying a chain from genesis, or from the snapshot it was bootstrapped from.
+        Args:
+            blocks (iterable): (index, hash, timestamp) of every block, in order.
+            base (tuple, optional): the snapshot's height, difficulty, reward, epoch timestamp and tip hash.
+
+        Returns:
+            tuple: the height, difficulty, reward, epoch timestamp and tip hash.
+        """
+        if base is not None:
+            height, difficulty, reward, epoch_timestamp, tip_hash = base
 
         else:
-            conn = sqlite3.connect(self.db)
-            c = conn.cursor()
-            config_ = c.execute('SELECT * FROM "CONFIG"').fetchone()
-            self.config_ = {'REWARD_HALVING': config_[0],
-                            'TIME_TARGET': config_[1],
-                            'DIFFICULTY_ADJUST': config_[2],
-                            'INITIAL_REWARD': config_[3],
-                            'INITIAL_DIFFICULTY': config_[4]}
-
-            self.reward = self.config_['INITIAL_REWARD'] / math.floor(pow(2, c.execute(
-                'SELECT COUNT(*) FROM BLOCKS').fetchone()[0] / self.config_['REWARD_HALVING']))
-            self.difficulty = self.config_['INITIAL_DIFFICULTY']
-            for x in range(math.floor(c.execute('SELECT COUNT(*) FROM BLOCKS').fetchone()[0] / self.config_['DIFFICULTY_ADJUST'])):
-                beginning_time = c.execute('SELECT TIMESTAMP FROM "BLOCKS" WHERE NUMBER = ?', (
-                    x * self.config_['DIFFICULTY_ADJUST'],)).fetchone()[0]
-
-                time_delta = c.execute('SELECT TIMESTAMP FROM "BLOCKS" WHERE NUMBER = ?', (x * self.config_[
-                                       'DIFFICULTY_ADJUST'] + self.config_['DIFFICULTY_ADJUST'] - 1,)).fetchone()[0] - beginning_time
-                if time_delta / self.config_['DIFFICULTY_ADJUST'] < self.config_['TIME_TARGET']:
-                    self.difficulty += 1
-
-                elif self.difficulty != 1:
-                    self.difficulty -= 1
-
-            conn.close()
+            height, tip_hash = 0, None
+            difficulty, reward, epoch_timestamp = self.config_['INITIAL_DIFFICULTY'], self.config_['INITIAL_REWARD'], None
+
+        for index, hash_, timestamp in blocks:
+            if index < height:
+                # already accounted for by the snapshot
+                continue
+
+            difficulty, reward, epoch_timestamp = self.next_consensus(
+                index, timestamp, difficulty, reward, epoch_timestamp)
+            height, tip_hash = index + 1, hash_
+
+        return height, difficulty, reward, epoch_timestamp, tip_hash
+
+    def import_snapshot(self, snapshot):
+        """Set up a new chain from a snapshot. The account state can't be checked without the
+        history before it, so snapshots should only be taken from trusted nodes, but the blocks
+        it carries have to link up to the tip it claims.
+        Args:
+            snapshot (dict): the snapshot, see self.snapshot.
+        """
+        blocks = [Block.from_dict(block) for block in snapshot['blocks']]
+
+        if not blocks or blocks[-1].hash != snapshot['tip_hash'] or blocks[-1].index != snapshot['height'] - 1:
+            raise ValueError('The snapshot\'s blocks don\'t end at its tip.')
+
+        for previous, block in zip(blocks, blocks[1:]):
+            if block.index != previous.index + 1 or block.previous_hash != previous.hash:
+                raise ValueError('The snapshot\'s blocks don\'t form a chain.')
+
+        self.storage.import_snapshot(snapshot, blocks)
+
+    async def snapshot(self, height=None):
+        """Capture the state of the chain at a height, for new nodes to bootstrap from.
+        The account state is read at the stored tip and rolled back block by block, so older heights take longer,
+        but it's read from a snapshot of the storage so blocks keep being added meanwhile.
+        Args:
+            height (int, optional): the height to capture, the current height by default.
+
+        Returns:
+            dict: the configuration, the consensus state and account states at the height,
+            and the blocks needed to check the timestamps of the blocks after it.
+        """
+        state, accounts = await self.storage.read_state()
+        tip_height = state[0]
+        height = tip_height if height is None else height
+
+        if not max(self.snapshot_base[0] if self.snapshot_base is not None else 0, 1) <= height <= tip_height:
+            raise IndexError
+
+        accounts = {address: [balance, nonce] for address, balance, nonce in accounts}
+
+        # blocks are only ever appended, so those up to the state that was read can be read after it
+        for end in range(tip_height, height, -1000):
+            for block in reversed(await self.storage.read_blocks(max(end - 1000, height), end - 1)):
+                for t in reversed(block.data):
+                    accounts[t.to][0] -= t.amount
+                    accounts[t.from_][0] += t.amount + t.fee
+                    accounts[t.from_][1] -= 1
+
+        blocks = await self.storage.read_blocks(max(height - self.timestamps.maxlen, self.first_block), height - 1)
+
+        if height < tip_height:
+            state = await asyncio.get_event_loop().run_in_executor(
+                None, self.replay_consensus, self.storage.headers(height), self.snapshot_base)
+
+        return {'config': self.config_,
+                'height': state[0],
+                'difficulty': state[1],
+                'reward': state[2],
+                'epoch_timestamp': state[3],
+                'tip_hash': state[4],
+                'blocks': [loads(repr(block)) for block in blocks],
+                'accounts': sorted([address, balance, nonce] for address, (balance, nonce) in accounts.items() if balance or nonce)}
+
+    async def close(self):
+        """Close the blockchain's storage and stop any mining and verification processes."""
+        self.miner.close()
+        self.verifier.close()
+        await self.storage.close()
 
     async def start_db(self, genesis_address):
-        async with aiosqlite.connect(self.db) as db:
-            await db.executescript(startup_script)
-            block = self.mine_genesis_block(genesis_address)
-            await db.execute(block_template, (block.index, block.hash, block.nonce, block.previous_hash, block.timestamp))
-            await db.execute(transaction_template, (block.hash, block.data[0].hash, block.data[0].to, block.data[0].from_, block.data[0].amount, block.data[0].timestamp, block.data[0].signature, block.data[0].nonce, block.data[0].fee))
-            await db.execute('INSERT INTO "CONFIG" VALUES (?, ?, ?, ?, ?)', (self.config_['REWARD_HALVING'], self.config_['TIME_TARGET'], self.config_['DIFFICULTY_ADJUST'], self.config_['INITIAL_REWARD'], self.config_['INITIAL_DIFFICULTY']))
-            await db.commit()
+        await self.add_genesis_block(self.mine_genesis_block(genesis_address))
+
+    async def add_genesis_block(self, block):
+        """Add the first block to an empty chain if it's valid.
+        Args:
+            block (Block): the genesis block.
+
+        Returns:
+            bool: whether the block was added.
+        """
+        if self.tip is not None or not self.verify_genesis_block(block):
+            return False
+
+        consensus = self.next_consensus(block.index, block.timestamp, self.difficulty, self.reward, self.epoch_timestamp)
+
+        async with self.storage.write() as txn:
+            await txn.write_blocks([block], consensus, await self.execute_block(txn, block))
+
+        self.update_tip(block, consensus)
+
+        return True
+
+    def update_tip(self, block, consensus):
+        """Move the in-memory chain tip to a block that has just been written.
+        Args:
+            block (Block): the new last block.
+            consensus (tuple): the difficulty, reward and epoch timestamp following the block.
+        """
+        self.tip = block
+        self.chain_height = block.index + 1
+        self.timestamps.append(block.timestamp)
+        self.difficulty, self.reward, self.epoch_timestamp = consensus
+
+        # whatever was being mined now builds on a stale tip
+        self.miner.cancel()
+        self.templates.invalidate('tip')
+
+    async def execute_block(self, txn, block, accounts=None, verified=None):
+        """Run a block's transactions against the account state without writing anything.
+        Args:
+            txn: open storage write transaction to read the account state from.
+            block (Block): the block to execute.
+            accounts (dict, optional): account states that take precedence over the database's.
+            verified (dict, optional): the signatures already found valid, by transaction hash, see self.check_transaction.
+
+        Returns:
+            dict: the new [balance, nonce] of every account the block touches.
+            None if any of the block's transactions is invalid.
+        """
+        changes = {}
+
+        async def account(address):
+            if address not in changes:
+                if accounts is not None and address in accounts:
+                    changes[address] = list(accounts[address])
+
+                else:
+                    account = await txn.get_account(address)
+                    changes[address] = list(account) if account is not None else [0, 0]
+
+            return changes[address]
+
+        for t in block[1:]:
+            sender = await account(t.from_)
+
+            if not (self.check_transaction(t, verified) and sender[0] >= t.amount + t.fee and sender[1] == t.nonce):
+                return None
+
+            sender[0] -= t.amount + t.fee
+            sender[1] += 1
+            (await account(t.to))[0] += t.amount
+
+        # the reward isn't spendable until the block after it
+        reward = block[0]
+        (await account(reward.to))[0] += reward.amount
+        network = await account(reward.from_)
+        network[0] -= reward.amount + reward.fee
+        network[1] += 1
+
+        return changes
+
+    async def rebuild_accounts(self):
+        """Recompute the account state from the full transaction history."""
+        await self.storage.rebuild_accounts()
 
     def mine_genesis_block(self, genesis_address):
         """Mine the genesis block.
@@ -98,17 +350,18 @@ class Blockchain:
         reward_transaction = Transaction(
             to=genesis_address, from_='Network', amount=self.reward, nonce=0, fee=0)
         block = Block(index=0, nonce=n, data=[
-                      reward_transaction], previous_hash=0, timestamp=time.time())
+                      reward_transaction], previous_hash=0, timestamp=time.time(), version=self.block_version(0))
 
         while not block.hash.startswith(self.difficulty * '1'):
             n += 1
             block = Block(index=0, nonce=n, data=[
-                          reward_transaction], previous_hash=0, timestamp=time.time())
+                          reward_transaction], previous_hash=0, timestamp=time.time(), version=self.block_version(0))
 
         return block
 
     async def mine_block(self, reward_address, lowest_fee=1):
-        """Mine a block.
+        """Mine a block. The nonce search is handed to self.miner a round at a time, and between rounds
+        the template is only rebuilt if the tip or the pending transactions have changed.
         Args:
             reward_address (str): the address to send the block's rewards to.
             lowest_fee (int, optional): the lowest fee to accept.
@@ -116,27 +369,65 @@ class Blockchain:
         Returns:
             Block: the mined block.
         """
-        n = 0
+        start, started = 0, time.time()
+
         while True:
-            last_block = await self.last_block()
-            await asyncio.sleep(0)
+            self.miner.reset()
 
-            acceptable_transactions = []
+            difficulty = self.difficulty
+            block, rebuilt = await self.templates.get(reward_address, lowest_fee)
 
-            for t in sorted(self.pending, key=lambda t: t.nonce):
-                if t.fee >= lowest_fee and t.nonce == await self.get_account_nonce(t.from_) + len([tr for tr in acceptable_transactions if tr.from_ == t.from_]) and t.amount + t.fee >= await self.get_balance(t.from_) - sum([tr.fee + tr.amount for tr in acceptable_transactions if tr.from_ == t.from_]):
-                    acceptable_transactions.append(t)
+            if rebuilt:
+                start = 0
 
-            reward_transaction = Transaction(to=reward_address, from_='Network', amount=self.reward + sum(
-                transaction.fee for transaction in acceptable_transactions), nonce=0, fee=0)
+            nonce, start = await self.miner.search(block, difficulty, start)
 
-            block = Block(index=await self.height(), nonce=n, data=[
-                          reward_transaction] + acceptable_transactions, previous_hash=last_block.hash, timestamp=time.time())
+            if nonce is not None:
+                self.miner.solved(time.time() - started)
+                return block.with_nonce(nonce)
 
-            if block.hash.startswith(self.difficulty * '1'):
-                return block
+    async def block_template(self, reward_address, lowest_fee=1):
+        """Assemble the next block from the pending transactions that can go in it, without a proof of work.
+        Args:
+            reward_address (str): the address to send the block's rewards to.
+            lowest_fee (int, optional): the lowest fee to accept.
 
-            n += 1
+        Returns:
+            Block: the unsolved block.
+        """
+        last_block = await self.last_block()
+
+        self.pending.expire()
+
+        # each sender's account is looked up once, however many transactions they have pending
+        accounts = {}
+
+        for sender in list(self.pending.senders):
+            account = await self.storage.get_account(sender)
+            accounts[sender] = account if account is not None else (0, 0)
+
+        acceptable_transactions = self.pending.select(accounts, lowest_fee)
+
+        reward_transaction = Transaction(to=reward_address, from_='Network', amount=self.reward + sum(
+            transaction.fee for transaction in acceptable_transactions), nonce=0, fee=0)
+
+        index = await self.height()
+
+        return Block(index=index, nonce=0, data=[
+                     reward_transaction] + acceptable_transactions, previous_hash=last_block.hash, timestamp=time.time(),
+                     version=self.block_version(index))
+
+    def block_version(self, index):
+        """Get the format a block has to be in, which changes at the chain's header activation height.
+        Args:
+            index (int): index of the block.
+
+        Returns:
+            int: the block version.
+        """
+        activation = self.config_.get('HEADER_ACTIVATION')
+
+        return HEADER_VERSION if activation is not None and index >= activation else 1
 
     async def verify_block(self, block, syncing=False):
         """Verify a block.
@@ -148,17 +439,56 @@ class Blockchain:
             True if the block is valid.
             False if the block is invalid.
         """
-        last_block = await self.last_block()
-        difficulty_check = block.hash.startswith(self.difficulty * '1')
+        return self.check_block(block, self.tip, self.difficulty, self.reward, self.timestamps, syncing)
+
+    def check_block(self, block, last_block, difficulty, reward, timestamps, syncing=False):
+        """Verify a block against a given chain state, rather than the current one.
+        Args:
+            block (Block): block to verify.
+            last_block (Block): the block it should follow.
+            difficulty (int): the difficulty it should be mined at.
+            reward (int): the block reward it may claim.
+            timestamps (iterable): timestamps of the last 11 blocks.
+            syncing (bool, optional): whether or not to check the timestamp.
+
+        Returns:
+            True if the block is valid.
+            False if the block is invalid.
+        """
+        difficulty_check = block.hash.startswith(difficulty * '1')
         hash_check = block.previous_hash == last_block.hash
-        index_check = block.index == await self.height()
-        reward_check = block[0].amount <= self.reward + \
+        index_check = block.index == last_block.index + 1
+        version_check = block.version == self.block_version(block.index)
+        # a malformed transaction's fee can't be summed, and would fail the block further on anyway
+        reward_check = well_formed_block(block) and block[0].amount <= reward + \
             sum(transaction.fee for transaction in block[1:]) and block[0].from_ == 'Network' and len(
                 block[0].to) == 96
-        timestamp_check = block.timestamp > await self.lowest_acceptable_timestamp() and block.timestamp < time.time() + \
+        timestamp_check = block.timestamp > statistics.median(timestamps) and block.timestamp < time.time() + \
             7200
 
-        return all((difficulty_check, index_check, reward_check, hash_check, timestamp_check)) if not syncing else all((difficulty_check, index_check, reward_check, hash_check))
+        return all((difficulty_check, index_check, version_check, reward_check, hash_check, timestamp_check)) if not syncing else all((difficulty_check, index_check, version_check, reward_check, hash_check))
+
+    def linked_blocks(self, blocks, syncing=False):
+        """Run self.check_block over a run of blocks, each following on from the one before it, from the current tip.
+        Args:
+            blocks (list): the blocks to check, in order.
+            syncing (bool, optional): whether or not to check timestamps.
+
+        Returns:
+            int: how many of the blocks, from the first, passed.
+        """
+        tip, consensus = self.tip, (self.difficulty, self.reward, self.epoch_timestamp)
+        timestamps = collections.deque(self.timestamps, maxlen=self.timestamps.maxlen)
+
+        for passed, block in enumerate(blocks):
+            if not self.check_block(block, tip, consensus[0], consensus[1], timestamps, syncing):
+                return passed
+
+            consensus = self.next_consensus(block.index, block.timestamp, *consensus)
+            timestamps.append(block.timestamp)
+            tip = block
+
+        return len(blocks)
 
     def verify_genesis_block(self, genesis_block):
         """Verify a genesis block.
@@ -169,7 +499,44 @@ class Blockchain:
             True if the block is valid.
             False if the block is invalid.
         """
-        return genesis_block.hash.startswith(self.difficulty * '1') and genesis_block.index == 0 and len(genesis_block.data) == 1 and genesis_block[0].amount == self.reward
+        return genesis_block.hash.startswith(self.difficulty * '1') and genesis_block.index == 0 and genesis_block.version == self.block_version(0) and len(genesis_block.data) == 1 and genesis_block[0].amount == self.reward
+
+    def check_transaction(self, transaction, verified=None):
+        """Check everything about a transaction that doesn't depend on the account state.
+        Args:
+            transaction (Transaction): transaction to check.
+            verified (dict, optional): the signatures already found valid, by transaction hash,
+                if given the transaction's signature is looked up rather than checked.
+
+        Returns:
+            True if the transaction is well formed and correctly signed.
+            False if it isn't.
+        """
+        if not well_formed(transaction):
+            return False
+
+        if verified is not None:
+            return verified.get(transaction.hash) == transaction.signature
+
+        return self.check_signature(transaction)
+
+    def check_signature(self, transaction):
+        """Check a transaction's signature, unless it's already been found valid.
+        Args:
+            transaction (Transaction): transaction to check.
+
+        Returns:
+            bool: whether the signature is valid.
+        """
+        # the hash doesn't cover the signature, so it's the signature that's remembered
+        if self.signatures.get(transaction.hash) == transaction.signature:
+            return True
+
+        if verify_signature(transaction.from_, transaction.signature, transaction.hash):
+            self.signatures.put(transaction.hash, transaction.signature)
+            return True
+
+        return False
 
     async def verify_transaction(self, transaction):
         """Verify a transaction.
@@ -180,144 +547,349 @@ class Blockchain:
             True if the transaction is valid.
             False if the transaction is invalid.
         """
-        signature_check = Verifier(transaction.from_).verify(transaction)
-        balance_check = await self.get_balance(
+        return self.check_transaction(transaction) and await self.get_balance(
             transaction.from_) >= transaction.amount + transaction.fee
-        decimal_check = decimal.Decimal(transaction.amount).as_tuple(
-        ).exponent < 19 and decimal.Decimal(transaction.fee).as_tuple().exponent < 19
-        address_check = len(transaction.to) == 96 and len(
-            transaction.from_) == 96
-        positive_check = transaction.amount > 0 and transaction.fee > 0
-        self_check = transaction.from_ != transaction.to
-
-        return all((signature_check, balance_check, decimal_check, address_check, positive_check, self_check))
 
     async def height(self):
-        async with aiosqlite.connect(self.db) as db:
-            async with db.execute('SELECT COUNT(*) FROM BLOCKS') as cursor:
-                result = await cursor.fetchone()
-                return result[0]
+        return self.chain_height
 
     async def last_block(self):
-        return await self.block_from_index(-1)
+        return self.tip
 
-    async def block_from_index(self, index):
-        if index > await self.height():
+    def normalize_range(self, start, end):
+        start = start if start >= 0 else self.chain_height + start
+        end = end if end >= 0 else self.chain_height + end
+
+        if end > self.chain_height - 1 or start < self.first_block or start > end:
             raise IndexError
 
-        if index >= 0:
-            async with aiosqlite.connect(self.db) as db:
-                async with db.execute('SELECT * FROM "BLOCKS" WHERE "NUMBER" = ?', (str(index),)) as cursor:
-                    block = await cursor.fetchone()
+        return start, end
 
-                async with db.execute('SELECT * FROM "TRANSACTIONS" WHERE "BLOCKHASH" = ?', (block[1],)) as cursor:
-                    transactions = await cursor.fetchall()
+    async def block_from_index(self, index):
+        index, _ = self.normalize_range(index, index)
+        return (await self.block_entries(index, index))[0][0]
 
-                return Block.from_tuple(block, transactions)
+    async def blocks_from_range(self, start, end):
+        return [block for block, _ in await self.block_entries(*self.normalize_range(start, end))]
 
-        else:
-            return await self.block_from_index(await self.height() + index)
+    async def block_json(self, index):
+        """Gets the JSON serialization of a block.
+        Args:
+            index (int): the index of the block.
 
-    async def blocks_from_range(self, start, end):
-        height = await self.height()
-        start = start if start >= 0 else height + start
-        end = end if end >= 0 else height + end
+        Returns:
+            bytes: the block as JSON.
+        """
+        index, _ = self.normalize_range(index, index)
+        return (await self.block_entries(index, index, decode=False))[0][1]
+
+    async def blocks_json(self, start, end):
+        """Gets the JSON serialization of a range of blocks.
+        Args:
+            start (int): index of the first block.
+            end (int): index of the last block.
+
+        Returns:
+            bytes: a JSON array of the blocks.
+        """
+        return b'[' + b', '.join(serialized for _, serialized in await self.block_entries(*self.normalize_range(start, end), decode=False)) + b']'
 
-        if end > height - 1 or start > height - 1 or start > end:
+    async def headers_json(self, start, end):
+        """Gets the JSON serialization of a range of block headers, from their stored fields, without reading the blocks.
+        Args:
+            start (int): index of the first block.
+            end (int): index of the last block, only the first MAX_HEADERS of the range are served.
+
+        Returns:
+            bytes: a JSON array of the headers.
+        """
+        start, end = self.normalize_range(start, end)
+        end = min(end, start + MAX_HEADERS - 1)
+
+        # blocks from before the header activation don't have one
+        if self.block_version(start) < HEADER_VERSION:
             raise IndexError
 
-        async with aiosqlite.connect(self.db) as db:
-            async with db.execute('SELECT * FROM "BLOCKS" WHERE "NUMBER" BETWEEN ? and ?', (start, end)) as cursor:
-                blocks = await cursor.fetchall()
-            hashes = tuple(block[1] for block in blocks)
-            if len(hashes) == 1:
-                async with db.execute('SELECT * FROM "TRANSACTIONS" WHERE "BLOCKHASH" = ?', (hashes[0],)) as cursor:
-                    return [Block.from_tuple(blocks[0], await cursor.fetchall())]
+        return b'[' + b', '.join(repr(header).encode() for header in await self.storage.read_headers(start, end)) + b']'
+
+    async def find_transaction(self, hash_):
+        """Look a transaction up by its hash, among the pending transactions and then in the chain.
+        Args:
+            hash_ (str): hexadecimal hash of the transaction.
+
+        Returns:
+            Transaction: the transaction, None if it isn't pending or in a stored block.
+        """
+        transaction = self.pending.get(hash_)
+
+        if transaction is not None:
+            return transaction
+
+        index = await self.storage.transaction_block(hash_)
+
+        if index is None or index < self.first_block:
+            return None
+
+        for transaction in await self.block_from_index(index):
+            if transaction.hash == hash_:
+                return transaction
+
+    async def transaction_proof(self, hash_):
+        """Prove that a transaction is in the chain, for clients that only keep headers.
+        Args:
+            hash_ (str): hexadecimal hash of the transaction.
+
+        Returns:
+            dict: the header of the block the transaction is in, the transaction's signature and position in the block,
+            and the Merkle proof of its id. None if the transaction isn't in a block with a header.
+        """
+        index = await self.storage.transaction_block(hash_)
+
+        if index is None or index < self.first_block:
+            return None
+
+        block = await self.block_from_index(index)
+
+        if block.version < HEADER_VERSION:
+            return None
+
+        position = [transaction.hash for transaction in block].index(hash_)
+
+        return {'header': loads(repr(block.header())),
+                'signature': block[position].signature,
+                'position': position,
+                'proof': merkle_proof([transaction.txid for transaction in block], position)}
+
+    async def block_entries(self, start, end, decode=True):
+        """Gets decoded and serialized blocks, from the block cache where possible.
+        Blocks are immutable once they're buried, so only the tip range is kept out of the cache.
+        Args:
+            start (int): index of the first block.
+            end (int): index of the last block.
+            decode (bool, optional): whether the blocks are needed as Block objects, or only as JSON.
+
+        Returns:
+            list: [Block, bytes] for each block in the range, the Block is None if it wasn't needed or cached.
+        """
+        entries = [self.block_cache.get(index) for index in range(start, end + 1)]
+        missing = [start + offset for offset, entry in enumerate(entries) if entry is None]
+
+        if missing:
+            first, last = missing[0], missing[-1]
+
+            if first == last == self.chain_height - 1:
+                fetched = [[self.tip, repr(self.tip).encode()]]
+
+            elif decode:
+                fetched = [[block, repr(block).encode()] for block in await self.storage.read_blocks(first, last)]
 
             else:
-                async with db.execute('SELECT * FROM "TRANSACTIONS" WHERE "BLOCKHASH" IN ({0}?)'.format('?,' * (len(blocks) - 1)), tuple(block[1] for block in blocks)) as cursor:
-                    transactions = await cursor.fetchall()
+                fetched = [[None, serialized] for serialized in await self.storage.read_json(first, last)]
+
+            for index, entry in enumerate(fetched, first):
+                entries[index - start] = entry
 
-                return [Block.from_tuple(block, tuple(transaction for transaction in transactions if transaction[0] == block[1])) for block in blocks]
+                if index < self.chain_height - self.cache_depth:
+                    self.block_cache.put(index, entry, entry_size(entry))
+
+        if decode:
+            for index, entry in enumerate(entries, start):
+                if entry[0] is None:
+                    entry[0] = Block.from_dict(loads(entry[1].decode()))
+
+                    # the decoded block is kept along with its JSON, so a cached entry grows
+                    if index in self.block_cache:
+                        self.block_cache.put(index, entry, entry_size(entry))
+
+        return entries
 
     async def add_block(self, block, syncing=False):
-        """Wrapper around self.verify_block that adds a block to the blockchain if it's valid."""
-        if await self.verify_block(block, syncing):
-            async with aiosqlite.connect(self.db) as db:
-                await db.execute(block_template, (block.index, block.hash, block.nonce, block.previous_hash, block.timestamp))
-                await db.execute(transaction_template, (block.hash, block[0].hash, block[0].to, block[0].from_, block[0].amount, block[0].timestamp, block[0].signature, block[0].nonce, block[0].fee))
+        """Wrapper around self.verify_block that adds a block to the blockchain if it's valid.
+        The block and everything it changes are written in a single database transaction.
+        """
+        return await self.add_batch([block], syncing) == 1
 
-                # step through transaction execution
-                for t in block[1:]:
-                    if await self.verify_transaction(t) and t.nonce == await self.get_account_nonce(t.from_):
-                        await db.execute(transaction_template, (block.hash, t.hash, t.to, t.from_, t.amount, t.timestamp, t.signature, t.nonce, t.fee))
+    async def check_blocks(self, blocks):
+        """Run the checks that don't depend on the chain state over a run of blocks, see validation.check_blocks,
+        in chunks spread across the verification processes.
+        Args:
+            blocks (list): the blocks to check, in order.
 
-                    else:
-                        # revert block
-                        await db.execute('DELETE FROM "BLOCKS" WHERE "HASH" = ?', (block.hash,))
-                        await db.execute('DELETE FROM "TRANSACTIONS" WHERE "BLOCKHASH" = ?', (block.hash,))
-                        return False
+        Returns:
+            tuple:
+                int: how many of the blocks, from the first, passed.
+                dict: their transactions' signatures, by transaction hash, to pass to self.add_blocks.
+        """
+        if self.verifier.workers:
+            # chunks of about as many transactions as the verifier sends a worker at once, but at least a block
+            transactions = sum(len(block.data) - 1 for block in blocks)
+            size = max(1, len(blocks) * self.verifier.chunk_size // max(transactions, 1))
 
-                for transaction in block[1:]:
-                    for t in self.pending:
-                        if t.hash == transaction.hash:
-                            self.pending.remove(t)
+        else:
+            size = max(len(blocks), 1)
 
-                await db.commit()
+        chunks = [blocks[start:start + size] for start in range(0, len(blocks), size)]
+        results = await asyncio.gather(*[self.verifier.run(check_blocks, chunk, blocks[start - 1].hash if start else None)
+                                         for start, chunk in zip(range(0, len(blocks), size), chunks)])
 
-            height = await self.height()
+        passed, verified = 0, {}
 
-            if height % self.config_['DIFFICULTY_ADJUST'] == 0:
-                async with aiosqlite.connect(self.db) as db:
-                    async with db.execute('SELECT TIMESTAMP FROM "BLOCKS" WHERE NUMBER = ?', (height - self.config_['DIFFICULTY_ADJUST'],)) as cursor:
-                        beginning_time = await cursor.fetchone()
-                        time_delta = block.timestamp - beginning_time[0]
+        for chunk, (chunk_passed, signatures) in zip(chunks, results):
+            passed += chunk_passed
+            verified.update(signatures)
 
-                    if time_delta / self.config_['DIFFICULTY_ADJUST'] < self.config_['TIME_TARGET']:
-                        self.difficulty += 1
+            if chunk_passed < len(chunk):
+                break
 
-                    elif self.difficulty != 1:
-                        self.difficulty -= 1
+        return passed, verified
 
-            if height % self.config_['REWARD_HALVING'] == 0:
-                self.reward = self.reward / 2
+    async def add_blocks(self, blocks, syncing=True, batch_size=500, progress=None, verified=None):
+        """Add a contiguous run of blocks, e.g. while syncing, validating them against running in-memory state.
+        Args:
+            blocks (list): the blocks to add, in order.
+            syncing (bool, optional): whether or not to check timestamps.
+            batch_size (int, optional): the most blocks to write in one database transaction.
+            progress (callable, optional): called with the number of blocks added so far after each batch.
+            verified (dict, optional): the blocks' valid signatures, by transaction hash, if they've been through self.check_blocks.
 
-            return True
+        Returns:
+            int: the number of blocks added, which stops short at the first invalid block.
+        """
+        added = 0
 
-        return False
+        for start in range(0, len(blocks), batch_size):
+            batch = blocks[start:start + batch_size]
+            batch_added = await self.add_batch(batch, syncing, verified)
+            added += batch_added
+
+            if progress is not None:
+                progress(added)
+
+            if batch_added < len(batch):
+                break
+
+        return added
+
+    async def add_batch(self, blocks, syncing=False, verified=None):
+        """Validate a run of blocks against running state and write the valid prefix in a single database transaction.
+        Args:
+            blocks (list): the blocks to add, in order.
+            syncing (bool, optional): whether or not to check timestamps.
+            verified (dict, optional): the blocks' valid signatures, by transaction hash, if they've already been checked.
+
+        Returns:
+            int: the number of blocks added.
+        """
+        applied = []
+
+        # the proof of work and linkage are cheap to check, so blocks that fail them cost no signature checks
+        blocks = blocks[:self.linked_blocks(blocks, syncing)]
+
+        if not blocks:
+            return 0
+
+        if verified is None:
+            # signatures don't depend on the chain state, so they're all checked up front, in parallel,
+            # apart from those of transactions that were already checked when they were pending
+            verified, unchecked = {}, []
+
+            for t in (t for block in blocks for t in block[1:]):
+                if self.signatures.get(t.hash) == t.signature:
+                    verified[t.hash] = t.signature
+
+                else:
+                    unchecked.append(t)
+
+            verified.update((t.hash, t.signature) for t, valid in zip(unchecked, await self.verifier.verify(unchecked)) if valid)
+
+        try:
+            # holding the writer for the whole check means concurrent blocks are applied one at a time
+            async with self.storage.write() as txn:
+                tip, consensus = self.tip, (self.difficulty, self.reward, self.epoch_timestamp)
+                timestamps = collections.deque(self.timestamps, maxlen=self.timestamps.maxlen)
+                accounts = {}
+
+                for block in blocks:
+                    if not self.check_block(block, tip, consensus[0], consensus[1], timestamps, syncing):
+                        break
+
+                    changes = await self.execute_block(txn, block, accounts, verified)
+
+                    if changes is None:
+                        break
+
+                    accounts.update(changes)
+                    consensus = self.next_consensus(block.index, block.timestamp, *consensus)
+                    timestamps.append(block.timestamp)
+                    tip = block
+
+                    applied.append((block, consensus))
+
+                if applied:
+                    await txn.write_blocks([block for block, _ in applied], consensus, accounts)
+
+        except StorageError:
+            # e.g. a transaction that's already in the chain, everything has been rolled back
+            return 0
+
+        for block, consensus in applied:
+            self.update_tip(block, consensus)
+
+        included = [transaction for block, _ in applied for transaction in block[1:]]
+        self.pending.remove(included)
+        self.pending.prune(accounts)
+
+        # a transaction can only go in the chain once, so there's no need to remember its signature any more
+        for transaction in included:
+            self.signatures.discard(transaction.hash)
+
+        return len(applied)
 
     async def add_transaction(self, transaction):
         """Wrapper around self.add_transaction that add a transactions to the mempool if it's valid."""
         if await self.verify_transaction(transaction):
-            if transaction.hash not in [t.hash for t in self.pending]:
-                self.pending.append(transaction)
+            if transaction not in self.pending:
+                if not self.pending.add(transaction):
+                    # outbid by a pending transaction with the same nonce
+                    return False
+
+                self.templates.transaction_added(transaction)
+
             return True
 
         return False
 
-    async def get_balance(self, address):
-        """Gets the balance of an address.
+    async def add_transactions(self, transactions):
+        """Add many transactions to the mempool, checking their signatures all at once, in parallel, first.
         Args:
-            address (str): the address to get balance for.
+            transactions (list): the transactions to add.
 
         Returns:
-            int: the amount of units of cryptocurrency the address owns.
+            list: whether each transaction is pending, see self.add_transaction.
         """
-        async with aiosqlite.connect(self.db) as db:
-            async with db.execute('SELECT * FROM "TRANSACTIONS" WHERE "SENDER" = ? OR "RECEIVER" = ?', (address, address)) as cursor:
-                transactions = [Transaction.from_tuple(transaction) for transaction in await cursor.fetchall()]
+        unchecked = [index for index, t in enumerate(transactions) if well_formed(t) and self.signatures.get(t.hash) != t.signature]
+        verdicts = await self.verifier.verify([transactions[index] for index in unchecked])
+        rejected = set()
 
-        balance = 0
+        for index, valid in zip(unchecked, verdicts):
+            if valid:
+                self.signatures.put(transactions[index].hash, transactions[index].signature)
 
-        for transaction in transactions:
-            if transaction.to == address:
-                balance += transaction.amount
+            else:
+                rejected.add(index)
+
+        return [index not in rejected and await self.add_transaction(t) for index, t in enumerate(transactions)]
 
-            if transaction.from_ == address:
-                balance -= transaction.amount
-                balance -= transaction.fee
+    async def get_balance(self, address):
+        """Gets the balance of an address.
+        Args:
+            address (str): the address to get balance for.
 
-        return balance
+        Returns:
+            int: the amount of units of cryptocurrency the address owns.
+        """
+        account = await self.storage.get_account(address)
+        return account[0] if account is not None else 0
 
     async def get_account_nonce(self, address):
         """Gets the nonce of an address.
@@ -327,10 +899,8 @@ class Blockchain:
         Returns:
             int: the account's nonce.
         """
-        async with aiosqlite.connect(self.db) as db:
-            async with db.execute('SELECT COUNT(*) from "TRANSACTIONS" WHERE "SENDER" = ?', (address,)) as cursor:
-                result = await cursor.fetchone()
-                return result[0]
+        account = await self.storage.get_account(address)
+        return account[1] if account is not None else 0
 
     async def lowest_acceptable_timestamp(self):
         """Gets the median timestamp of past 11 blocks.
@@ -338,8 +908,4 @@ class Blockchain:
         Returns:
             int: unix timestamp (lowest acceptable timestamp for new blocks)
         """
-        height = await self.height()
-        if height < 11:
-            return statistics.median([block.timestamp for block in await self.blocks_from_range(0, height - 1)])
-
-        return statistics.median([block.timestamp for block in await self.blocks_from_range(-11, height - 1)])
+        return statistics.median(self.timestamps)
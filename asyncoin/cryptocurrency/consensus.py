@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+
+def next_consensus(config_, index, timestamp, difficulty, reward, epoch_timestamp):
+    """Work out the consensus parameters that follow a block.
+    Args:
+        config_ (dict): configuration of the chain.
+        index (int): index of the block.
+        timestamp (int): timestamp of the block.
+        difficulty (int): difficulty the block was mined at.
+        reward (int): block reward the block was mined at.
+        epoch_timestamp (int): timestamp of the first block of the block's difficulty epoch.
+
+    Returns:
+        tuple: the difficulty, reward and epoch timestamp for the next block.
+    """
+    height = index + 1
+
+    if index % config_['DIFFICULTY_ADJUST'] == 0:
+        epoch_timestamp = timestamp
+
+    if height % config_['DIFFICULTY_ADJUST'] == 0:
+        if (timestamp - epoch_timestamp) / config_['DIFFICULTY_ADJUST'] < config_['TIME_TARGET']:
+            difficulty += 1
+
+        elif difficulty != 1:
+            difficulty -= 1
+
+    if height % config_['REWARD_HALVING'] == 0:
+        reward = reward / 2
+
+    return difficulty, reward, epoch_timestamp
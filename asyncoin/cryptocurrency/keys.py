@@ -1,8 +1,126 @@
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import asyncio
 import ecdsa
 
 from asyncoin.cryptocurrency.transaction import Transaction
+from asyncoin.utilities.cache import LRUCache
+
+# decoding a verifying key costs about as much as checking a signature with it, so they're kept by address
+verifying_keys = LRUCache(4096)
+
+
+def verifying_key(address):
+    """Decode a verifying key, or take it from the cache.
+    Args:
+        address (str): hexadecimal representation of a verifying key.
+
+    Returns:
+        ecdsa.VerifyingKey: the verifying key.
+    """
+    public = verifying_keys.get(address)
+
+    if public is None:
+        public = ecdsa.VerifyingKey.from_string(bytes.fromhex(address))
+        verifying_keys.put(address, public)
+
+    return public
+
+
+def verify_signature(address, signature, message):
+    """
+    Args:
+        address (str): hexadecimal representation of the signer's verifying key.
+        signature (str): hexadecimal representation of the signature.
+        message (str): what was signed.
+
+    Returns:
+        bool: whether the signature is valid, False if the address or signature can't be decoded.
+    """
+    try:
+        return verifying_key(address).verify(bytes.fromhex(signature), message.encode())
+
+    # malformed keys fail an assertion in ecdsa, unsigned transactions have no signature to decode
+    except (ecdsa.keys.BadSignatureError, AssertionError, ValueError, TypeError):
+        return False
+
+
+def verify_signatures(signatures):
+    """Check a batch of signatures, in a worker process.
+    Args:
+        signatures (list): the address, signature and message of each.
+
+    Returns:
+        list: whether each signature is valid.
+    """
+    return [verify_signature(*signature) for signature in signatures]
+
+
+class BatchVerifier:
+    """Checks transactions' signatures in bulk, spread across a pool of worker processes.
+    Attributes:
+        workers (int): number of worker processes, 0 to check signatures on the event loop instead.
+        chunk_size (int): how many signatures are sent to a worker at once.
+    """
+
+    def __init__(self, workers=None, chunk_size=64):
+        """
+        Args:
+            workers (int, optional): number of worker processes, one per core by default.
+            chunk_size (int, optional): how many signatures are sent to a worker at once.
+        """
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.chunk_size = chunk_size
+
+        self.pool = None
+
+    def start(self):
+        """Start the worker processes if they aren't running already."""
+        if self.pool is None and self.workers:
+            self.pool = ProcessPoolExecutor(self.workers)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    async def verify(self, transactions):
+        """Check the signatures of transactions.
+        Args:
+            transactions (list): the transactions to check.
+
+        Returns:
+            list: whether each transaction's signature is valid.
+        """
+        signatures = [(t.from_, t.signature, t.hash) for t in transactions]
+
+        # too few to be worth sending to other processes
+        if not self.workers or len(signatures) <= self.chunk_size:
+            return verify_signatures(signatures)
+
+        chunks = await asyncio.gather(*[self.run(verify_signatures, signatures[start:start + self.chunk_size])
+                                        for start in range(0, len(signatures), self.chunk_size)])
+
+        return [valid for chunk in chunks for valid in chunk]
+
+    async def run(self, function, *args):
+        """Call a function in one of the worker processes, or on the event loop if there aren't any.
+        Args:
+            function (callable): a module level function, so it can be sent to the workers.
+            *args: its arguments.
+
+        Returns:
+            what the function returns.
+        """
+        if not self.workers:
+            return function(*args)
+
+        self.start()
+
+        return await asyncio.get_event_loop().run_in_executor(self.pool, function, *args)
 
 
 class Verifier:
@@ -17,7 +135,7 @@ class Verifier:
             address (str): hexadecimal representation of a verifying key.
         """
         self.address = address
-        self.public = ecdsa.VerifyingKey.from_string(bytes.fromhex(address))
+        self.public = verifying_key(address)
 
     def verify(self, transaction):
         """Wrapper around ecdsa.VerifyingKey.verify.
@@ -29,12 +147,7 @@ class Verifier:
                 False if the signature is invalid.
                 True if the the signature is valid.
         """
-        try:
-            self.public.verify(bytes.fromhex(transaction.signature), transaction.hash.encode())
-            return True
-
-        except ecdsa.keys.BadSignatureError:
-            return False
+        return verify_signature(self.address, transaction.signature, transaction.hash)
 
 
 class KeyPair(Verifier):
@@ -81,6 +194,5 @@ class KeyPair(Verifier):
         kwargs['from_'] = self.address
 
         transaction = Transaction(**kwargs)
-        transaction.signature = self.sign(transaction)
 
-        return transaction
+        return transaction.with_signature(self.sign(transaction))
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from asyncoin.cryptocurrency.block import BlockHeader, HEADER_VERSION
+from asyncoin.cryptocurrency.consensus import next_consensus
+from asyncoin.cryptocurrency.merkle import verify_proof
+from asyncoin.cryptocurrency.transaction import transaction_id
+
+
+class HeaderChain:
+    """A chain of block headers, checked for linkage and proof of work, for confirming
+    transactions from a node's /headers and /proof endpoints without downloading any blocks.
+    Attributes:
+        config_ (dict): configuration of the chain.
+        headers (list): the checked headers, in order.
+        difficulty (int): difficulty of the next header.
+        reward (int): block reward of the next header.
+        epoch_timestamp (int): timestamp of the first block of the current difficulty epoch.
+    """
+
+    def __init__(self, config_, checkpoint=None):
+        """
+        Args:
+            config_ (dict): configuration of the chain, as served by /config.
+            checkpoint (tuple, optional): a trusted header to start from, and the difficulty, reward and epoch timestamp
+                following it. Needed unless the chain has had headers since genesis.
+        """
+        self.config_ = config_
+        self.headers = []
+
+        if checkpoint is None:
+            self.difficulty, self.reward, self.epoch_timestamp = config_['INITIAL_DIFFICULTY'], config_['INITIAL_REWARD'], None
+
+        else:
+            header, self.difficulty, self.reward, self.epoch_timestamp = checkpoint
+            self.headers.append(header)
+
+    @property
+    def tip(self):
+        return self.headers[-1] if self.headers else None
+
+    def check_header(self, header):
+        """Check that a header can follow the current tip.
+        Args:
+            header (BlockHeader): the header to check.
+
+        Returns:
+            bool: whether the header is valid.
+        """
+        if self.tip is None:
+            link_check = header.index == 0 and str(header.previous_hash) == '0'
+
+        else:
+            link_check = header.index == self.tip.index + 1 and header.previous_hash == self.tip.hash
+
+        return link_check and header.version >= HEADER_VERSION and header.hash.startswith(self.difficulty * '1')
+
+    def add(self, headers):
+        """Add headers to the chain, stopping at the first invalid one.
+        Args:
+            headers (list): headers (BlockHeader, or dicts as served by /headers) following the tip, in order.
+
+        Returns:
+            int: the number of headers added.
+        """
+        added = 0
+
+        for header in headers:
+            if isinstance(header, dict):
+                header = BlockHeader.from_dict(header)
+
+            if not self.check_header(header):
+                break
+
+            self.difficulty, self.reward, self.epoch_timestamp = next_consensus(
+                self.config_, header.index, header.timestamp, self.difficulty, self.reward, self.epoch_timestamp)
+            self.headers.append(header)
+            added += 1
+
+        return added
+
+    def header(self, index):
+        """
+        Args:
+            index (int): index of the block.
+
+        Returns:
+            BlockHeader: the block's header, None if it isn't in the chain.
+        """
+        if not self.headers or not self.headers[0].index <= index <= self.tip.index:
+            return None
+
+        return self.headers[index - self.headers[0].index]
+
+    def confirmations(self, transaction_hash, proof):
+        """Confirm a transaction from a proof of its inclusion.
+        Args:
+            transaction_hash (str): hexadecimal hash of the transaction.
+            proof (dict): the proof, as served by /proof.
+
+        Returns:
+            int: the number of blocks including and on top of the transaction's block, 0 if the proof isn't valid for this chain.
+        """
+        header = BlockHeader.from_dict(proof['header'])
+        known = self.header(header.index)
+
+        # the leaves are transaction ids, which the signature is needed to work out
+        txid = transaction_id(transaction_hash, proof['signature'])
+
+        if known is None or known.hash != header.hash or not verify_proof(txid, proof['proof'], header.merkle_root):
+            return 0
+
+        return self.tip.index - header.index + 1
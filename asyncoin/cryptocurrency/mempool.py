@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import heapq
+import struct
+import time
+import sys
+
+from asyncoin.cryptocurrency.transaction import FIELDS
+
+# what a dict spends on each entry, measured on one grown an entry at a time so it's over-allocated as the pool's are
+INDEXED = 1 << 16
+DICT_ENTRY = (sys.getsizeof({index: None for index in range(INDEXED)}) - sys.getsizeof({})) // INDEXED
+
+# what the heap and deque spend on each entry, a pointer to it
+POINTER = struct.calcsize('P')
+
+# memory taken by a transaction's index entries besides the transaction itself: its fee and age entries and
+# the pointers to them, the time it was added, its size and footprint (ints too big to be shared), and an entry
+# in each of the five dicts that refer to it, by hash or by nonce
+INDEX_OVERHEAD = (sys.getsizeof((0.0, 0.0, '')) + sys.getsizeof((0.0, '')) + 2 * POINTER + sys.getsizeof(0.0) +
+                  2 * sys.getsizeof(1024) + 5 * DICT_ENTRY)
+
+
+class Mempool:
+    """Pending transactions, indexed by hash and by sender and nonce, bounded by count, memory and age.
+
+    Each sender's transactions can only go in a block in nonce order, so a template is assembled
+    from a heap of each sender's next executable transaction, ordered by fee rate: taking one
+    makes the same sender's following nonce executable, which goes back into the heap.
+
+    When the pool is over its limits the lowest fee rate transactions are evicted first, and
+    transactions that have been pending longer than the maximum age expire. Either way, the
+    sender's later nonces go with them, as they can't go in a block without it.
+
+    Attributes:
+        max_entries (int): the most transactions the pool holds, None for no limit.
+        max_bytes (int): the most memory the pool's transactions take up, None for no limit.
+        max_age (float): seconds after which a pending transaction expires, None for never.
+        transactions (dict): every pending transaction, by hash.
+        senders (dict): each sender's pending transactions, by nonce.
+        sizes (dict): the serialized size of every pending transaction, by hash.
+        footprints (dict): the memory taken by every pending transaction, by hash.
+        added (dict): when every pending transaction was added, by hash.
+        bytes (int): the memory taken by all the pending transactions.
+        evictions (int): number of transactions evicted to make room.
+        expirations (int): number of transactions that expired.
+        replacements (int): number of transactions replaced by ones paying a higher fee rate.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, max_age=None):
+        """
+        Args:
+            max_entries (int, optional): the most transactions the pool holds.
+            max_bytes (int, optional): the most memory the pool's transactions take up.
+            max_age (float, optional): seconds after which a pending transaction expires.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self.transactions = {}
+        self.senders = {}
+        self.sizes = {}
+        self.footprints = {}
+        self.added = {}
+        self.bytes = 0
+
+        # (fee rate, time added, hash) and (time added, hash), entries for removed transactions are skipped when reached
+        self.by_fee = []
+        self.by_age = collections.deque()
+
+        self.evictions = 0
+        self.expirations = 0
+        self.replacements = 0
+
+    def get(self, hash_):
+        """
+        Args:
+            hash_ (str): hexadecimal hash of the transaction.
+
+        Returns:
+            Transaction: the pending transaction, None if it isn't pending.
+        """
+        return self.transactions.get(hash_)
+
+    def fee_rate(self, transaction):
+        """
+        Returns:
+            float: the transaction's fee per byte of its serialization.
+        """
+        size = self.sizes.get(transaction.hash)
+
+        if size is None:
+            size = len(repr(transaction))
+
+        return transaction.fee / size
+
+    def priority(self, transaction):
+        # a heap pops the smallest, so the highest fee rate comes first, then the oldest
+        return -self.fee_rate(transaction), transaction.timestamp, transaction.hash
+
+    @staticmethod
+    def footprint(transaction):
+        """
+        Returns:
+            int: bytes of memory the transaction and its index entries take up.
+        """
+        return sys.getsizeof(transaction) + sys.getsizeof(transaction.hash) + INDEX_OVERHEAD + sum(
+            sys.getsizeof(getattr(transaction, field)) for field in FIELDS)
+
+    def add(self, transaction, now=None):
+        """Add a transaction, then evict what's needed to bring the pool back under its limits.
+        Another from the same sender with the same nonce is replaced if it pays a lower fee and fee rate.
+        Args:
+            transaction (Transaction): a transaction that's already been verified.
+            now (float, optional): the current time.
+
+        Returns:
+            bool: whether the transaction is pending, False if it was outbid by the one it conflicts with
+            or pays too little to stay in a full pool.
+        """
+        if transaction.hash in self.transactions:
+            return True
+
+        now = time.time() if now is None else now
+        self.expire(now)
+
+        size = len(repr(transaction))
+        queue = self.senders.get(transaction.from_, {})
+        conflict = queue.get(transaction.nonce)
+
+        if conflict is not None:
+            # sizes vary by a few bytes, so a replacement has to pay more outright as well
+            if transaction.fee <= conflict.fee or transaction.fee / size < self.fee_rate(conflict):
+                return False
+
+            self.discard(conflict)
+            self.replacements += 1
+
+        self.senders.setdefault(transaction.from_, {})[transaction.nonce] = transaction
+        self.transactions[transaction.hash] = transaction
+        self.sizes[transaction.hash] = size
+        self.footprints[transaction.hash] = self.footprint(transaction)
+        self.added[transaction.hash] = now
+        self.bytes += self.footprints[transaction.hash]
+
+        heapq.heappush(self.by_fee, (transaction.fee / size, now, transaction.hash))
+
+        if self.max_age is not None:
+            self.by_age.append((now, transaction.hash))
+
+        self.evict()
+
+        return transaction.hash in self.transactions
+
+    def full(self):
+        return (self.max_entries is not None and len(self.transactions) > self.max_entries) or (
+            self.max_bytes is not None and self.bytes > self.max_bytes)
+
+    def evict(self):
+        """Evict the lowest fee rate transactions until the pool is within its limits."""
+        while self.full():
+            _, added, hash_ = heapq.heappop(self.by_fee)
+
+            if self.added.get(hash_) == added:
+                self.evictions += self.drop(self.transactions[hash_])
+
+        # removed transactions' entries are let go of once they make up most of the index
+        if len(self.by_fee) > 2 * len(self.transactions) + 64:
+            self.by_fee = [entry for entry in self.by_fee if self.added.get(entry[2]) == entry[1]]
+            heapq.heapify(self.by_fee)
+
+    def expire(self, now=None):
+        """Remove the transactions that have been pending longer than the maximum age.
+        Args:
+            now (float, optional): the current time.
+        """
+        if self.max_age is None:
+            return
+
+        cutoff = (time.time() if now is None else now) - self.max_age
+
+        while self.by_age and self.by_age[0][0] < cutoff:
+            added, hash_ = self.by_age.popleft()
+
+            if self.added.get(hash_) == added:
+                self.expirations += self.drop(self.transactions[hash_])
+
+    def drop(self, transaction):
+        """Remove a transaction along with the same sender's later nonces, which can't go in a block without it.
+        Returns:
+            int: the number of transactions removed.
+        """
+        queue = self.senders[transaction.from_]
+        following = [queued for nonce, queued in queue.items() if nonce >= transaction.nonce]
+
+        for queued in following:
+            self.discard(queued)
+
+        return len(following)
+
+    def discard(self, transaction):
+        """Remove a transaction if it's pending."""
+        if self.transactions.pop(transaction.hash, None) is None:
+            return
+
+        del self.sizes[transaction.hash]
+        del self.added[transaction.hash]
+        self.bytes -= self.footprints.pop(transaction.hash)
+
+        queue = self.senders[transaction.from_]
+        del queue[transaction.nonce]
+
+        if not queue:
+            del self.senders[transaction.from_]
+
+    def remove(self, transactions):
+        """Remove transactions that have gone into the chain.
+        Args:
+            transactions (iterable): the included transactions.
+        """
+        for transaction in transactions:
+            self.discard(transaction)
+
+    def prune(self, accounts):
+        """Remove transactions whose nonces have been used up, e.g. by conflicting transactions that went into the chain.
+        Args:
+            accounts (dict): the new [balance, nonce] of accounts, by address.
+        """
+        for address, (_, nonce) in accounts.items():
+            queue = self.senders.get(address)
+
+            if queue is not None:
+                for stale in [transaction for used, transaction in queue.items() if used < nonce]:
+                    self.discard(stale)
+
+    def select(self, accounts, lowest_fee=1, limit=None):
+        """Choose the most profitable transactions that can go in the next block, each sender's in nonce order.
+        Args:
+            accounts (dict): the [balance, nonce] of every sender with pending transactions, by address.
+            lowest_fee (int, optional): the lowest fee to accept.
+            limit (int, optional): the most transactions to choose.
+
+        Returns:
+            list: the chosen transactions, in the order they're executed.
+        """
+        state, heap = {}, []
+
+        for address, queue in self.senders.items():
+            balance, nonce = accounts.get(address) or (0, 0)
+            head = queue.get(nonce)
+
+            if head is not None:
+                state[address] = [balance, nonce]
+                heap.append(self.priority(head))
+
+        heapq.heapify(heap)
+        chosen = []
+
+        while heap and (limit is None or len(chosen) < limit):
+            transaction = self.transactions[heapq.heappop(heap)[2]]
+            sender = state[transaction.from_]
+
+            # a sender's later nonces can't go in without this one, so they're passed over with it
+            if transaction.fee < lowest_fee or transaction.amount + transaction.fee > sender[0]:
+                continue
+
+            sender[0] -= transaction.amount + transaction.fee
+            sender[1] += 1
+            chosen.append(transaction)
+
+            following = self.senders[transaction.from_].get(sender[1])
+
+            if following is not None:
+                heapq.heappush(heap, self.priority(following))
+
+        return chosen
+
+    def stats(self):
+        """
+        Returns:
+            dict: the pool's size, limits and eviction counters.
+        """
+        return {'transactions': len(self.transactions),
+                'senders': len(self.senders),
+                'bytes': self.bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'max_age': self.max_age,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'replacements': self.replacements}
+
+    # Special class methods
+
+    def __iter__(self):
+        return iter(list(self.transactions.values()))
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, transaction):
+        return transaction.hash in self.transactions
+
+    def __repr__(self):
+        return '[{}]'.format(', '.join(repr(transaction) for transaction in self.transactions.values()))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from hashlib import sha256
+
+# leaves and interior nodes are hashed with different prefixes, so an interior node can't pass for a leaf
+LEAF = b'\x00'
+NODE = b'\x01'
+
+
+def merkle_root(hashes):
+    """Compute the Merkle root of a list of hashes. An odd node out is carried up to the next level unpaired.
+    Args:
+        hashes (list): hexadecimal hashes of the leaves, in order.
+
+    Returns:
+        str: hexadecimal Merkle root.
+    """
+    level = [sha256(LEAF + bytes.fromhex(hash_)).digest() for hash_ in hashes]
+
+    if not level:
+        return sha256(b'').hexdigest()
+
+    while len(level) > 1:
+        level = [sha256(NODE + level[i] + level[i + 1]).digest() if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+
+    return level[0].hex()
+
+
+def merkle_proof(hashes, index):
+    """Build a proof that a leaf is included under the Merkle root of a list of hashes.
+    Args:
+        hashes (list): hexadecimal hashes of the leaves, in order.
+        index (int): position of the leaf to prove.
+
+    Returns:
+        list: [side, hash] for each sibling on the path to the root, side being 'L' or 'R'.
+    """
+    level = [sha256(LEAF + bytes.fromhex(hash_)).digest() for hash_ in hashes]
+    proof = []
+
+    while len(level) > 1:
+        sibling = index ^ 1
+
+        # an odd node out has no sibling, it's carried up as it is
+        if sibling < len(level):
+            proof.append(['L' if sibling < index else 'R', level[sibling].hex()])
+
+        level = [sha256(NODE + level[i] + level[i + 1]).digest() if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+        index //= 2
+
+    return proof
+
+
+def verify_proof(hash_, proof, root):
+    """Check a Merkle inclusion proof.
+    Args:
+        hash_ (str): hexadecimal hash of the leaf.
+        proof (list): [side, hash] for each sibling on the path to the root.
+        root (str): hexadecimal Merkle root the leaf should be under.
+
+    Returns:
+        bool: whether the proof is valid.
+    """
+    node = sha256(LEAF + bytes.fromhex(hash_)).digest()
+
+    for side, sibling in proof:
+        if side == 'L':
+            node = sha256(NODE + bytes.fromhex(sibling) + node).digest()
+
+        elif side == 'R':
+            node = sha256(NODE + node + bytes.fromhex(sibling)).digest()
+
+        else:
+            return False
+
+    return node.hex() == root
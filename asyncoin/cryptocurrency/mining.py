@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+
+from hashlib import sha256
+import multiprocessing
+import struct
+import time
+import os
+
+import asyncio
+
+from asyncoin.cryptocurrency.block import HEADER_VERSION
+
+# set in each worker process, by the Miner that owns the pool
+cancelled = None
+
+# how many nonces a worker tries between checks for cancellation
+CHECK_INTERVAL = 1024
+
+NONCE = struct.Struct('<Q')
+
+
+def init_worker(event):
+    global cancelled
+    cancelled = event
+
+
+def resolve(future, result=None, error=None):
+    # results arrive on the pool's handler thread, possibly after the search has been cancelled
+    if not future.done():
+        if error is not None:
+            future.set_exception(error)
+
+        else:
+            future.set_result(result)
+
+
+def search_range(prefix, suffix, target, start, stop, binary=False):
+    """Search a range of nonces for a block hash that meets the difficulty.
+    Args:
+        prefix (bytes): the hashed block contents before the nonce.
+        suffix (bytes): the hashed block contents after the nonce.
+        target (str): the prefix a valid hash starts with.
+        start (int): the first nonce to try.
+        stop (int): the nonce to stop before.
+        binary (bool, optional): whether the nonce is hashed packed, as in a block header, rather than as text.
+
+    Returns:
+        tuple:
+            int: a nonce that solves the block, None if there isn't one in the range or the search was cancelled.
+            int: the number of nonces tried.
+    """
+    # hashed once, every nonce carries on from a copy of this state
+    base = sha256(prefix)
+
+    for nonce in range(start, stop):
+        if cancelled is not None and nonce % CHECK_INTERVAL == 0 and cancelled.is_set():
+            return None, nonce - start
+
+        digest = base.copy()
+        digest.update((NONCE.pack(nonce) if binary else str(nonce).encode()) + suffix)
+
+        if digest.hexdigest().startswith(target):
+            if cancelled is not None:
+                # the other workers' ranges are for the same block
+                cancelled.set()
+
+            return nonce, nonce - start + 1
+
+    return None, stop - start
+
+
+class Miner:
+    """Searches for proof of work across a pool of worker processes, each given a disjoint nonce range.
+    Attributes:
+        workers (int): number of worker processes, 0 to search on the event loop instead.
+        chunk_size (int): how many nonces each worker is given per round.
+        cancelled (multiprocessing.Event): tells the workers to abandon their ranges.
+        stale (bool): whether the block being searched for has been made stale by a new tip.
+        hashes (int): number of nonces tried.
+        search_time (float): seconds spent searching.
+        rounds (int): number of rounds searched.
+        stale_rounds (int): number of rounds cut short by a new tip.
+        last_hashrate (float): hashes per second of the last round.
+        blocks (int): number of blocks solved.
+        block_time (float): total seconds from starting on a block to solving it.
+        last_block_time (float): seconds it took to solve the last block.
+        orphans (int): number of solved blocks that didn't make it into the chain.
+    """
+
+    def __init__(self, workers=None, chunk_size=250000):
+        """
+        Args:
+            workers (int, optional): number of worker processes, one per core by default.
+            chunk_size (int, optional): how many nonces each worker is given per round.
+        """
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.chunk_size = chunk_size
+
+        self.cancelled = multiprocessing.Event()
+        self.stale = False
+
+        self.pool = None
+
+        self.hashes = 0
+        self.search_time = 0
+        self.rounds = 0
+        self.stale_rounds = 0
+        self.last_hashrate = None
+
+        self.blocks = 0
+        self.block_time = 0
+        self.last_block_time = None
+        self.orphans = 0
+
+    def start(self):
+        """Start the worker processes if they aren't running already.
+        Best done before the event loop starts any threads, as the workers are forked.
+        """
+        if self.pool is None and self.workers:
+            self.pool = multiprocessing.Pool(self.workers, initializer=init_worker, initargs=(self.cancelled,))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def reset(self):
+        """Start mining a new block, clearing any earlier cancellation."""
+        self.stale = False
+        self.cancelled.clear()
+
+    def cancel(self):
+        """Abandon the current search, e.g. because a competing block arrived."""
+        self.stale = True
+        self.cancelled.set()
+
+    async def search(self, block, difficulty, start=0):
+        """Search a block's nonces from 'start' for one that meets the difficulty.
+        Args:
+            block (Block): the block to solve, its nonce is ignored.
+            difficulty (int): the block's difficulty.
+            start (int, optional): the first nonce to try.
+
+        Returns:
+            tuple:
+                int: a nonce that solves the block, None if no nonce in this round did or the search was cancelled.
+                int: the nonce after the last one that was searched.
+        """
+        if block.version >= HEADER_VERSION:
+            # the nonce is the header's last field
+            prefix, suffix, binary = block.header().pack()[:-NONCE.size], b'', True
+
+        else:
+            prefix = str(block.index).encode()
+            suffix = '{}{}{}'.format(block.previous_hash, list(block.data), block.timestamp).encode()
+            binary = False
+
+        target = difficulty * '1'
+
+        started = time.time()
+        nonce, hashes, stop = await self.search_nonces(prefix, suffix, target, start, binary)
+        elapsed = time.time() - started
+
+        self.rounds += 1
+        self.hashes += hashes
+        self.search_time += elapsed
+
+        if elapsed:
+            self.last_hashrate = hashes / elapsed
+
+        if self.stale:
+            self.stale_rounds += 1
+
+        return nonce, stop
+
+    async def search_nonces(self, prefix, suffix, target, start, binary):
+        """Search one round of nonces, see self.search.
+        Returns:
+            tuple: the solving nonce or None, the number of nonces tried, and the nonce after the last one searched.
+        """
+        if not self.workers:
+            stop = start + self.chunk_size
+
+            for chunk in range(start, stop, CHECK_INTERVAL):
+                if self.stale:
+                    return None, chunk - start, chunk
+
+                nonce, _ = search_range(prefix, suffix, target, chunk, chunk + CHECK_INTERVAL, binary)
+
+                if nonce is not None:
+                    return nonce, nonce - start + 1, stop
+
+                await asyncio.sleep(0)
+
+            return None, stop - start, stop
+
+        self.start()
+
+        loop = asyncio.get_event_loop()
+        results = []
+
+        for worker in range(self.workers):
+            future = loop.create_future()
+            results.append(future)
+
+            self.pool.apply_async(
+                search_range, (prefix, suffix, target, start + worker * self.chunk_size, start + (worker + 1) * self.chunk_size, binary),
+                callback=lambda nonce, future=future: loop.call_soon_threadsafe(resolve, future, nonce),
+                error_callback=lambda error, future=future: loop.call_soon_threadsafe(resolve, future, None, error))
+
+        try:
+            results = await asyncio.gather(*results)
+
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+        if not self.stale:
+            self.cancelled.clear()
+
+        found = [nonce for nonce, _ in results if nonce is not None]
+
+        return min(found) if found and not self.stale else None, sum(hashes for _, hashes in results), start + self.workers * self.chunk_size
+
+    def solved(self, elapsed):
+        """Record a solved block.
+        Args:
+            elapsed (float): seconds from starting on the block to solving it.
+        """
+        self.blocks += 1
+        self.block_time += elapsed
+        self.last_block_time = elapsed
+
+    def stats(self):
+        """
+        Returns:
+            dict: hash rates, block times and counters.
+        """
+        return {'workers': self.workers,
+                'hashes': self.hashes,
+                'hashrate': self.hashes / self.search_time if self.search_time else None,
+                'last_hashrate': self.last_hashrate,
+                'rounds': self.rounds,
+                'stale_rounds': self.stale_rounds,
+                'blocks': self.blocks,
+                'average_block_time': self.block_time / self.blocks if self.blocks else None,
+                'last_block_time': self.last_block_time,
+                'orphans': self.orphans}
+
+
+class TemplateManager:
+    """Keeps the candidate block being mined, rebuilding it only when it's out of date, rather than every round.
+    Attributes:
+        build (coroutine function): builds a template from a reward address and lowest fee.
+        max_age (float): seconds after which the template is rebuilt anyway, to refresh its timestamp.
+        template (Block): the current template, None before the first build.
+        built_at (float): when the current template was built.
+        reason (str): why the current template is out of date, None if it isn't.
+        builds (int): number of templates built.
+        build_time (float): total seconds spent building templates.
+        last_build_time (float): seconds it took to build the current template.
+        reuses (int): number of times the current template was handed out again.
+        rebuilds (dict): number of rebuilds for each reason.
+    """
+
+    def __init__(self, build, max_age=60):
+        """
+        Args:
+            build (coroutine function): builds a template from a reward address and lowest fee.
+            max_age (float, optional): seconds after which the template is rebuilt anyway.
+        """
+        self.build = build
+        self.max_age = max_age
+
+        self.template = None
+        self.key = None
+        self.built_at = None
+        self.reason = None
+
+        self.builds = 0
+        self.build_time = 0
+        self.last_build_time = None
+        self.reuses = 0
+        self.rebuilds = {'tip': 0, 'mempool': 0, 'age': 0, 'address': 0}
+
+    def invalidate(self, reason):
+        """Mark the template out of date.
+        Args:
+            reason (str): 'tip' or 'mempool'.
+        """
+        if self.template is not None and self.reason is None:
+            self.reason = reason
+
+    def transaction_added(self, transaction):
+        """Mark the template out of date if a new transaction could go in it."""
+        if self.key is not None and transaction.fee >= self.key[1]:
+            self.invalidate('mempool')
+
+    def age(self):
+        return time.time() - self.built_at if self.built_at is not None else None
+
+    async def get(self, reward_address, lowest_fee=1):
+        """Get the block to mine, rebuilding it if it's out of date.
+        Args:
+            reward_address (str): the address to send the block's rewards to.
+            lowest_fee (int, optional): the lowest fee to accept.
+
+        Returns:
+            tuple:
+                Block: the template.
+                bool: whether it was just built, so its nonces haven't been searched.
+        """
+        reason = self.reason
+
+        if self.template is not None and reason is None:
+            if self.key != (reward_address, lowest_fee):
+                reason = 'address'
+
+            elif self.age() > self.max_age:
+                reason = 'age'
+
+            else:
+                self.reuses += 1
+                return self.template, False
+
+        if reason is not None:
+            self.rebuilds[reason] += 1
+
+        # cleared first, anything that changes while building marks the new template out of date
+        self.reason = None
+
+        started = time.time()
+        self.template = await self.build(reward_address, lowest_fee)
+        self.key = (reward_address, lowest_fee)
+        self.built_at = time.time()
+
+        self.builds += 1
+        self.last_build_time = self.built_at - started
+        self.build_time += self.last_build_time
+
+        return self.template, True
+
+    def stats(self):
+        """
+        Returns:
+            dict: the template's size and age, and the build counters.
+        """
+        return {'transactions': len(self.template.data) - 1 if self.template is not None else None,
+                'age': self.age(),
+                'builds': self.builds,
+                'average_build_time': self.build_time / self.builds if self.builds else None,
+                'last_build_time': self.last_build_time,
+                'reuses': self.reuses,
+                'rebuilds': dict(self.rebuilds)}
@@ -5,37 +5,73 @@ import time
 import json
 
 
+# in the order they're serialized
+FIELDS = ('to', 'from_', 'amount', 'timestamp', 'signature', 'nonce', 'fee')
+
+
+def transaction_id(hash_, signature):
+    """
+    Args:
+        hash_ (str): hexadecimal hash of the transaction.
+        signature (str): hexadecimal representation of its signature.
+
+    Returns:
+        str: hexadecimal digest of the signed transaction, which commits to its signature as well as its content.
+    """
+    return sha256('{}{}'.format(hash_, signature).encode()).hexdigest()
+
+
 class Transaction:
-    """A Cryptocurrency transaction.
+    """A Cryptocurrency transaction. Transactions are immutable, so their hash is only computed once.
     Attributes:
         to (str): address that the transaction is to.
         from_ (str): address that the transaction is from.
         amount (int): the amount of cryptocurrency transacted.
         signature (str): hexadecimal representation of the signer's signature.
         hash (str): hexadecimal message digest of the transaction's content.
+        txid (str): hexadecimal digest of the transaction's content and signature, see transaction_id.
         fee (int): transaction fee paid to miners to prevent spam attack.
         nonce (int): account nonce to prevent replay attack.
     """
 
-    def __init__(self, json_dict=None, **kwargs):
+    __slots__ = FIELDS + ('_hash', '_txid')
+
+    def __init__(self, **kwargs):
         """
         Args:
             **kwargs:
                 to (str): address that the transaction is to.
                 from_ (str): address that the transaction is from.
                 amount (int): the amount of cryptocurrency transacted.
+                timestamp (float, optional): the time the transaction was created.
                 signature (str, optional): hexadecimal representation of the signer's signature.
                 fee (int): transaction fee paid to miners to prevent spam attack.
                 nonce (int): account nonce to prevent replay attack.
         """
-        if kwargs:
-            self.to = kwargs['to']
-            self.from_ = kwargs['from_']
-            self.amount = kwargs['amount']
-            self.timestamp = kwargs.get('timestamp', time.time())
-            self.signature = kwargs.get('signature')
-            self.nonce = kwargs['nonce']
-            self.fee = kwargs['fee']
+        set_ = object.__setattr__
+
+        set_(self, 'to', kwargs['to'])
+        set_(self, 'from_', kwargs['from_'])
+        set_(self, 'amount', kwargs['amount'])
+        set_(self, 'timestamp', kwargs.get('timestamp', time.time()))
+        set_(self, 'signature', kwargs.get('signature'))
+        set_(self, 'nonce', kwargs['nonce'])
+        set_(self, 'fee', kwargs['fee'])
+        set_(self, '_hash', None)
+        set_(self, '_txid', None)
+
+    def with_signature(self, signature):
+        """
+        Args:
+            signature (str): hexadecimal representation of the signer's signature.
+
+        Returns:
+            Transaction: a copy of the transaction with the signature.
+        """
+        return Transaction(**dict(self.to_dict(), signature=signature))
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
 
     @classmethod
     def from_dict(cls, json_dict):
@@ -59,18 +95,42 @@ class Transaction:
 
     @property
     def hash(self):
-        return sha256('{}{}{}{}{}{}'.format(self.to, self.from_, self.amount, self.fee, self.nonce, self.timestamp).encode()).hexdigest()
+        if self._hash is None:
+            # the signature isn't part of the hash, it's what gets signed
+            object.__setattr__(self, '_hash', sha256('{}{}{}{}{}{}'.format(self.to, self.from_, self.amount, self.fee, self.nonce, self.timestamp).encode()).hexdigest())
+
+        return self._hash
+
+    @property
+    def txid(self):
+        if self._txid is None:
+            object.__setattr__(self, '_txid', transaction_id(self.hash, self.signature))
+
+        return self._txid
 
     # Special class methods
 
+    def __setattr__(self, name, value):
+        raise AttributeError('Transactions are immutable, use with_signature or construct a new one.')
+
+    def __delattr__(self, name):
+        raise AttributeError('Transactions are immutable.')
+
+    def __reduce__(self):
+        # pickled through the constructor, as the immutable attributes can't be set back one by one
+        return Transaction.from_dict, (self.to_dict(),)
+
     def __str__(self):
         return self.__repr__()
 
     def __repr__(self):
-        __dict__ = dict(self.__dict__)
+        __dict__ = self.to_dict()
         __dict__['hash'] = self.hash
 
         return json.dumps(__dict__)
 
     def __eq__(self, other):
-        return self.hash == other.hash
+        return isinstance(other, Transaction) and self.hash == other.hash
+
+    def __hash__(self):
+        return hash(self.hash)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import decimal
+import math
+
+from asyncoin.cryptocurrency.keys import verify_signature
+
+
+def well_formed(transaction):
+    """Check a transaction's fields, apart from its signature.
+    Args:
+        transaction (Transaction): transaction to check.
+
+    Returns:
+        bool: whether the amounts and addresses are valid, False as well if any of them is of the wrong type.
+    """
+    # a field of the wrong type makes the transaction malformed, rather than raising further on
+    if not (isinstance(transaction.to, str) and isinstance(transaction.from_, str) and isinstance(transaction.nonce, int)):
+        return False
+
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+               for value in (transaction.amount, transaction.fee, transaction.nonce)):
+        return False
+
+    decimal_check = decimal.Decimal(transaction.amount).as_tuple(
+    ).exponent < 19 and decimal.Decimal(transaction.fee).as_tuple().exponent < 19
+    address_check = len(transaction.to) == 96 and len(
+        transaction.from_) == 96
+    positive_check = transaction.amount > 0 and transaction.fee > 0
+    self_check = transaction.from_ != transaction.to
+
+    return all((decimal_check, address_check, positive_check, self_check))
+
+
+def well_formed_block(block):
+    """Check the types of a block's fields, that it has a reward and that its other transactions are well formed,
+    before it's hashed or verified.
+    Args:
+        block (Block): block to check.
+
+    Returns:
+        bool: whether the block can be verified without its fields raising.
+    """
+    number_check = all(isinstance(value, int) and not isinstance(value, bool) for value in (block.index, block.nonce, block.version))
+    timestamp_check = isinstance(block.timestamp, (int, float)) and not isinstance(block.timestamp, bool) and math.isfinite(block.timestamp)
+    hash_check = isinstance(block.previous_hash, str)
+    reward_check = len(block.data) > 0 and isinstance(block[0].amount, (int, float)) and not isinstance(block[0].amount, bool) and \
+        math.isfinite(block[0].amount) and isinstance(block[0].to, str) and isinstance(block[0].from_, str)
+
+    # the fees are summed up against the reward, so every one of them has to be a number
+    transactions_check = all(well_formed(transaction) for transaction in block[1:])
+
+    return all((number_check, timestamp_check, hash_check, reward_check, transactions_check))
+
+
+def check_blocks(blocks, previous_hash=None):
+    """Run the checks that don't depend on the chain state over a run of blocks, in a worker process:
+    that each block follows the one before it, has a well formed reward, and only well formed, correctly signed transactions.
+    Args:
+        blocks (list): the blocks to check, in order.
+        previous_hash (str, optional): hash of the block before the first one, None not to check what the first follows.
+
+    Returns:
+        tuple:
+            int: how many of the blocks, from the first, passed.
+            list: the hash and signature of each of their transactions.
+    """
+    signatures = []
+
+    for passed, block in enumerate(blocks):
+        link_check = previous_hash is None or block.previous_hash == previous_hash
+        reward_check = len(block.data) > 0 and block[0].from_ == 'Network' and len(block[0].to) == 96
+
+        if not (link_check and reward_check and all(
+                well_formed(t) and verify_signature(t.from_, t.signature, t.hash) for t in block[1:])):
+            return passed, signatures
+
+        signatures.extend((t.hash, t.signature) for t in block[1:])
+        previous_hash = block.hash
+
+    return len(blocks), signatures
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import time
+
+import aiohttp
+import asyncio
+
+from asyncoin.cryptocurrency.block import Block
+
+# what a peer's failed or malformed /blockrange response can raise, struct.error from hashing a header with mistyped fields
+FETCH_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, AttributeError, KeyError, TypeError, ValueError, struct.error)
+
+
+class Source:
+    """A peer blocks are downloaded from.
+    Attributes:
+        url (str): the peer's address.
+        height (int): how many of the blocks being downloaded the peer has.
+        chunk_size (int): how many blocks to ask it for at once, adjusted to how quickly it answers.
+        active (int): number of its requests in flight.
+        failures (int): number of its requests that failed in a row.
+        blocks (int): number of blocks downloaded from it.
+    """
+
+    def __init__(self, url, height, chunk_size):
+        self.url = url
+        self.height = height
+        self.chunk_size = chunk_size
+
+        self.active = 0
+        self.failures = 0
+        self.blocks = 0
+
+
+class BlockDownloader:
+    """Downloads a range of blocks from several peers at once, with a few requests in flight to each,
+    and hands them on in order of height.
+
+    Each peer is asked for as many blocks as it can send in about target_time seconds: its chunk
+    size grows when it answers quickly, shrinks when it's slow, and is halved when a request fails.
+    A failed range is retried on another peer, and a peer whose requests keep failing is dropped.
+    Blocks are only requested up to max_ahead past the next one to hand on, and when that next
+    range is held up on a slow peer, an idle peer is asked for it as well.
+
+    Attributes:
+        session (aiohttp.ClientSession): the session to download with.
+        peers (list): addresses of the peers to download from.
+        start (int): index of the first block.
+        end (int): index to stop before.
+        previous_hash (str): hash of the block before the first one, None not to check what the first follows.
+        chunk_size (int): how many blocks each peer is first asked for at once.
+        min_chunk (int): the fewest blocks a peer is asked for at once.
+        max_chunk (int): the most blocks a peer is asked for at once.
+        window_size (int): how many blocks are handed on together, at most, unless a single range is bigger.
+        per_peer (int): the most requests in flight to each peer.
+        max_ahead (int): how far past the next block to hand on blocks are requested, None for enough to keep every peer busy.
+        target_time (float): seconds each request should take.
+        retries (int): how many requests in a row a peer can fail before it's dropped.
+        sources (list): the peers still being downloaded from.
+        ready (dict): downloaded ranges waiting for the ones before them, by the index of their first block.
+        failures (int): number of requests that failed.
+        hedged (int): number of ranges asked of a second peer because the first was holding everything up.
+    """
+
+    def __init__(self, session, peers, start, end, previous_hash=None, chunk_size=100, min_chunk=10, max_chunk=1000,
+                 window_size=500, per_peer=2, max_ahead=None, target_time=2, retries=3):
+        self.session = session
+        self.peers = list(peers)
+        self.start = start
+        self.end = end
+        self.previous_hash = previous_hash
+
+        self.chunk_size = chunk_size
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.window_size = window_size
+        self.per_peer = per_peer
+        self.max_ahead = max_ahead
+        self.target_time = target_time
+        self.retries = retries
+
+        self.sources = []
+
+        # the next block to ask for, past any ranges waiting to be retried, and the next one to hand on
+        self.next = start
+        self.delivered = start
+
+        self.ready = {}
+        self.retry = []
+        self.requests = {}
+
+        self.failures = 0
+        self.hedged = 0
+
+    async def probe(self):
+        """Ask every peer for its height, keeping the ones that have blocks to download."""
+        async def height(peer):
+            async with self.session.get('http://{}/height'.format(peer)) as response:
+                return int(await response.text())
+
+        heights = await asyncio.gather(*[height(peer) for peer in self.peers], return_exceptions=True)
+
+        self.sources = [Source(peer, min(height, self.end), self.chunk_size) for peer, height in zip(self.peers, heights)
+                        if not isinstance(height, Exception) and height > self.start]
+
+        if self.max_ahead is None:
+            self.max_ahead = max(self.window_size, self.max_chunk) * self.per_peer * max(len(self.sources), 1)
+
+    def assign(self, source):
+        """Choose the next range of blocks to ask a peer for.
+        Args:
+            source (Source): the peer.
+
+        Returns:
+            tuple: the indexes of the first and last block, None if there's nothing for the peer to do.
+        """
+        # ranges that failed are retried first, on a different peer if there is one
+        retries = [retry for retry in self.retry if retry[1] < source.height and (retry[2] != source.url or len(self.sources) == 1)]
+
+        if retries:
+            retry = min(retries)
+            self.retry.remove(retry)
+            return retry[:2]
+
+        limit = min(self.delivered + self.max_ahead, source.height)
+
+        if self.next < limit:
+            first, self.next = self.next, min(self.next + source.chunk_size, limit)
+            return first, self.next - 1
+
+        # everything after the next range to hand on waits for it, so a slow peer holding it up is raced
+        if self.delivered not in self.ready:
+            holding = [request for request in self.requests.values() if request[1] == self.delivered]
+
+            if len(holding) == 1:
+                peer, first, last, started = holding[0]
+
+                if peer is not source and last < source.height and time.time() - started > self.target_time:
+                    self.hedged += 1
+                    return first, last
+
+        return None
+
+    async def fetch(self, source, first, last):
+        """Download a range of blocks from a peer, checking it's the range that was asked for.
+        Returns:
+            list: the blocks.
+        """
+        async with self.session.get('http://{}/blockrange/{}/{}'.format(source.url, first, last)) as response:
+            data = await response.json()
+
+        if not isinstance(data, list) or len(data) != last - first + 1:
+            raise ValueError('Expected blocks {} to {}.'.format(first, last))
+
+        blocks = [Block.from_dict(block) for block in data]
+
+        # every hash is worked out here, so a malformed block fails this peer's request rather than the download
+        hashes = [block.hash for block in blocks]
+
+        for offset, block in enumerate(blocks):
+            if block.index != first + offset or (offset and block.previous_hash != hashes[offset - 1]):
+                raise ValueError('Blocks {} to {} are out of order.'.format(first, last))
+
+        return blocks
+
+    def request(self, source, first, last):
+        task = asyncio.ensure_future(self.fetch(source, first, last))
+        self.requests[task] = (source, first, last, time.time())
+        source.active += 1
+
+    def failed(self, source, first, last):
+        """Shrink the chunk size of a peer whose request failed, or drop it, and queue the range to be retried."""
+        self.failures += 1
+        source.failures += 1
+        source.chunk_size = max(source.chunk_size // 2, self.min_chunk)
+
+        if source.failures > self.retries and source in self.sources:
+            self.sources.remove(source)
+
+        # unless another peer is already on it
+        if first >= self.delivered and first not in self.ready and all(
+                requested != first for _, requested, _, _ in self.requests.values()):
+            self.retry.append((first, last, source.url))
+
+    def completed(self, task):
+        """Take in the result of a finished request."""
+        source, first, last, started = self.requests.pop(task)
+        source.active -= 1
+
+        try:
+            blocks = task.result()
+
+        except FETCH_ERRORS:
+            self.failed(source, first, last)
+            return
+
+        elapsed = time.time() - started
+        source.failures = 0
+        source.blocks += len(blocks)
+
+        # the chunk size moves halfway towards what would have taken target_time
+        wanted = len(blocks) * self.target_time / max(elapsed, 0.001)
+        source.chunk_size = int(min(max((source.chunk_size + wanted) / 2, self.min_chunk), self.max_chunk))
+
+        # a range asked of two peers is taken from whichever answers first
+        if first >= self.delivered and first not in self.ready:
+            self.ready[first] = (source, blocks)
+
+    def window(self):
+        """Take the downloaded blocks that follow on from those already handed on.
+        Returns:
+            list: up to about self.window_size blocks, empty if the next range hasn't arrived.
+        """
+        blocks = []
+
+        while self.delivered in self.ready and len(blocks) < self.window_size:
+            source, ranged = self.ready.pop(self.delivered)
+            previous_hash = blocks[-1].hash if blocks else self.previous_hash
+
+            if previous_hash is not None and ranged[0].previous_hash != previous_hash:
+                # the peer is on another fork
+                self.failed(source, self.delivered, ranged[-1].index)
+                break
+
+            blocks.extend(ranged)
+            self.delivered += len(ranged)
+
+        if blocks:
+            self.previous_hash = blocks[-1].hash
+
+        return blocks
+
+    async def run(self, windows, check):
+        """Download the blocks, starting each window's checks as soon as it's ready.
+        Args:
+            windows (asyncio.Queue): gets the first index, blocks and checks of each window in order,
+                then None, or the error that stopped the download.
+            check (coroutine function): starts the checks on a list of blocks.
+        """
+        try:
+            await self.probe()
+
+            while self.delivered < self.end:
+                for source in list(self.sources):
+                    while source.active < self.per_peer:
+                        work = self.assign(source)
+
+                        if work is None:
+                            break
+
+                        self.request(source, *work)
+
+                if not self.requests:
+                    raise ValueError('Unable to sync, no peer could send block {}.'.format(self.delivered))
+
+                # woken up now and then even without an answer, to race a peer that's holding everything up
+                done, _ = await asyncio.wait(list(self.requests), timeout=self.target_time, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    self.completed(task)
+
+                first, blocks = self.delivered, self.window()
+
+                while blocks:
+                    await windows.put((first, blocks, asyncio.ensure_future(check(blocks))))
+                    first, blocks = self.delivered, self.window()
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as error:
+            await windows.put(error)
+            return
+
+        finally:
+            for task in self.requests:
+                task.cancel()
+
+        await windows.put(None)
+
+    def stats(self):
+        """
+        Returns:
+            dict: blocks downloaded from, and chunk size of, each peer, and the failure counters.
+        """
+        return {'peers': {source.url: {'blocks': source.blocks, 'chunk_size': source.chunk_size} for source in self.sources},
+                'failures': self.failures,
+                'hedged': self.hedged}
@@ -6,91 +6,287 @@ import aiohttp
 import asyncio
 from aioconsole import ainput
 
-from json import loads
+from json import loads, dumps
 import yaml
 import logging
 import os
 from websockets.exceptions import ConnectionClosed
 from urllib.parse import urlparse
 import socket
-import aiosqlite
-import math
+import struct
 
-from asyncoin.cryptocurrency.blockchain import (
-    Blockchain, startup_script, block_template, transaction_template)
+from asyncoin.cryptocurrency.blockchain import Blockchain
 from asyncoin.cryptocurrency.block import Block
 from asyncoin.cryptocurrency.transaction import Transaction
 from asyncoin.cryptocurrency.keys import KeyPair
+from asyncoin.cryptocurrency.validation import well_formed, well_formed_block
+from asyncoin.network.downloader import BlockDownloader, FETCH_ERRORS
+from asyncoin.storage.snapshot import encode_snapshot, decode_snapshot, read_snapshot
 
 from asyncoin.utilities.encryption import decrypt
+from asyncoin.utilities.cache import LRUCache
 
 
-class Peers:
-    """A set of adjacent peers."""
+def is_hash(value):
+    """
+    Returns:
+        bool: whether a value is a hexadecimal SHA-256 hash.
+    """
+    try:
+        return isinstance(value, str) and len(bytes.fromhex(value)) == 32
+
+    except ValueError:
+        return False
 
-    def __init__(self):
+
+class Peers:
+    """A set of adjacent peers, all contacted through one long-lived HTTP session.
+
+    New blocks and transactions are gossiped by announcing their hashes to '/inv', peers fetch
+    the bodies they haven't seen from whoever announced them, then announce them on in turn.
+
+    Attributes:
+        peers (set): the urls of the peers.
+        url (str): this node's own url, sent with announcements so peers know where to fetch from.
+        block_subscribers (set): websockets to send new blocks to.
+        timeout (float): seconds a peer has to connect, and between reads, before it's given up on.
+        concurrency (int): the most requests to peers in flight at once.
+        tasks (set): broadcasts running in the background.
+        seen (LRUCache): hashes of recently announced or received blocks and transactions.
+        relay_interval (float): seconds transactions are held to be announced together.
+        relay_batch (int): the most transactions announced or fetched in one request.
+        relay_queue (list): hashes of transactions waiting to be announced.
+    """
+
+    def __init__(self, timeout=5, concurrency=32, seen_entries=65536, relay_interval=0.1, relay_batch=1000):
+        """
+        Args:
+            timeout (float, optional): seconds a peer has to connect, and between reads, before it's given up on.
+            concurrency (int, optional): the most requests to peers in flight at once.
+            seen_entries (int, optional): how many recently seen hashes to remember.
+            relay_interval (float, optional): seconds transactions are held to be announced together.
+            relay_batch (int, optional): the most transactions announced or fetched in one request.
+        """
         self.peers = set()
+        self.url = None
         self.block_subscribers = set()
 
+        # anything in here is neither fetched nor relayed again
+        self.seen = LRUCache(seen_entries)
+
+        self.relay_interval = relay_interval
+        self.relay_batch = relay_batch
+        self.relay_queue = []
+        self.relay_task = None
+
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.tasks = set()
+
+        self.session = None
+        self.requests = None
+
+    def client(self):
+        """Get the shared session, opened on first use so it belongs to the running event loop.
+        Returns:
+            aiohttp.ClientSession: the session.
+        """
+        if self.session is None or self.session.closed:
+            # connections are kept alive and reused for every message to the same peer
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout))
+            self.requests = asyncio.Semaphore(self.concurrency)
+
+        return self.session
+
+    async def close_peers(self):
+        """Cancel the background broadcasts and close the session."""
+        for task in list(self.tasks):
+            task.cancel()
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def announcer(self, peer, address):
+        """Check an announcement's sender can be fetched from, so a caller can't point the node at any host it likes.
+        Args:
+            peer (str): the url the announcement says to fetch from.
+            address (str): the address the announcement came from.
+
+        Returns:
+            bool: whether the url is a known peer, or on the host the announcement came from.
+        """
+        if peer in self.peers:
+            return True
+
+        try:
+            return address is not None and urlparse('http://{}'.format(peer)).hostname == address
+
+        except ValueError:
+            return False
+
+    def background(self, coroutine):
+        """Run a coroutine without waiting for it, e.g. a broadcast from a request handler.
+        Args:
+            coroutine (coroutine): the coroutine to run.
+
+        Returns:
+            asyncio.Future: the running task.
+        """
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        return task
+
+    async def fan_out(self, request, exclude=None):
+        """Make a request to every peer at once. Peers that refuse the connection are dropped,
+        those that time out or fail are skipped this time.
+        Args:
+            request (coroutine function): makes the request, given the session and a peer.
+            exclude (str, optional): a peer to leave out.
+
+        Returns:
+            list: the result from each peer that answered.
+        """
+        session = self.client()
+
+        async def contact(peer):
+            async with self.requests:
+                try:
+                    return True, await request(session, peer)
+
+                except aiohttp.client_exceptions.ClientConnectorError:
+                    self.peers.discard(peer)
+
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                    pass
+
+                return False, None
+
+        results = await asyncio.gather(*[contact(peer) for peer in list(self.peers) if peer != exclude])
+
+        return [result for answered, result in results if answered]
+
+    @staticmethod
+    async def post(session, peer, path, data):
+        """
+        Args:
+            session (aiohttp.ClientSession): the session to send with.
+            peer (str): the peer's url.
+            path (str): the route to post to.
+            data (str): the body.
+
+        Returns:
+            int: the response's status.
+        """
+        async with session.post('http://{}{}'.format(peer, path), data=data) as response:
+            return response.status
+
     async def find_peers(self):
         """Ask all peers for their peers.
         Returns:
             list: a list of the urls of all known peers.
         """
-        peers = []
+        async def ask(session, peer):
+            async with session.get('http://{}/peers'.format(peer)) as response:
+                return await response.json()
+
+        return [peer for peers in await self.fan_out(ask) for peer in peers]
+
+    async def announce(self, blocks=(), transactions=(), exclude=None):
+        """Advertise blocks and transactions to all peers by their hashes.
+        Args:
+            blocks (iterable): hashes of the blocks.
+            transactions (iterable): hashes of the transactions.
+            exclude (str, optional): a peer not to announce to, e.g. the one they came from.
+        """
+        data = dumps({'peer': self.url, 'blocks': list(blocks), 'transactions': list(transactions)})
+        await self.fan_out(lambda session, peer: self.post(session, peer, '/inv', data), exclude)
+
+    def relay(self, transactions):
+        """Queue transactions to be announced to all peers, in batches of at most self.relay_batch,
+        each sent once it's full or self.relay_interval after the first transaction was queued.
+        Args:
+            transactions (list): hashes of the transactions.
+        """
+        for hash_ in transactions:
+            self.seen.put(hash_, True)
+
+        self.relay_queue.extend(transactions)
+
+        while len(self.relay_queue) >= self.relay_batch:
+            batch, self.relay_queue = self.relay_queue[:self.relay_batch], self.relay_queue[self.relay_batch:]
+            self.background(self.announce(transactions=batch))
+
+        if self.relay_queue and (self.relay_task is None or self.relay_task.done()):
+            self.relay_task = self.background(self.flush_relay())
+
+    async def flush_relay(self):
+        await asyncio.sleep(self.relay_interval)
 
-        for peer in self.peers:
-            async with aiohttp.ClientSession() as session:
-                async with session.get('http://{}/peers'.format(peer)) as response:
-                    peers.append(await response.json())
+        batch, self.relay_queue = self.relay_queue, []
 
-        return peers
+        if batch:
+            await self.announce(transactions=batch)
 
     async def broadcast_transaction(self, transaction):
-        """Send all peers a transaction.
+        """Announce a transaction to all peers, along with any others relayed around the same time.
         Args:
             transaction (Transaction): transaction to send.
         """
-        peers = list(self.peers)
-        for peer in peers:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    await session.post('http://{}/transaction'.format(peer), data=repr(transaction))
-
-            except aiohttp.client_exceptions.ClientConnectorError:
-                self.peers.remove(peer)
+        self.relay([transaction.hash])
 
     async def broadcast_block(self, block):
-        """Send all peers a block.
+        """Announce a block to all peers, and send it to the websocket subscribers.
         Args:
             block (Block): transaction to send.
         """
-        peers = list(self.peers)
-        for peer in peers:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    await session.post('http://{}/block'.format(peer), data=repr(block))
-
-            except aiohttp.client_exceptions.ClientConnectorError:
-                self.peers.remove(peer)
+        self.seen.put(block.hash, True)
+        await self.announce(blocks=[block.hash])
+        await self.notify_subscribers(block)
 
-        if self.block_subscribers:
-            for subsciber in self.block_subscribers:
-                try:
-                    await subsciber.send(repr(block))
+    async def notify_subscribers(self, block):
+        for subsciber in list(self.block_subscribers):
+            try:
+                await subsciber.send(repr(block))
 
-                except ConnectionClosed:
-                    self.block_subscribers.remove(subsciber)
+            except ConnectionClosed:
+                self.block_subscribers.discard(subsciber)
 
 
 class Node(Blockchain, Peers):
     """A Node the communicates over Http using Sanic and requests."""
 
-    def __init__(self, port=8000, db='blockchain.db'):
+    # snapshots below the tip are only served at multiples of this height, and only the latest few of them,
+    # so each takes a bounded rollback and all of them stay cached
+    snapshot_interval = 1000
+    snapshot_checkpoints = 4
+
+    def __init__(self, port=8000, db='blockchain.db', cache_bytes=64 * 1024 * 1024, sync_batch=500, storage='sqlite', mining_workers=None,
+                 mempool_bytes=32 * 1024 * 1024, mempool_age=3 * 60 * 60, verify_workers=None, relay_batch=1000, mempool_entries=50000):
         self.port = port
         self.db = db
+        self.storage_backend = storage
+        self.mining_workers = mining_workers
+        self.mempool_entries = mempool_entries
+        self.mempool_bytes = mempool_bytes
+        self.mempool_age = mempool_age
+        self.verify_workers = verify_workers
+
+        # the last snapshot served at the tip, and those served at checkpoints, so each is only taken and encoded once
+        self.served_snapshot = None
+        self.checkpoint_snapshots = LRUCache(self.snapshot_checkpoints)
+        self.cache_bytes = cache_bytes
+        self.sync_batch = sync_batch
 
-        Peers.__init__(self)
+        # how many windows of blocks are downloaded and checked ahead of the one being applied
+        self.sync_lookahead = 2
+
+        Peers.__init__(self, relay_batch=relay_batch)
+        self.url = '{}:{}'.format(socket.gethostbyname(socket.getfqdn()), port)
 
         self.app = Sanic(__name__)
 
@@ -102,11 +298,17 @@ class Node(Blockchain, Peers):
             try:
                 block = Block.from_dict(loads(request.body.decode()))
 
-            except KeyError:
+                # hashing a header block packs its fields, which fails on mistyped ones
+                block.hash
+
+            except (KeyError, TypeError, ValueError, struct.error):
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            if not well_formed_block(block):
                 return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
 
             if await self.add_block(block):
-                await self.broadcast_block(block)
+                self.background(self.broadcast_block(block))
 
                 return response.json({'success': True}, headers={'Access-Control-Allow-Origin': '*'})
 
@@ -114,7 +316,6 @@ class Node(Blockchain, Peers):
 
         @self.app.route('/transaction', methods=['POST'])
         async def transaction(request):
-            print(request.body)
             if request.body is None:
                 return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
 
@@ -122,7 +323,7 @@ class Node(Blockchain, Peers):
                 transaction = Transaction.from_dict(
                     loads(request.body.decode()))
 
-            except KeyError:
+            except (KeyError, TypeError, ValueError):
                 return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
 
             if not await self.add_transaction(transaction):
@@ -132,10 +333,104 @@ class Node(Blockchain, Peers):
 
             return response.json({'success': True}, headers={'Access-Control-Allow-Origin': '*'})
 
+        @self.app.route('/transactions', methods=['POST'])
+        async def transactions(request):
+            try:
+                submitted = loads(request.body.decode())
+
+            except (AttributeError, ValueError):
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            if not isinstance(submitted, list) or len(submitted) > self.relay_batch:
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            # a malformed item only fails itself
+            transactions = []
+
+            for dict_ in submitted:
+                try:
+                    transaction = Transaction.from_dict(dict_)
+                    transactions.append(transaction if well_formed(transaction) else None)
+
+                except (KeyError, TypeError, ValueError, ArithmeticError):
+                    transactions.append(None)
+
+            valid = [t for t in transactions if t is not None]
+            fresh = {t.hash for t in valid if t.hash not in self.seen}
+            added = dict(zip((t.hash for t in valid), await self.add_transactions(valid)))
+
+            self.relay([hash_ for hash_ in fresh if added[hash_]])
+
+            results = [{'hash': t.hash, 'success': added[t.hash]} if t is not None else {'hash': None, 'success': False}
+                       for t in transactions]
+
+            return response.json({'success': all(result['success'] for result in results), 'results': results},
+                                 headers={'Access-Control-Allow-Origin': '*'})
+
+        @self.app.route('/transactions/find', methods=['POST'])
+        async def find_transactions(request):
+            try:
+                hashes = loads(request.body.decode())
+
+            except (AttributeError, ValueError):
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            if not isinstance(hashes, list) or len(hashes) > self.relay_batch:
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            found = [await self.find_transaction(hash_) if is_hash(hash_) else None for hash_ in hashes]
+
+            return response.json([loads(repr(t)) if t is not None else None for t in found], headers={'Access-Control-Allow-Origin': '*'})
+
+        @self.app.route('/inv', methods=['POST'])
+        async def inventory(request):
+            try:
+                inventory = loads(request.body.decode())
+                peer, blocks, transactions = inventory['peer'], list(inventory['blocks']), list(inventory['transactions'])
+
+            except (AttributeError, KeyError, TypeError, ValueError):
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            if not isinstance(peer, str) or not self.announcer(peer, request.ip):
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            blocks, transactions = await self.unseen(blocks, transactions)
+
+            if blocks or transactions:
+                self.background(self.fetch_inventory(peer, blocks, transactions))
+
+            return response.json({'success': True, 'requested': len(blocks) + len(transactions)}, headers={'Access-Control-Allow-Origin': '*'})
+
+        @self.app.route('/block/<blockhash>', methods=['GET'])
+        async def block_by_hash(request, blockhash):
+            try:
+                index = await self.storage.block_index(blockhash)
+
+            except ValueError:
+                index = None
+
+            if index is None or index < self.first_block:
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            return response.raw(await self.block_json(index), content_type='application/json', headers={'Access-Control-Allow-Origin': '*'})
+
+        @self.app.route('/transaction/<txhash>', methods=['GET'])
+        async def transaction_by_hash(request, txhash):
+            try:
+                transaction = await self.find_transaction(txhash)
+
+            except ValueError:
+                transaction = None
+
+            if transaction is None:
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            return response.json(loads(repr(transaction)), headers={'Access-Control-Allow-Origin': '*'})
+
         @self.app.route('/blocks/<index:number>', methods=['GET'])
         async def blocks(request, index):
             try:
-                return response.json(loads(repr(await self.block_from_index(index))), headers={'Access-Control-Allow-Origin': '*'})
+                return response.raw(await self.block_json(index), content_type='application/json', headers={'Access-Control-Allow-Origin': '*'})
 
             except IndexError:
                 return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
@@ -147,11 +442,53 @@ class Node(Blockchain, Peers):
         @self.app.route('/blockrange/<start:number>/<end:number>', methods=['GET'])
         async def blockrange(request, start, end):
             try:
-                return response.json(loads(repr(await self.blocks_from_range(start, end))), headers={'Access-Control-Allow-Origin': '*'})
+                return response.raw(await self.blocks_json(start, end), content_type='application/json', headers={'Access-Control-Allow-Origin': '*'})
+
+            except IndexError:
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+        @self.app.route('/headers/<start:number>/<end:number>', methods=['GET'])
+        async def headers(request, start, end):
+            try:
+                return response.raw(await self.headers_json(start, end), content_type='application/json', headers={'Access-Control-Allow-Origin': '*'})
+
+            except IndexError:
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+        @self.app.route('/proof/<txhash>', methods=['GET'])
+        async def proof(request, txhash):
+            try:
+                proof = await self.transaction_proof(txhash)
+
+            except ValueError:
+                proof = None
+
+            if proof is None:
+                return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
+
+            return response.json(proof, headers={'Access-Control-Allow-Origin': '*'})
+
+        @self.app.route('/snapshot', methods=['GET'])
+        async def snapshot(request):
+            return response.raw(await self.snapshot_data(), content_type='application/octet-stream', headers={'Access-Control-Allow-Origin': '*'})
+
+        @self.app.route('/snapshot/<height:number>', methods=['GET'])
+        async def snapshot_at(request, height):
+            try:
+                return response.raw(await self.snapshot_data(height), content_type='application/octet-stream', headers={'Access-Control-Allow-Origin': '*'})
 
             except IndexError:
                 return response.json({'success': False}, headers={'Access-Control-Allow-Origin': '*'})
 
+        @self.app.route('/cache', methods=['GET'])
+        async def cache(request):
+            return response.json(self.block_cache.stats(), headers={'Access-Control-Allow-Origin': '*'})
+
+        @self.app.route('/mining/stats', methods=['GET'])
+        async def mining_stats(request):
+            return response.json({'miner': self.miner.stats(), 'template': self.templates.stats(), 'difficulty': self.difficulty},
+                                 headers={'Access-Control-Allow-Origin': '*'})
+
         @self.app.route('/peers', methods=['GET', 'POST'])
         async def peers(request):
             if request.method == 'GET':
@@ -177,7 +514,17 @@ class Node(Blockchain, Peers):
 
         @self.app.route('/pending', methods=['GET'])
         async def pending(request):
-            return response.json(loads(repr(self.pending)), headers={'Access-Control-Allow-Origin': '*'})
+            stats = self.pending.stats()
+            return response.json(loads(repr(self.pending)), headers={'Access-Control-Allow-Origin': '*',
+                                                                     'X-Mempool-Count': str(stats['transactions']),
+                                                                     'X-Mempool-Bytes': str(stats['bytes']),
+                                                                     'X-Mempool-Evictions': str(stats['evictions']),
+                                                                     'X-Mempool-Expirations': str(stats['expirations'])})
+
+        @self.app.route('/pending/stats', methods=['GET'])
+        async def pending_stats(request):
+            return response.json(dict(self.pending.stats(), signature_cache=self.signatures.stats()),
+                                 headers={'Access-Control-Allow-Origin': '*'})
 
         @self.app.route('/config', methods=['GET'])
         async def config(request):
@@ -205,12 +552,140 @@ class Node(Blockchain, Peers):
         """Asynchronous POW task."""
         while True:
             block = await self.mine_block(reward_address, lowest_fee)
-            await self.add_block(block)
-            await self.broadcast_block(block)
+
+            if not await self.add_block(block):
+                # a competing block got in while this one was being solved
+                self.miner.orphans += 1
+                continue
+
+            self.background(self.broadcast_block(block))
 
     async def sync(self, uri):
         pass
 
+    async def unseen(self, blocks, transactions):
+        """Pick out the announced hashes that haven't been seen, and mark them seen so they're only fetched once.
+        Args:
+            blocks (list): hashes of announced blocks.
+            transactions (list): hashes of announced transactions.
+
+        Returns:
+            tuple: the hashes of the blocks and of the transactions to fetch.
+        """
+        wanted_blocks, wanted_transactions = [], []
+
+        for hash_ in blocks:
+            if not is_hash(hash_) or hash_ in self.seen or await self.storage.block_index(hash_) is not None:
+                continue
+
+            self.seen.put(hash_, True)
+            wanted_blocks.append(hash_)
+
+        for hash_ in transactions:
+            if not is_hash(hash_) or hash_ in self.seen or self.pending.get(hash_) is not None:
+                continue
+
+            self.seen.put(hash_, True)
+            wanted_transactions.append(hash_)
+
+        return wanted_blocks, wanted_transactions
+
+    async def fetch_inventory(self, peer, blocks, transactions):
+        """Fetch announced blocks and transactions from the peer that announced them, add them,
+        and announce the ones that were valid on to the other peers.
+        Args:
+            peer (str): the url of the peer that announced them.
+            blocks (list): hashes of the blocks to fetch, in order.
+            transactions (list): hashes of the transactions to fetch.
+        """
+        session = self.client()
+        added_transactions, added_blocks = [], []
+
+        # transactions are fetched in batches, one request for up to self.relay_batch of them
+        for start in range(0, len(transactions), self.relay_batch):
+            batch = transactions[start:start + self.relay_batch]
+
+            try:
+                async with self.requests:
+                    async with session.post('http://{}/transactions/find'.format(peer), data=dumps(batch)) as response:
+                        results = await response.json()
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                results = None
+
+            fetched = []
+
+            for hash_, result in zip(batch, results if isinstance(results, list) else [None] * len(batch)):
+                try:
+                    transaction = Transaction.from_dict(result)
+
+                except (KeyError, TypeError):
+                    transaction = None
+
+                if transaction is None or transaction.hash != hash_:
+                    # it can be fetched from whoever announces it next
+                    self.seen.discard(hash_)
+                    continue
+
+                fetched.append(transaction)
+
+            added_transactions.extend(t.hash for t, added in zip(fetched, await self.add_transactions(fetched)) if added)
+
+        for hash_ in blocks:
+            try:
+                async with self.requests:
+                    async with session.get('http://{}/block/{}'.format(peer, hash_)) as response:
+                        block = Block.from_dict(await response.json())
+
+                if block.hash != hash_ or not well_formed_block(block):
+                    raise ValueError('Peer {} sent the wrong block for {}.'.format(peer, hash_))
+
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, TypeError, ValueError, struct.error):
+                # it can be fetched from whoever announces it next
+                self.seen.discard(hash_)
+                continue
+
+            if await self.add_announced_block(session, peer, block):
+                added_blocks.append(hash_)
+                await self.notify_subscribers(block)
+
+            elif block.index >= self.chain_height:
+                # it may yet follow on from the tip once the blocks before it arrive, so it's fetched when next announced
+                self.seen.discard(hash_)
+
+        self.relay(added_transactions)
+
+        if added_blocks:
+            await self.announce(added_blocks, exclude=peer)
+
+    async def add_announced_block(self, session, peer, block):
+        """Add a block fetched from the peer that announced it. If it's ahead of the tip, the blocks in between,
+        up to self.sync_batch of them, are fetched from the same peer and added first.
+        Args:
+            session (aiohttp.ClientSession): the session to fetch with.
+            peer (str): the url of the peer that announced it.
+            block (Block): the block.
+
+        Returns:
+            bool: whether the block was added.
+        """
+        if block.index > self.chain_height:
+            start, end = self.chain_height, min(block.index, self.chain_height + self.sync_batch) - 1
+
+            try:
+                async with self.requests:
+                    async with session.get('http://{}/blockrange/{}/{}'.format(peer, start, end)) as response:
+                        ancestors = [Block.from_dict(ancestor) for ancestor in await response.json()]
+
+                # as many as follow on from the tip are added
+                usable = next((index for index, ancestor in enumerate(ancestors) if not well_formed_block(ancestor)), len(ancestors))
+                await self.add_batch(ancestors[:usable])
+
+            except FETCH_ERRORS:
+                pass
+
+        return await self.add_block(block)
+
     async def interface(self):
         """Asynchronous user input task."""
         logging.getLogger('root').setLevel('CRITICAL')
@@ -237,6 +712,16 @@ class Node(Blockchain, Peers):
                         except NameError:
                             print('The node is not mining.')
 
+                    elif cmd[1] == 'stats':
+                        stats = self.miner.stats()
+                        print('Mining: {}'.format('yes' if 'mining_task' in locals() else 'no'))
+                        print('Workers: {}, Difficulty: {}'.format(stats['workers'], self.difficulty))
+                        print('Hashrate: {} H/s (last round {} H/s)'.format(
+                            round(stats['hashrate'] or 0), round(stats['last_hashrate'] or 0)))
+                        print('Blocks: {}, Orphans: {}, Average Block Time: {}s'.format(
+                            stats['blocks'], stats['orphans'], round(stats['average_block_time'] or 0, 2)))
+                        print('Rounds: {}, Stale Rounds: {}'.format(stats['rounds'], stats['stale_rounds']))
+
                     else:
                         if 'mining_task' in locals():
                             print('The node is already mining.')
@@ -312,7 +797,7 @@ class Node(Blockchain, Peers):
                     print('Created Transaction {}'.format(transaction.hash))
 
                     await self.add_transaction(transaction)
-                    await self.broadcast_transaction(transaction)
+                    self.background(self.broadcast_transaction(transaction))
 
                     print('Broadcasting transaction...')
 
@@ -338,100 +823,178 @@ class Node(Blockchain, Peers):
                 for task in asyncio.Task.all_tasks():
                     task.cancel()
 
+                self.miner.close()
+                self.verifier.close()
+                await self.close_peers()
+
                 loop.stop()
 
-    async def sync(self, sync_url):
+    async def snapshot_data(self, height=None):
+        """Gets an encoded snapshot of the chain.
+        Args:
+            height (int, optional): the height to capture, the current height by default, otherwise one of
+                the last self.snapshot_checkpoints multiples of self.snapshot_interval.
+
+        Returns:
+            bytes: the encoded snapshot.
+
+        Raises:
+            IndexError: if snapshots aren't served at the height.
+        """
+        if height is not None and height != self.chain_height:
+            if height % self.snapshot_interval or not self.chain_height - self.snapshot_interval * self.snapshot_checkpoints < height < self.chain_height:
+                raise IndexError
+
+            data = self.checkpoint_snapshots.get(height)
+
+            if data is None:
+                data = await asyncio.get_event_loop().run_in_executor(None, encode_snapshot, await self.snapshot(height))
+                self.checkpoint_snapshots.put(height, data)
+
+            return data
+
+        height = self.chain_height
+
+        if self.served_snapshot is None or self.served_snapshot[0] != height:
+            snapshot = await self.snapshot(height)
+            self.served_snapshot = (height, await asyncio.get_event_loop().run_in_executor(None, encode_snapshot, snapshot))
+
+        return self.served_snapshot[1]
+
+    async def sync(self, sync_url, snapshot=None):
+        """Sync the chain from another node.
+        Args:
+            sync_url (str): url of the node.
+            snapshot (optional): True to bootstrap a new chain from the node's snapshot, or a snapshot file to bootstrap it from.
+        """
         # get rid of schema or extra / at end
         node_url = urlparse(sync_url).netloc if urlparse(
             sync_url).netloc else urlparse(sync_url).path
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get('http://{}/config'.format(node_url)) as response:
-                    config = await response.json()
+        session = self.client()
 
-            except aiohttp.client_exceptions.ClientConnectorError:
-                print('That node is not online.')
-                for task in asyncio.Task.all_tasks():
-                    task.cancel()
+        try:
+            async with session.get('http://{}/config'.format(node_url)) as response:
+                config = await response.json()
 
-                asyncio.get_event_loop().stop()
+        except aiohttp.client_exceptions.ClientConnectorError:
+            print('That node is not online.')
+            for task in asyncio.Task.all_tasks():
+                task.cancel()
 
-        if os.path.exists(self.db):
-            Blockchain.__init__(self, config_=config,
-                                db=self.db)
+            asyncio.get_event_loop().stop()
 
-            last_block = await self.last_block()
-            last_block_index = last_block.index
+        if snapshot is not None and not os.path.exists(self.db):
+            if snapshot is True:
+                async with session.get('http://{}/snapshot'.format(node_url)) as response:
+                    snapshot = decode_snapshot(await response.read())
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get('http://{}/blocks/{}'.format(node_url, last_block_index)) as response:
-                    if Block.from_dict(await response.json()).hash != last_block.hash:
-                        raise ValueError(
-                            'Unable to sync from that node, blocks are not the same.')
+            else:
+                snapshot = read_snapshot(snapshot)
+
+            if snapshot['config'] != config:
+                raise ValueError(
+                    'Unable to sync from that node, the snapshot is for a different chain.')
 
         else:
-            # don't use Blockchain.start_db so we don't mine genesis block
-            async with aiosqlite.connect(self.db) as db:
-                await db.executescript(startup_script)
-                await db.commit()
-
-            Blockchain.__init__(self, config_=config,
-                                db=self.db)
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get('http://{}/blocks/0'.format(node_url)) as response:
-                    block = Block.from_dict(await response.json())
-
-            if self.verify_genesis_block(block):
-                async with aiosqlite.connect(self.db) as db:
-                    await db.execute(block_template, (block.index, block.hash,
-                                                      block.nonce, block.previous_hash, block.timestamp))
-                    await db.execute(transaction_template, (block.hash, block.data[0].hash, block.data[0].to, block.data[0].from_, block.data[
-                        0].amount, block.data[0].timestamp, block.data[0].signature, block.data[0].nonce, block.data[0].fee))
-                    await db.commit()
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get('http://{}/height'.format(node_url)) as response:
-                peer_height = int(await response.text())
-
-        our_height = await self.height()
-
-        while peer_height != our_height:
-            async with aiohttp.ClientSession() as session:
-                # Sync in 50 block chunks to just in case
-                for x in range(math.floor(our_height / 50), math.ceil(peer_height / 50)):
-                    async with session.get('http://{}/blockrange/{}/{}'.format(node_url, our_height, our_height + 50 if our_height + 50 <= peer_height - 1 else peer_height - 1)) as response:
-                        # not using asyncio.wait or asyncio.gather to preserve order
-                        for block in await response.json():
-                            print(await self.add_block(Block.from_dict(block), syncing=True))
-
-                    our_height = await self.height()
+            snapshot = None
 
-                async with session.get('http://{}/height'.format(node_url)) as response:
-                    height = int(await response.text())
+        # an empty chain is created without mining a genesis block, it's downloaded instead
+        Blockchain.__init__(self, config_=config, db=self.db,
+                            cache_bytes=self.cache_bytes, storage=self.storage_backend, snapshot=snapshot,
+                            mining_workers=self.mining_workers, mempool_entries=self.mempool_entries,
+                            mempool_bytes=self.mempool_bytes, mempool_age=self.mempool_age, verify_workers=self.verify_workers)
+
+        if self.tip is not None:
+            async with session.get('http://{}/blocks/{}'.format(node_url, self.tip.index)) as response:
+                if Block.from_dict(await response.json()).hash != self.tip.hash:
+                    raise ValueError(
+                        'Unable to sync from that node, blocks are not the same.')
+
+        else:
+            async with session.get('http://{}/blocks/0'.format(node_url)) as response:
+                block = Block.from_dict(await response.json())
+
+            if not await self.add_genesis_block(block):
+                raise ValueError(
+                    'Unable to sync from that node, the genesis block is invalid.')
 
+        async with session.get('http://{}/height'.format(node_url)) as response:
+            peer_height = int(await response.text())
+
+        # blocks are downloaded from every peer the node knows of, not just the node itself
         self.peers.add(node_url)
 
         for node in await self.find_peers():
             self.peers.add(node)
 
-        peers = set(self.peers)
+        self.peers.discard(self.url)
+
+        while self.chain_height < peer_height:
+            # later windows are downloaded and checked while earlier ones are applied, in order
+            windows = asyncio.Queue(maxsize=self.sync_lookahead)
+            downloader = BlockDownloader(session, [node_url] + sorted(self.peers - {node_url}), self.chain_height, peer_height,
+                                         previous_hash=self.tip.hash, chunk_size=min(100, self.sync_batch),
+                                         max_chunk=self.sync_batch, window_size=self.sync_batch)
+            download = asyncio.ensure_future(downloader.run(windows, self.check_blocks))
 
-        for peer in peers:
             try:
-                async with aiohttp.ClientSession() as session:
-                    await session.post('http://{}/peers'.format(node_url), data='{}:{}'.format(socket.gethostbyname(socket.getfqdn()), self.port))
+                while True:
+                    window = await windows.get()
+
+                    if window is None:
+                        break
+
+                    if isinstance(window, Exception):
+                        raise window
+
+                    start, blocks, checks = window
+                    _, verified = await checks
 
-            except aiohttp.client_exceptions.ClientConnectorError:
-                self.peers.remove(peer)
+                    added = await self.add_blocks(blocks, syncing=True, batch_size=self.sync_batch, verified=verified,
+                                                  progress=lambda added, start=start: print(
+                                                      'Synced {}/{} blocks.'.format(start + added, peer_height)))
 
-    def run(self, sync=None):
-        """Spin up a blockchain and start the Sanic server."""
+                    if added < len(blocks):
+                        raise ValueError(
+                            'Unable to sync from that node, block {} is invalid.'.format(self.chain_height))
+
+            finally:
+                download.cancel()
+
+                while not windows.empty():
+                    window = windows.get_nowait()
+
+                    if isinstance(window, tuple):
+                        window[2].cancel()
+
+            if self.chain_height == peer_height:
+                # the node may have moved on while we were syncing
+                async with session.get('http://{}/height'.format(node_url)) as response:
+                    peer_height = int(await response.text())
+
+        # introduce ourselves to every peer, the ones that can't be reached are dropped
+        await self.fan_out(lambda session, peer: self.post(session, peer, '/peers', self.url))
+
+    def run(self, sync=None, verify_state=False, snapshot=None):
+        """Spin up a blockchain and start the Sanic server.
+        Args:
+            sync (str, optional): url of a node to sync from.
+            verify_state (bool, optional): replay the chain to audit the stored consensus state.
+            snapshot (optional): bootstrap a new chain from a snapshot file, or with True, from the sync node's snapshot.
+        """
         self.db = '{}{}'.format(self.port, self.db)
 
         if sync is not None:
-            asyncio.get_event_loop().run_until_complete(self.sync(sync))
+            asyncio.get_event_loop().run_until_complete(self.sync(sync, snapshot))
+
+        elif snapshot not in (None, True) and not os.path.exists(self.db):
+            Blockchain.__init__(self, db=self.db, cache_bytes=self.cache_bytes, storage=self.storage_backend,
+                                snapshot=read_snapshot(snapshot), mining_workers=self.mining_workers,
+                                mempool_entries=self.mempool_entries, mempool_bytes=self.mempool_bytes,
+                                mempool_age=self.mempool_age, verify_workers=self.verify_workers)
+
+            print('Started Blockchain from Snapshot.')
 
         elif not os.path.exists(self.db):
             with open('./config/keys.yaml') as key_file:
@@ -442,15 +1005,24 @@ class Node(Blockchain, Peers):
                     "No address found in 'keys.yaml', use 'python3 run.py generate' to generate a pair.")
 
             Blockchain.__init__(
-                self, genesis_address=address, db=self.db)
+                self, genesis_address=address, db=self.db, cache_bytes=self.cache_bytes, storage=self.storage_backend,
+                mining_workers=self.mining_workers, mempool_entries=self.mempool_entries,
+                mempool_bytes=self.mempool_bytes, mempool_age=self.mempool_age, verify_workers=self.verify_workers)
 
             print('Started Blockchain and Mined Genesis Block.')
 
         else:
-            Blockchain.__init__(self, db=self.db)
+            Blockchain.__init__(self, db=self.db, verify_state=verify_state, cache_bytes=self.cache_bytes,
+                                storage=self.storage_backend, mining_workers=self.mining_workers,
+                                mempool_entries=self.mempool_entries, mempool_bytes=self.mempool_bytes,
+                                mempool_age=self.mempool_age, verify_workers=self.verify_workers)
 
             print('Loaded Blockchain from Database.')
 
+        # forked now, before the server is running
+        self.miner.start()
+        self.verifier.start()
+
         loop = asyncio.get_event_loop()
 
         self.app.add_task(self.interface())
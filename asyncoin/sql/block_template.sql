@@ -1,2 +1,2 @@
-INSERT INTO BLOCKS (NUMBER, HASH, NONCE, PREVIOUSHASH, TIMESTAMP)
-VALUES (?, ?, ?, ?, ?);
+INSERT INTO BLOCKS (NUMBER, HASH, NONCE, PREVIOUSHASH, TIMESTAMP, VERSION, MERKLEROOT)
+VALUES (?, ?, ?, ?, ?, ?, ?);
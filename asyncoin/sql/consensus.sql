@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS CONSENSUS(
+    ID INT NOT NULL CHECK (ID = 0),
+    HEIGHT INT NOT NULL,
+    DIFFICULTY INT NOT NULL,
+    REWARD DECIMAL (18, 18) NOT NULL,
+    EPOCH_TIMESTAMP DECIMAL (18, 18),
+    TIP_HASH CHAR(64),
+    TIP_TIMESTAMP DECIMAL (18, 18),
+    PRIMARY KEY (ID)
+);
@@ -0,0 +1,2 @@
+INSERT OR REPLACE INTO CONSENSUS (ID, HEIGHT, DIFFICULTY, REWARD, EPOCH_TIMESTAMP, TIP_HASH, TIP_TIMESTAMP)
+VALUES (0, ?, ?, ?, ?, ?, ?);
@@ -0,0 +1,2 @@
+ALTER TABLE BLOCKS ADD COLUMN VERSION INT NOT NULL DEFAULT 1;
+ALTER TABLE CONFIG ADD COLUMN HEADER_ACTIVATION INT;
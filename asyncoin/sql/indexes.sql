@@ -0,0 +1,9 @@
+CREATE INDEX IF NOT EXISTS BLOCKS_HASH ON BLOCKS (HASH);
+
+CREATE INDEX IF NOT EXISTS TRANSACTIONS_BLOCKHASH ON TRANSACTIONS (BLOCKHASH);
+
+CREATE INDEX IF NOT EXISTS TRANSACTIONS_SENDER ON TRANSACTIONS (SENDER, NONCE);
+
+CREATE INDEX IF NOT EXISTS TRANSACTIONS_RECEIVER ON TRANSACTIONS (RECEIVER);
+
+ANALYZE;
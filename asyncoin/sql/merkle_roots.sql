@@ -0,0 +1 @@
+ALTER TABLE BLOCKS ADD COLUMN MERKLEROOT CHAR(64);
@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS ACCOUNTS(
+    ADDRESS CHAR(96) NOT NULL,
+    BALANCE DECIMAL (18, 18) NOT NULL,
+    NONCE INT NOT NULL,
+    PRIMARY KEY (ADDRESS)
+);
+
+DELETE FROM ACCOUNTS;
+
+INSERT INTO ACCOUNTS (ADDRESS, BALANCE, NONCE)
+SELECT ADDRESS, SUM(DELTA), SUM(SENT) FROM (
+    SELECT RECEIVER AS ADDRESS, AMOUNT AS DELTA, 0 AS SENT FROM TRANSACTIONS
+    UNION ALL
+    SELECT SENDER AS ADDRESS, -(AMOUNT + FEE) AS DELTA, 1 AS SENT FROM TRANSACTIONS
+)
+GROUP BY ADDRESS;
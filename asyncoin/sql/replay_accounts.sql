@@ -0,0 +1,15 @@
+DELETE FROM ACCOUNTS;
+
+WITH APPLIED AS (
+    SELECT TRANSACTIONS.* FROM TRANSACTIONS JOIN BLOCKS ON TRANSACTIONS.BLOCKHASH = BLOCKS.HASH
+    WHERE BLOCKS.NUMBER >= (SELECT COALESCE(MAX(HEIGHT), 0) FROM SNAPSHOT)
+)
+INSERT INTO ACCOUNTS (ADDRESS, BALANCE, NONCE)
+SELECT ADDRESS, SUM(DELTA), SUM(SENT) FROM (
+    SELECT ADDRESS, BALANCE AS DELTA, NONCE AS SENT FROM SNAPSHOT_ACCOUNTS
+    UNION ALL
+    SELECT RECEIVER AS ADDRESS, AMOUNT AS DELTA, 0 AS SENT FROM APPLIED
+    UNION ALL
+    SELECT SENDER AS ADDRESS, -(AMOUNT + FEE) AS DELTA, 1 AS SENT FROM APPLIED
+)
+GROUP BY ADDRESS;
@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS SNAPSHOT(
+    ID INT NOT NULL CHECK (ID = 0),
+    FIRST_BLOCK INT NOT NULL,
+    HEIGHT INT NOT NULL,
+    DIFFICULTY INT NOT NULL,
+    REWARD DECIMAL (18, 18) NOT NULL,
+    EPOCH_TIMESTAMP DECIMAL (18, 18),
+    TIP_HASH CHAR(64) NOT NULL,
+    PRIMARY KEY (ID)
+);
+CREATE TABLE IF NOT EXISTS SNAPSHOT_ACCOUNTS(
+    ADDRESS CHAR(96) NOT NULL,
+    BALANCE DECIMAL (18, 18) NOT NULL,
+    NONCE INT NOT NULL,
+    PRIMARY KEY (ADDRESS)
+);
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+
+class StorageError(Exception):
+    """A write conflicted with what's already stored and was rolled back."""
+
+
+class Storage:
+    """Where a blockchain's blocks, account state and consensus state are kept.
+
+    The synchronous methods are only used while a Blockchain is being constructed,
+    everything else is asynchronous.
+
+    Attributes:
+        path (str): where the chain is stored.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): where the chain is stored.
+        """
+        self.path = path
+
+    def exists(self):
+        """
+        Returns:
+            bool: whether a chain has been stored at this path.
+        """
+        raise NotImplementedError
+
+    def create(self, config_):
+        """Set up empty storage for a new chain.
+        Args:
+            config_ (dict): configuration of the chain.
+        """
+        raise NotImplementedError
+
+    def load(self):
+        """Bring the storage up to date and read back what's needed to resume the chain.
+        Returns:
+            tuple:
+                dict: configuration of the chain, None if it hasn't been saved.
+                tuple: the checkpointed height, difficulty, reward, epoch timestamp and tip hash, None if there isn't one.
+        """
+        raise NotImplementedError
+
+    def import_snapshot(self, snapshot, blocks):
+        """Set up storage for a chain bootstrapped from a snapshot, instead of from genesis.
+        Args:
+            snapshot (dict): the snapshot, see Blockchain.snapshot.
+            blocks (list): the snapshot's blocks, decoded.
+        """
+        raise NotImplementedError
+
+    def load_base(self):
+        """
+        Returns:
+            tuple: the index of the oldest stored block, and the height, difficulty, reward, epoch timestamp
+            and tip hash of the snapshot the chain was bootstrapped from. None if it was started from genesis.
+        """
+        raise NotImplementedError
+
+    def save_config(self, config_):
+        raise NotImplementedError
+
+    def save_state(self, state):
+        """Checkpoint consensus state outside of a block write.
+        Args:
+            state (tuple): the height, difficulty, reward, epoch timestamp and tip hash.
+        """
+        raise NotImplementedError
+
+    def headers(self, height=None):
+        """
+        Args:
+            height (int, optional): stop before the block at this index.
+
+        Returns:
+            iterable: (index, hash, timestamp) of every block, in order.
+        """
+        raise NotImplementedError
+
+    def load_tip(self, height, count):
+        """
+        Args:
+            height (int): the height of the chain.
+            count (int): how many of the latest timestamps to load.
+
+        Returns:
+            tuple:
+                Block: the last block.
+                list: timestamps of the last 'count' blocks, oldest first.
+        """
+        raise NotImplementedError
+
+    async def read_blocks(self, start, end):
+        """
+        Args:
+            start (int): index of the first block.
+            end (int): index of the last block.
+
+        Returns:
+            list: the blocks, in order.
+        """
+        raise NotImplementedError
+
+    async def read_json(self, start, end):
+        """
+        Args:
+            start (int): index of the first block.
+            end (int): index of the last block.
+
+        Returns:
+            list: the JSON serialization (bytes) of each block, in order.
+        """
+        raise NotImplementedError
+
+    async def read_headers(self, start, end):
+        """
+        Args:
+            start (int): index of the first block.
+            end (int): index of the last block.
+
+        Returns:
+            list: the blocks' headers (BlockHeader), in order.
+        """
+        return [block.header() for block in await self.read_blocks(start, end)]
+
+    async def read_state(self):
+        """Read the consensus checkpoint and the account states as of the same height, without holding up writes.
+        Returns:
+            tuple:
+                tuple: the height, difficulty, reward, epoch timestamp and tip hash.
+                list: the address, balance and nonce of every account.
+        """
+        raise NotImplementedError
+
+    async def block_index(self, hash_):
+        """Find a block's height from its hash.
+        Args:
+            hash_ (str): hexadecimal hash of the block.
+
+        Returns:
+            int: the block's index, None if it isn't in the chain.
+        """
+        raise NotImplementedError
+
+    async def transaction_block(self, hash_):
+        """Find the block a transaction was included in.
+        Args:
+            hash_ (str): hexadecimal hash of the transaction.
+
+        Returns:
+            int: the block's index, None if the transaction isn't in the chain.
+        """
+        raise NotImplementedError
+
+    async def get_account(self, address):
+        """
+        Args:
+            address (str): the account's address.
+
+        Returns:
+            tuple: the account's balance and nonce, None if it has never been used.
+        """
+        raise NotImplementedError
+
+    def write(self):
+        """Start a write transaction. Only one is open at a time.
+        Returns:
+            async context manager yielding an object with 'get_account', 'accounts' and 'write_blocks' coroutines,
+            which commits on success and rolls back on error.
+        """
+        raise NotImplementedError
+
+    async def rebuild_accounts(self):
+        """Recompute the account state from the full transaction history."""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
@@ -0,0 +1,553 @@
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import json
+import struct
+
+import asyncio
+
+from asyncoin.cryptocurrency.block import Block, BlockHeader, HEADER
+from asyncoin.storage.backend import StorageError
+from asyncoin.storage.sqlite import SQLiteStorage, SQLiteWrite
+
+# segment number, offset and length of a block's record, one per height
+HEIGHT_RECORD = struct.Struct('<IQI')
+
+# binary block (or transaction) hash and block height, in the order blocks were appended
+HASH_RECORD = struct.Struct('<32sQ')
+
+
+def header_record(block):
+    return HEADER.unpack(block.header().pack())
+
+
+def record_header(record):
+    version, index, previous_hash, merkle_root, timestamp, nonce = record
+
+    # the genesis block's previous hash is packed as zeros
+    return BlockHeader(version, index, previous_hash.hex() if any(previous_hash) else '0', merkle_root.hex(), timestamp, nonce)
+
+
+class MappedIndex:
+    """An append-only file of fixed-size records, read through a memory map.
+    Attributes:
+        path (str): path to the index file.
+        record (struct.Struct): layout of each record.
+        count (int): number of records in the index.
+    """
+
+    def __init__(self, path, record):
+        self.path = path
+        self.record = record
+        self.count = 0
+
+        self.file = None
+        self.map = None
+
+    def open(self):
+        self.file = open(self.path, 'a+b', buffering=0)
+        self.count = os.fstat(self.file.fileno()).st_size // self.record.size
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.map = None
+
+    def append(self, records):
+        self.file.write(b''.join(self.record.pack(*record) for record in records))
+        self.count += len(records)
+
+    def truncate(self, count):
+        self.file.truncate(count * self.record.size)
+        self.count = count
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError
+
+        end = (index + 1) * self.record.size
+
+        if self.map is None or len(self.map) < end:
+            # remap to take in what's been appended, readers holding the old map keep it alive
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self.record.unpack_from(self.map, index * self.record.size)
+
+    def __len__(self):
+        return self.count
+
+
+class HashTable:
+    """An open addressing hash table of (hash, height) records, kept in a file and read and written through
+    a memory map, so looking a hash up touches a few pages rather than loading the whole index.
+
+    The keys are SHA-256 digests, already evenly spread, so their leading bytes pick the slot directly and
+    collisions are resolved by probing the following slots. An all zero slot is empty. The table is rebuilt
+    from the append-only index it mirrors whenever their counts disagree, e.g. after a truncation or a crash.
+
+    Attributes:
+        path (str): path to the table file.
+        capacity (int): number of slots, a power of two, kept at least twice the number of records.
+        count (int): number of records put in the table, a hash put twice counted twice, as in the index it mirrors.
+    """
+
+    # number of records, followed by the slots
+    HEADER = struct.Struct('<Q')
+    EMPTY = bytes(HASH_RECORD.size)
+
+    def __init__(self, path, min_capacity=4096):
+        self.path = path
+        self.min_capacity = min_capacity
+        self.capacity = 0
+        self.count = 0
+
+        self.file = None
+        self.map = None
+
+    def open(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.HEADER.size + self.min_capacity * HASH_RECORD.size:
+            self.create(self.path, self.min_capacity)
+
+        self.file = open(self.path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.capacity = (len(self.map) - self.HEADER.size) // HASH_RECORD.size
+        self.count = self.HEADER.unpack_from(self.map, 0)[0]
+
+    def close(self):
+        if self.file is not None:
+            self.map.close()
+            self.file.close()
+            self.file = None
+            self.map = None
+
+    def create(self, path, capacity):
+        with open(path, 'wb') as file:
+            file.truncate(self.HEADER.size + capacity * HASH_RECORD.size)
+
+    def find(self, map_, capacity, key):
+        """
+        Returns:
+            int: offset of the slot holding the key, or of the empty slot it would go in.
+        """
+        slot = int.from_bytes(key[:8], 'little') & (capacity - 1)
+
+        while True:
+            offset = self.HEADER.size + slot * HASH_RECORD.size
+            record = map_[offset:offset + HASH_RECORD.size]
+
+            if record[:32] == key or record == self.EMPTY:
+                return offset
+
+            slot = (slot + 1) & (capacity - 1)
+
+    def get(self, key):
+        """
+        Args:
+            key (bytes): the binary hash.
+
+        Returns:
+            int: the height recorded for the hash, None if it isn't in the table.
+        """
+        stored, height = HASH_RECORD.unpack_from(self.map, self.find(self.map, self.capacity, key))
+
+        return height if stored == key else None
+
+    def put(self, records):
+        """Add records, growing the table first if it would be over half full.
+        Args:
+            records (list): (binary hash, height) pairs, a later record for the same hash replaces the earlier one.
+        """
+        if 2 * (self.count + len(records)) > self.capacity:
+            self.resize(self.count + len(records))
+
+        for key, height in records:
+            HASH_RECORD.pack_into(self.map, self.find(self.map, self.capacity, key), key, height)
+
+        self.count += len(records)
+        self.HEADER.pack_into(self.map, 0, self.count)
+
+    def resize(self, count, records=None):
+        """Rehash into a new file with room for 'count' records, from this table or from 'records' instead.
+        Args:
+            count (int): how many records the table should have room for.
+            records (MappedIndex, optional): the records to fill it with, this table's own if not given.
+        """
+        capacity = self.min_capacity
+        while capacity < 2 * count:
+            capacity *= 2
+
+        path = '{}.tmp'.format(self.path)
+        self.create(path, capacity)
+
+        if records is None:
+            mirrored = self.count
+            records = (HASH_RECORD.unpack_from(self.map, self.HEADER.size + slot * HASH_RECORD.size) for slot in range(self.capacity))
+
+        else:
+            mirrored = len(records)
+
+        with open(path, 'r+b') as file:
+            map_ = mmap.mmap(file.fileno(), 0)
+
+            for key, height in records:
+                if key != self.EMPTY[:32]:
+                    HASH_RECORD.pack_into(map_, self.find(map_, capacity, key), key, height)
+
+            self.HEADER.pack_into(map_, 0, mirrored)
+            map_.close()
+
+        self.close()
+        os.replace(path, self.path)
+        self.open()
+
+    def rebuild(self, index):
+        """Refill the table from the index it mirrors."""
+        self.resize(len(index), index)
+
+    def sync(self):
+        self.map.flush()
+
+
+class FlatFileStorage(SQLiteStorage):
+    """Keeps blocks in append-only segment files, and account and consensus state in SQLite.
+
+    Blocks are stored as their JSON serialization, so a range of blocks is served by reading
+    contiguous bytes, without decoding anything. Memory mapped indexes locate blocks by height
+    and by hash. Block files are synced before the state that refers to them is committed,
+    and anything past the committed height is truncated away when the chain is loaded.
+
+    Attributes:
+        directory (str): where the segment and index files are kept.
+        segment_size (int): size after which a new segment file is started.
+        first (int): index of the oldest stored block, only non-zero for chains bootstrapped from a snapshot.
+        heights (MappedIndex): segment, offset and length of every block, by height.
+        hashes (MappedIndex): hash and height of every block.
+        transactions (MappedIndex): hash and block height of every transaction.
+        header_records (MappedIndex): the packed header of every block, by height.
+        by_hash (HashTable): the height of every block, by hash.
+        by_transaction (HashTable): the block height of every transaction, by hash.
+    """
+
+    def __init__(self, path, segment_size=128 * 1024 * 1024):
+        """
+        Args:
+            path (str): path to the SQLite database, the block files go in a directory beside it.
+            segment_size (int, optional): size after which a new segment file is started.
+        """
+        super().__init__(path)
+
+        self.directory = '{}.blocks'.format(os.path.splitext(path)[0])
+        self.segment_size = segment_size
+        self.first = 0
+
+        self.heights = MappedIndex(os.path.join(self.directory, 'heights.idx'), HEIGHT_RECORD)
+        self.hashes = MappedIndex(os.path.join(self.directory, 'hashes.idx'), HASH_RECORD)
+        self.transactions = MappedIndex(os.path.join(self.directory, 'transactions.idx'), HASH_RECORD)
+        self.header_records = MappedIndex(os.path.join(self.directory, 'headers.idx'), HEADER)
+
+        self.by_hash = HashTable(os.path.join(self.directory, 'hashes.tbl'))
+        self.by_transaction = HashTable(os.path.join(self.directory, 'transactions.tbl'))
+
+        self.segment = None
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, 'blk{:05d}.dat'.format(number))
+
+    def open_files(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+        if self.heights.file is None:
+            self.heights.open()
+            self.hashes.open()
+            self.transactions.open()
+            self.header_records.open()
+            self.by_hash.open()
+            self.by_transaction.open()
+            self.reconcile()
+
+    def reconcile(self):
+        """Rebuild the hash tables that don't match their indexes."""
+        for table, index in ((self.by_hash, self.hashes), (self.by_transaction, self.transactions)):
+            if table.count != len(index):
+                table.rebuild(index)
+
+    def create(self, config_):
+        super().create(config_)
+        self.open_files()
+
+    def load(self):
+        config_, state = super().load()
+        self.open_files()
+
+        base = self.load_base()
+        self.first = base[0] if base is not None else 0
+
+        height = state[0] if state is not None else 0
+
+        if self.first + len(self.heights) < height:
+            raise ValueError('The block files in {} are behind the chain state, was this chain stored with another backend?'.format(
+                self.directory))
+
+        self.truncate(max(height - self.first, 0))
+
+        # block files from before transactions, or headers, were indexed, every block has at least its reward transaction
+        index_transactions = len(self.heights) and not len(self.transactions)
+        index_headers = len(self.header_records) != len(self.heights)
+
+        if index_transactions or index_headers:
+            height = self.first + len(self.heights)
+            self.header_records.truncate(0 if index_headers else len(self.header_records))
+
+            for start in range(self.first, height, 1000):
+                for data in self.read_range(start, min(start + 1000, height) - 1):
+                    block = Block.from_dict(json.loads(data.decode()))
+
+                    if index_transactions:
+                        self.transactions.append([(bytes.fromhex(t.hash), block.index) for t in block])
+
+                    if index_headers:
+                        self.header_records.append([header_record(block)])
+
+            self.transactions.sync()
+            self.header_records.sync()
+            self.reconcile()
+
+        return config_, state
+
+    def import_blocks(self, conn, blocks):
+        self.first = blocks[0].index
+        self.open_files()
+        self.append(blocks)
+        self.sync()
+
+    def truncate(self, count):
+        """Drop everything written after the first 'count' stored blocks."""
+        segment, end = 0, 0
+
+        if count:
+            segment, offset, length = self.heights[count - 1]
+            end = offset + length
+
+        self.heights.truncate(count)
+        self.hashes.truncate(count)
+
+        # transaction records are in height order, so the first one past the kept blocks is found by bisection
+        low, high = 0, len(self.transactions)
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.transactions[middle][1] < self.first + count:
+                low = middle + 1
+
+            else:
+                high = middle
+
+        self.transactions.truncate(low)
+        self.header_records.truncate(min(count, len(self.header_records)))
+        self.reconcile()
+
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+        if os.path.exists(self.segment_path(segment)):
+            with open(self.segment_path(segment), 'r+b') as file:
+                file.truncate(end)
+
+        number = segment + 1
+        while os.path.exists(self.segment_path(number)):
+            os.remove(self.segment_path(number))
+            number += 1
+
+    def append(self, blocks):
+        """Append blocks to the segment files and indexes, and put them in the hash tables, without syncing them.
+        Args:
+            blocks (list): the blocks to append, in order.
+        """
+        self.put(*self.write_files(blocks))
+
+    def write_files(self, blocks):
+        """Append blocks to the segment files and indexes, the part of self.append that can run off the event loop.
+        Args:
+            blocks (list): the blocks to append, in order.
+
+        Returns:
+            tuple: the (hash, height) records of the blocks and of their transactions, to put in the hash tables.
+        """
+        segment, end = 0, 0
+
+        if len(self.heights):
+            segment, offset, length = self.heights[len(self.heights) - 1]
+            end = offset + length
+
+        if self.segment is None:
+            self.segment = open(self.segment_path(segment), 'ab')
+
+        height_records, hash_records, transaction_records, header_records = [], [], [], []
+
+        for block in blocks:
+            data = repr(block).encode()
+
+            if end and end + len(data) > self.segment_size:
+                self.segment.close()
+                segment, end = segment + 1, 0
+                self.segment = open(self.segment_path(segment), 'ab')
+
+            self.segment.write(data)
+            height_records.append((segment, end, len(data)))
+            hash_records.append((bytes.fromhex(block.hash), block.index))
+            transaction_records.extend((bytes.fromhex(t.hash), block.index) for t in block)
+            header_records.append(header_record(block))
+            end += len(data)
+
+        # the segment is flushed first so a height record never points past the data
+        self.segment.flush()
+        self.heights.append(height_records)
+        self.hashes.append(hash_records)
+        self.transactions.append(transaction_records)
+        self.header_records.append(header_records)
+
+        return hash_records, transaction_records
+
+    def put(self, hash_records, transaction_records):
+        # the tables are read on the event loop, and a put may remap them, so they're only written there
+        self.by_hash.put(hash_records)
+        self.by_transaction.put(transaction_records)
+
+    def sync(self):
+        if self.segment is not None:
+            os.fsync(self.segment.fileno())
+
+        self.heights.sync()
+        self.hashes.sync()
+        self.transactions.sync()
+        self.header_records.sync()
+        self.by_hash.sync()
+        self.by_transaction.sync()
+
+    def read_range(self, start, end):
+        """Read the serialized blocks in a range, one contiguous read per segment.
+        Args:
+            start (int): index of the first block.
+            end (int): index of the last block.
+
+        Returns:
+            list: the JSON serialization (bytes) of each block.
+        """
+        records = [self.heights[index - self.first] for index in range(start, end + 1)]
+        blocks = []
+
+        while records:
+            segment = records[0][0]
+            run = [record for record in records if record[0] == segment]
+            records = records[len(run):]
+
+            with open(self.segment_path(segment), 'rb') as file:
+                file.seek(run[0][1])
+                data = memoryview(file.read(run[-1][1] + run[-1][2] - run[0][1]))
+
+            blocks.extend(bytes(data[offset - run[0][1]:offset - run[0][1] + length]) for _, offset, length in run)
+
+        return blocks
+
+    def headers(self, height=None):
+        height = self.first + len(self.heights) if height is None else min(height, self.first + len(self.heights))
+
+        for start in range(self.first, height, 1000):
+            for data in self.read_range(start, min(start + 1000, height) - 1):
+                block = json.loads(data.decode())
+                yield block['index'], block['hash'], block['timestamp']
+
+    def load_tip(self, height, count):
+        blocks = [json.loads(data.decode()) for data in self.read_range(max(height - count, self.first), height - 1)]
+        return Block.from_dict(blocks[-1]), [block['timestamp'] for block in blocks]
+
+    async def read_json(self, start, end):
+        return await asyncio.get_event_loop().run_in_executor(None, self.read_range, start, end)
+
+    async def read_blocks(self, start, end):
+        return [Block.from_dict(json.loads(data.decode())) for data in await self.read_json(start, end)]
+
+    async def read_headers(self, start, end):
+        return [record_header(self.header_records[index - self.first]) for index in range(start, end + 1)]
+
+    async def block_index(self, hash_):
+        return self.by_hash.get(bytes.fromhex(hash_))
+
+    async def transaction_block(self, hash_):
+        return self.by_transaction.get(bytes.fromhex(hash_))
+
+    def write(self):
+        return FlatFileWrite(self)
+
+    async def rebuild_accounts(self):
+        base = self.load_base()
+        start, height = base[1] if base is not None else 0, self.first + len(self.heights)
+
+        # the history before a snapshot isn't stored, so replay starts from the snapshot's accounts
+        accounts = {address: [balance, nonce] for address, balance, nonce in await self.pool.fetchall('SELECT * FROM "SNAPSHOT_ACCOUNTS"')}
+
+        for start in range(start, height, 1000):
+            for block in await self.read_blocks(start, min(start + 1000, height) - 1):
+                for t in block:
+                    accounts.setdefault(t.to, [0, 0])[0] += t.amount
+                    sender = accounts.setdefault(t.from_, [0, 0])
+                    sender[0] -= t.amount + t.fee
+                    sender[1] += 1
+
+        async with self.pool.write() as db:
+            await db.execute('DELETE FROM "ACCOUNTS"')
+            await db.executemany('INSERT INTO "ACCOUNTS" VALUES (?, ?, ?)', [(address, balance, nonce) for address, (balance, nonce) in accounts.items()])
+
+    async def close(self):
+        await super().close()
+
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+        self.heights.close()
+        self.hashes.close()
+        self.transactions.close()
+        self.header_records.close()
+        self.by_hash.close()
+        self.by_transaction.close()
+
+
+class FlatFileWrite(SQLiteWrite):
+    """A write transaction that appends blocks to the block files and commits state to SQLite."""
+
+    async def __aenter__(self):
+        await super().__aenter__()
+        self.storage.open_files()
+        self.height = len(self.storage.heights)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, self.storage.sync)
+
+            except OSError as error:
+                self.storage.truncate(self.height)
+                await super().__aexit__(type(error), error, error.__traceback__)
+                raise
+
+            return await super().__aexit__(None, None, None)
+
+        self.storage.truncate(self.height)
+        return await super().__aexit__(exc_type, exc, tb)
+
+    async def write_chain(self, blocks):
+        hashes = [bytes.fromhex(t.hash) for block in blocks for t in block]
+
+        # there's no primary key to reject a transaction that's already in the chain, as there is in SQLite
+        if len(set(hashes)) < len(hashes) or any(self.storage.by_transaction.get(hash_) is not None for hash_ in hashes):
+            raise StorageError('A transaction is already in the chain.')
+
+        self.storage.put(*await asyncio.get_event_loop().run_in_executor(None, self.storage.write_files, blocks))
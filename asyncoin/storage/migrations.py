@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/rebuild_accounts.sql')) as script:
+    rebuild_accounts_script = script.read()
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/indexes.sql')) as script:
+    indexes_script = script.read()
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/consensus.sql')) as script:
+    consensus_script = script.read()
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/snapshot.sql')) as script:
+    snapshot_script = script.read()
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/headers.sql')) as script:
+    headers_script = script.read()
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/merkle_roots.sql')) as script:
+    merkle_roots_script = script.read()
+
+# migration n takes a database from schema version n to n + 1, version 0 being 'startup.sql'
+MIGRATIONS = [
+    rebuild_accounts_script,
+    indexes_script,
+    # left empty, Blockchain fills it in by replaying the chain the first time it loads
+    consensus_script,
+    # empty unless the chain was bootstrapped from a snapshot
+    snapshot_script,
+    # existing blocks keep the version 1 format, and existing chains don't activate headers until configured to
+    headers_script,
+    # blocks written before it have none, their headers are worked out from the block instead
+    merkle_roots_script
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn):
+    """Get the schema version of a database.
+    Args:
+        conn (sqlite3.Connection): connection to the database.
+
+    Returns:
+        int: the schema version, 0 for databases from before versioning.
+    """
+    conn.execute('CREATE TABLE IF NOT EXISTS SCHEMA_VERSION (VERSION INT NOT NULL)')
+    version = conn.execute('SELECT VERSION FROM SCHEMA_VERSION').fetchone()
+
+    if version is None:
+        conn.execute('INSERT INTO SCHEMA_VERSION VALUES (0)')
+        conn.commit()
+        return 0
+
+    return version[0]
+
+
+def migrate(conn):
+    """Migrate a database in place to the latest schema version.
+    Each migration is applied in its own transaction along with its version bump.
+    Args:
+        conn (sqlite3.Connection): connection to the database.
+
+    Returns:
+        int: the number of migrations applied.
+    """
+    version = schema_version(conn)
+
+    if version > SCHEMA_VERSION:
+        raise ValueError('Database schema version {} is newer than this node supports ({}).'.format(
+            version, SCHEMA_VERSION))
+
+    for number, script in enumerate(MIGRATIONS[version:], version + 1):
+        conn.executescript('BEGIN;\n{}\nUPDATE SCHEMA_VERSION SET VERSION = {};\nCOMMIT;'.format(script, number))
+
+    return SCHEMA_VERSION - version
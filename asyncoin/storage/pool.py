@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+import aiosqlite
+
+
+class ConnectionPool:
+    """A small pool of persistent SQLite connections: one writer and several readers.
+    Attributes:
+        path (str): path to the database file.
+        size (int): the number of reader connections.
+        cache_size (int): page cache size of each connection, in KiB.
+        mmap_size (int): maximum number of bytes of the database to memory map.
+        cached_statements (int): number of prepared statements each connection keeps.
+    """
+
+    def __init__(self, path, readers=4, cache_size=16384, mmap_size=268435456, cached_statements=256):
+        """
+        Args:
+            path (str): path to the database file.
+            readers (int, optional): the number of reader connections.
+            cache_size (int, optional): page cache size of each connection, in KiB.
+            mmap_size (int, optional): maximum number of bytes of the database to memory map.
+            cached_statements (int, optional): number of prepared statements each connection keeps.
+        """
+        self.path = path
+        self.size = readers
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+
+        self.writer = None
+        self.readers = None
+        self.write_lock = None
+
+        self._opening = None
+
+    async def connect(self):
+        """Open a connection to the database with the pool's tuning applied.
+        Returns:
+            aiosqlite.Connection: the new connection.
+        """
+        conn = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+        await conn.execute('PRAGMA cache_size = -{}'.format(self.cache_size))
+        await conn.execute('PRAGMA mmap_size = {}'.format(self.mmap_size))
+        await conn.execute('PRAGMA temp_store = MEMORY')
+
+        return conn
+
+    async def open(self):
+        """Open the pool's connections if they aren't open already."""
+        # the asyncio primitives are created lazily so they belong to the loop that uses them
+        if self._opening is None:
+            self._opening = asyncio.ensure_future(self._open())
+
+        await self._opening
+
+    async def _open(self):
+        self.writer = await self.connect()
+        await self.writer.execute('PRAGMA journal_mode = WAL')
+        await self.writer.execute('PRAGMA synchronous = NORMAL')
+        self.write_lock = asyncio.Lock()
+
+        self.readers = asyncio.Queue()
+        for _ in range(self.size):
+            conn = await self.connect()
+            await conn.execute('PRAGMA query_only = ON')
+            self.readers.put_nowait(conn)
+
+    async def close(self):
+        """Close all of the pool's connections."""
+        if self._opening is None:
+            return
+
+        await self._opening
+
+        await self.writer.close()
+        while not self.readers.empty():
+            await self.readers.get_nowait().close()
+
+        self.writer = None
+        self.readers = None
+        self._opening = None
+
+    def read(self):
+        """Borrow a reader connection.
+        Returns:
+            async context manager yielding an aiosqlite.Connection.
+        """
+        return _Reader(self)
+
+    def write(self):
+        """Take the writer connection, committing on success and rolling back on error.
+        Returns:
+            async context manager yielding an aiosqlite.Connection.
+        """
+        return _Writer(self)
+
+    async def fetchone(self, sql, parameters=()):
+        async with self.read() as db:
+            async with db.execute(sql, parameters) as cursor:
+                return await cursor.fetchone()
+
+    async def fetchall(self, sql, parameters=()):
+        async with self.read() as db:
+            async with db.execute(sql, parameters) as cursor:
+                return await cursor.fetchall()
+
+
+class _Reader:
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    async def __aenter__(self):
+        await self.pool.open()
+        self.conn = await self.pool.readers.get()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool.readers.put_nowait(self.conn)
+
+
+class _Writer:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        await self.pool.open()
+        await self.pool.write_lock.acquire()
+        return self.pool.writer
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.pool.writer.commit()
+
+            else:
+                await self.pool.writer.rollback()
+
+        finally:
+            self.pool.write_lock.release()
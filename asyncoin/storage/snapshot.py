@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from hashlib import sha256
+import json
+import zlib
+
+# file signature followed by the format version
+MAGIC = b'ASNCSNAP'
+VERSION = 1
+
+
+def encode_snapshot(snapshot):
+    """Serialize a snapshot to its file format: signature, version, SHA-256 of the body, then the zlib compressed JSON body.
+    Args:
+        snapshot (dict): the snapshot, see Blockchain.snapshot.
+
+    Returns:
+        bytes: the encoded snapshot.
+    """
+    body = zlib.compress(json.dumps(snapshot, sort_keys=True).encode(), 9)
+    return MAGIC + bytes([VERSION]) + sha256(body).digest() + body
+
+
+def decode_snapshot(data):
+    """Check and deserialize an encoded snapshot.
+    Args:
+        data (bytes): the encoded snapshot.
+
+    Returns:
+        dict: the snapshot.
+    """
+    header = len(MAGIC) + 1 + 32
+
+    if len(data) < header or not data.startswith(MAGIC):
+        raise ValueError('Not a snapshot file.')
+
+    if data[len(MAGIC)] != VERSION:
+        raise ValueError('Unsupported snapshot version {}.'.format(data[len(MAGIC)]))
+
+    body = data[header:]
+
+    if sha256(body).digest() != data[len(MAGIC) + 1:header]:
+        raise ValueError('Snapshot checksum mismatch, the file is corrupt.')
+
+    return json.loads(zlib.decompress(body).decode())
+
+
+def write_snapshot(path, snapshot):
+    with open(path, 'wb') as file:
+        file.write(encode_snapshot(snapshot))
+
+
+def read_snapshot(path):
+    with open(path, 'rb') as file:
+        return decode_snapshot(file.read())
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+
+from asyncoin.cryptocurrency.block import Block, BlockHeader, HEADER_VERSION
+from asyncoin.storage.backend import Storage, StorageError
+from asyncoin.storage.migrations import migrate
+from asyncoin.storage.pool import ConnectionPool
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/startup.sql')) as script:
+    startup_script = script.read()
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/block_template.sql')) as script:
+    block_template = script.read()
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/transaction_template.sql')) as script:
+    transaction_template = script.read()
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/consensus_template.sql')) as script:
+    consensus_template = script.read()
+
+with open(os.path.join(os.path.dirname(__file__), os.pardir, 'sql/replay_accounts.sql')) as script:
+    replay_accounts_script = script.read()
+
+
+def block_rows(blocks):
+    # the merkle root is kept so headers can be served without reading the transactions
+    return [(block.index, block.hash, block.nonce, block.previous_hash, block.timestamp, block.version,
+             block.merkle_root if block.version >= HEADER_VERSION else None) for block in blocks]
+
+
+def transaction_rows(blocks):
+    return [(block.hash, t.hash, t.to, t.from_, t.amount, t.timestamp, t.signature, t.nonce, t.fee) for block in blocks for t in block]
+
+
+class SQLiteStorage(Storage):
+    """Keeps the whole chain in a single SQLite database.
+    Attributes:
+        path (str): path to the database file.
+        pool (ConnectionPool): the database connections.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.pool = ConnectionPool(path)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def create(self, config_):
+        conn = sqlite3.connect(self.path)
+        conn.executescript(startup_script)
+        migrate(conn)
+        conn.close()
+
+        self.save_config(config_)
+
+    def load(self):
+        conn = sqlite3.connect(self.path)
+
+        # existing databases are brought up to the current schema in place
+        migrate(conn)
+
+        config_ = conn.execute('SELECT * FROM "CONFIG"').fetchone()
+        state = conn.execute('SELECT HEIGHT, DIFFICULTY, REWARD, EPOCH_TIMESTAMP, TIP_HASH FROM "CONSENSUS"').fetchone()
+        conn.close()
+
+        if config_ is not None:
+            config_ = {'REWARD_HALVING': config_[0],
+                       'TIME_TARGET': config_[1],
+                       'DIFFICULTY_ADJUST': config_[2],
+                       'INITIAL_REWARD': config_[3],
+                       'INITIAL_DIFFICULTY': config_[4],
+                       'HEADER_ACTIVATION': config_[5]}
+
+        return config_, tuple(state) if state is not None else None
+
+    def import_snapshot(self, snapshot, blocks):
+        self.create(snapshot['config'])
+
+        conn = sqlite3.connect(self.path)
+
+        with conn:
+            conn.executemany('INSERT INTO "ACCOUNTS" VALUES (?, ?, ?)', snapshot['accounts'])
+            # kept so the account state can still be rebuilt without the history before the snapshot
+            conn.executemany('INSERT INTO "SNAPSHOT_ACCOUNTS" VALUES (?, ?, ?)', snapshot['accounts'])
+            conn.execute('INSERT INTO "SNAPSHOT" VALUES (0, ?, ?, ?, ?, ?, ?)', (blocks[0].index, snapshot['height'], snapshot['difficulty'], snapshot['reward'], snapshot['epoch_timestamp'], snapshot['tip_hash']))
+            conn.execute(consensus_template, (snapshot['height'], snapshot['difficulty'], snapshot['reward'], snapshot['epoch_timestamp'], snapshot['tip_hash'], blocks[-1].timestamp))
+            self.import_blocks(conn, blocks)
+
+        conn.close()
+
+    def import_blocks(self, conn, blocks):
+        conn.executemany(block_template, block_rows(blocks))
+        conn.executemany(transaction_template, transaction_rows(blocks))
+
+    def load_base(self):
+        conn = sqlite3.connect(self.path)
+        base = conn.execute('SELECT FIRST_BLOCK, HEIGHT, DIFFICULTY, REWARD, EPOCH_TIMESTAMP, TIP_HASH FROM "SNAPSHOT"').fetchone()
+        conn.close()
+
+        return tuple(base) if base is not None else None
+
+    def save_config(self, config_):
+        conn = sqlite3.connect(self.path)
+        conn.execute('INSERT INTO "CONFIG" VALUES (?, ?, ?, ?, ?, ?)', (config_['REWARD_HALVING'], config_['TIME_TARGET'], config_['DIFFICULTY_ADJUST'], config_['INITIAL_REWARD'], config_['INITIAL_DIFFICULTY'], config_.get('HEADER_ACTIVATION')))
+        conn.commit()
+        conn.close()
+
+    def save_state(self, state):
+        conn = sqlite3.connect(self.path)
+        tip_timestamp = conn.execute('SELECT TIMESTAMP FROM "BLOCKS" WHERE "HASH" = ?', (state[-1],)).fetchone()
+        conn.execute(consensus_template, tuple(state) + (tip_timestamp[0] if tip_timestamp else None,))
+        conn.commit()
+        conn.close()
+
+    def headers(self, height=None):
+        conn = sqlite3.connect(self.path)
+        yield from conn.execute('SELECT NUMBER, HASH, TIMESTAMP FROM "BLOCKS" WHERE "NUMBER" < ? ORDER BY "NUMBER"', (height if height is not None else 2 ** 63 - 1,))
+        conn.close()
+
+    def load_tip(self, height, count):
+        conn = sqlite3.connect(self.path)
+
+        timestamps = [row[0] for row in conn.execute(
+            'SELECT TIMESTAMP FROM "BLOCKS" WHERE "NUMBER" < ? ORDER BY "NUMBER" DESC LIMIT ?', (height, count))]
+
+        tip = conn.execute('SELECT * FROM "BLOCKS" WHERE "NUMBER" = ?', (height - 1,)).fetchone()
+        tip = Block.from_tuple(tip, conn.execute(
+            'SELECT * FROM "TRANSACTIONS" WHERE "BLOCKHASH" = ? ORDER BY ROWID', (tip[1],)).fetchall())
+
+        conn.close()
+
+        return tip, timestamps[::-1]
+
+    async def read_blocks(self, start, end):
+        async with self.pool.read() as db:
+            async with db.execute('SELECT * FROM "BLOCKS" WHERE "NUMBER" BETWEEN ? AND ? ORDER BY "NUMBER"', (start, end)) as cursor:
+                blocks = await cursor.fetchall()
+
+            # a fixed statement (rather than a generated IN (...) list) so the prepared statement is reused
+            async with db.execute('SELECT "TRANSACTIONS".* FROM "TRANSACTIONS" JOIN "BLOCKS" ON "TRANSACTIONS"."BLOCKHASH" = "BLOCKS"."HASH" WHERE "BLOCKS"."NUMBER" BETWEEN ? AND ? ORDER BY "TRANSACTIONS".ROWID', (start, end)) as cursor:
+                transactions = await cursor.fetchall()
+
+        by_block = {block[1]: [] for block in blocks}
+        for transaction in transactions:
+            if transaction[0] in by_block:
+                by_block[transaction[0]].append(transaction)
+
+        return [Block.from_tuple(block, by_block[block[1]]) for block in blocks]
+
+    async def read_json(self, start, end):
+        return [repr(block).encode() for block in await self.read_blocks(start, end)]
+
+    async def read_headers(self, start, end):
+        rows = await self.pool.fetchall('SELECT "VERSION", "NUMBER", "PREVIOUSHASH", "MERKLEROOT", "TIMESTAMP", "NONCE" FROM "BLOCKS" WHERE "NUMBER" BETWEEN ? AND ? ORDER BY "NUMBER"', (start, end))
+
+        if any(row[3] is None for row in rows):
+            # written before merkle roots were stored
+            return await super().read_headers(start, end)
+
+        return [BlockHeader(*row) for row in rows]
+
+    async def block_index(self, hash_):
+        index = await self.pool.fetchone('SELECT "NUMBER" FROM "BLOCKS" WHERE "HASH" = ?', (hash_,))
+        return index[0] if index is not None else None
+
+    async def transaction_block(self, hash_):
+        index = await self.pool.fetchone('SELECT "BLOCKS"."NUMBER" FROM "TRANSACTIONS" JOIN "BLOCKS" ON "TRANSACTIONS"."BLOCKHASH" = "BLOCKS"."HASH" WHERE "TRANSACTIONS"."HASH" = ?', (hash_,))
+        return index[0] if index is not None else None
+
+    async def get_account(self, address):
+        account = await self.pool.fetchone('SELECT "BALANCE", "NONCE" FROM "ACCOUNTS" WHERE "ADDRESS" = ?', (address,))
+        return tuple(account) if account is not None else None
+
+    async def read_state(self):
+        async with self.pool.read() as db:
+            # both are read in one transaction, which sees the database as of its first read however much is written meanwhile
+            await db.execute('BEGIN')
+
+            try:
+                async with db.execute('SELECT HEIGHT, DIFFICULTY, REWARD, EPOCH_TIMESTAMP, TIP_HASH FROM "CONSENSUS"') as cursor:
+                    state = await cursor.fetchone()
+
+                async with db.execute('SELECT "ADDRESS", "BALANCE", "NONCE" FROM "ACCOUNTS"') as cursor:
+                    accounts = await cursor.fetchall()
+
+            finally:
+                await db.rollback()
+
+        return tuple(state), accounts
+
+    def write(self):
+        return SQLiteWrite(self)
+
+    async def rebuild_accounts(self):
+        async with self.pool.write() as db:
+            await db.executescript(replay_accounts_script)
+
+    async def close(self):
+        await self.pool.close()
+
+
+class SQLiteWrite:
+    """A write transaction on the pool's writer connection."""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.writer = storage.pool.write()
+        self.db = None
+
+    async def __aenter__(self):
+        self.db = await self.writer.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.writer.__aexit__(exc_type, exc, tb)
+
+        if isinstance(exc, sqlite3.IntegrityError):
+            raise StorageError(str(exc)) from exc
+
+    async def get_account(self, address):
+        async with self.db.execute('SELECT "BALANCE", "NONCE" FROM "ACCOUNTS" WHERE "ADDRESS" = ?', (address,)) as cursor:
+            account = await cursor.fetchone()
+
+        return tuple(account) if account is not None else None
+
+    async def write_blocks(self, blocks, consensus, accounts):
+        """Write a run of blocks, the account states they result in and the consensus checkpoint.
+        Args:
+            blocks (list): the blocks to write, in order.
+            consensus (tuple): the difficulty, reward and epoch timestamp following the last block.
+            accounts (dict): the new [balance, nonce] of every account the blocks touch.
+        """
+        await self.write_chain(blocks)
+        await self.db.executemany('INSERT OR REPLACE INTO "ACCOUNTS" VALUES (?, ?, ?)', [(address, balance, nonce) for address, (balance, nonce) in accounts.items()])
+        await self.db.execute(consensus_template, (blocks[-1].index + 1,) + tuple(consensus) + (blocks[-1].hash, blocks[-1].timestamp))
+
+    async def write_chain(self, blocks):
+        await self.db.executemany(block_template, block_rows(blocks))
+        await self.db.executemany(transaction_template, transaction_rows(blocks))
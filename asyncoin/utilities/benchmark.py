@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import tempfile
+import shutil
+import time
+import os
+
+from asyncoin.cryptocurrency.blockchain import Blockchain, config
+from asyncoin.cryptocurrency.keys import KeyPair
+
+
+async def hash_throughput(blockchain, reward_address, rounds=4):
+    """Measure raw hash throughput by searching a template at a difficulty no nonce will meet.
+    Args:
+        blockchain (Blockchain): the chain to build the template from.
+        reward_address (str): the address the template rewards.
+        rounds (int, optional): how many rounds of nonces to search.
+
+    Returns:
+        tuple:
+            int: number of hashes tried.
+            float: seconds it took.
+    """
+    template = await blockchain.block_template(reward_address)
+    miner = blockchain.miner
+
+    miner.reset()
+    hashes, started = miner.hashes, time.time()
+    start = 0
+
+    for _ in range(rounds):
+        _, start = await miner.search(template, 64, start)
+
+    return miner.hashes - hashes, time.time() - started
+
+
+async def block_latency(blockchain, reward_address, blocks):
+    """Measure how long it takes to produce blocks end to end, from building the template to the block being added.
+    Args:
+        blockchain (Blockchain): the chain to mine on.
+        reward_address (str): the address to send the rewards to.
+        blocks (int): how many blocks to mine.
+
+    Returns:
+        list: seconds each block took.
+    """
+    latencies = []
+
+    for _ in range(blocks):
+        started = time.time()
+        block = await blockchain.mine_block(reward_address)
+
+        if not await blockchain.add_block(block):
+            raise ValueError('Mined an invalid block at height {}.'.format(block.index))
+
+        latencies.append(time.time() - started)
+
+    return latencies
+
+
+def bench_mine(loop, difficulty=4, blocks=10, workers=None, storage='sqlite'):
+    """Benchmark mining on a throwaway chain, at a fixed difficulty.
+    Args:
+        loop (asyncio.AbstractEventLoop): the event loop to run on.
+        difficulty (int, optional): the difficulty to mine at.
+        blocks (int, optional): how many blocks to mine for the latency measurement.
+        workers (int, optional): number of mining processes, one per core by default.
+        storage (str, optional): the storage backend.
+
+    Returns:
+        dict: the hash rate, block latencies and the miner's own counters.
+    """
+    directory = tempfile.mkdtemp()
+    keys = KeyPair()
+
+    # difficulty is held where it is for the whole run
+    config_ = dict(config, INITIAL_DIFFICULTY=difficulty, DIFFICULTY_ADJUST=blocks + 2)
+
+    try:
+        blockchain = Blockchain(keys.address, config_, db=os.path.join(directory, 'bench.db'), storage=storage, mining_workers=workers)
+        blockchain.miner.start()
+
+        try:
+            hashes, elapsed = loop.run_until_complete(hash_throughput(blockchain, keys.address))
+            latencies = loop.run_until_complete(block_latency(blockchain, keys.address, blocks))
+
+        finally:
+            loop.run_until_complete(blockchain.close())
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    latencies.sort()
+
+    return {'difficulty': difficulty,
+            'workers': blockchain.miner.workers,
+            'hashes': hashes,
+            'hashrate': hashes / elapsed if elapsed else None,
+            'blocks': len(latencies),
+            'average_block_time': sum(latencies) / len(latencies) if latencies else None,
+            'median_block_time': latencies[len(latencies) // 2] if latencies else None,
+            'max_block_time': latencies[-1] if latencies else None,
+            'miner': blockchain.miner.stats()}
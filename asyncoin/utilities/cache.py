@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A least recently used cache bounded by entry count and by size.
+    Attributes:
+        max_entries (int): the most entries the cache holds.
+        max_bytes (int): the most total size the cache holds, None for no limit.
+        size (int): the total size of the cached entries.
+        hits (int): number of lookups that found an entry.
+        misses (int): number of lookups that didn't.
+        evictions (int): number of entries dropped to make room.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None):
+        """
+        Args:
+            max_entries (int, optional): the most entries the cache holds.
+            max_bytes (int, optional): the most total size the cache holds.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Look up an entry, marking it as recently used.
+        Args:
+            key: the entry's key.
+            default (optional): returned if there's no entry for the key.
+
+        Returns:
+            the cached value, or default.
+        """
+        try:
+            value, size = self.entries[key]
+
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def put(self, key, value, size=0):
+        """Add or replace an entry, evicting the least recently used entries to make room.
+        Args:
+            key: the entry's key.
+            value: the value to cache.
+            size (int, optional): the entry's size, counted against max_bytes.
+        """
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        self.discard(key)
+
+        self.entries[key] = (value, size)
+        self.size += size
+
+        while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.size > self.max_bytes):
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def discard(self, key):
+        """Remove an entry if it's cached.
+        Args:
+            key: the entry's key.
+        """
+        entry = self.entries.pop(key, None)
+
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: the cache's occupancy and hit/miss counters.
+        """
+        return {'entries': len(self.entries),
+                'bytes': self.size,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+    # Special class methods
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
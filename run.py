@@ -3,9 +3,15 @@
 
 from argparse import ArgumentParser
 
+import asyncio
+
 from asyncoin.network.node import Node
 
+from asyncoin.cryptocurrency.blockchain import Blockchain
+
 from asyncoin.cryptocurrency.keys import KeyPair
+from asyncoin.storage.snapshot import write_snapshot
+from asyncoin.utilities.benchmark import bench_mine
 from asyncoin.utilities.encryption import encrypt
 
 
@@ -14,12 +20,54 @@ parser.add_argument('mode')
 parser.add_argument('-port', type=int, default=8000)
 parser.add_argument('-db', default='blockchain.db')
 parser.add_argument('-sync', default=None)
+parser.add_argument('-verify-state', '--verify-state', action='store_true')
+parser.add_argument('-cache', type=int, default=64)
+parser.add_argument('-batch', type=int, default=500)
+parser.add_argument('-storage', default='sqlite', choices=['sqlite', 'flatfile'])
+parser.add_argument('-snapshot', nargs='?', const=True, default=None)
+parser.add_argument('-height', type=int, default=None)
+parser.add_argument('-out', default='snapshot.dat')
+parser.add_argument('-workers', type=int, default=None)
+parser.add_argument('-verify-workers', '--verify-workers', type=int, default=None)
+parser.add_argument('-mempool', type=int, default=32)
+parser.add_argument('-relay-batch', '--relay-batch', type=int, default=1000)
+parser.add_argument('-mempool-entries', '--mempool-entries', type=int, default=50000)
+parser.add_argument('-mempool-age', '--mempool-age', type=int, default=3 * 60 * 60)
+parser.add_argument('-difficulty', type=int, default=4)
+parser.add_argument('-blocks', type=int, default=10)
 
 args = parser.parse_args()
 
 if args.mode.lower() == 'node':
-    node = Node(args.port, args.db)
-    node.run(args.sync)
+    node = Node(args.port, args.db, args.cache * 1024 * 1024, args.batch, args.storage, args.workers,
+                args.mempool * 1024 * 1024, args.mempool_age, args.verify_workers, args.relay_batch,
+                args.mempool_entries)
+    node.run(args.sync, args.verify_state, args.snapshot)
+
+elif args.mode.lower() == 'rebuild':
+    blockchain = Blockchain(db='{}{}'.format(args.port, args.db), storage=args.storage)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(blockchain.rebuild_accounts())
+    loop.run_until_complete(blockchain.close())
+    print('Rebuilt account state.')
+
+elif args.mode.lower() == 'snapshot':
+    blockchain = Blockchain(db='{}{}'.format(args.port, args.db), storage=args.storage)
+    loop = asyncio.get_event_loop()
+    snapshot = loop.run_until_complete(blockchain.snapshot(args.height))
+    loop.run_until_complete(blockchain.close())
+    write_snapshot(args.out, snapshot)
+    print('Wrote snapshot at height {} to {}.'.format(snapshot['height'], args.out))
+
+elif args.mode.lower() == 'bench-mine':
+    results = bench_mine(asyncio.get_event_loop(), args.difficulty, args.blocks, args.workers, args.storage)
+    print('Workers: {}, Difficulty: {}'.format(results['workers'], results['difficulty']))
+    print('Hashrate: {} H/s over {} hashes'.format(round(results['hashrate'] or 0), results['hashes']))
+
+    # with -blocks 0 only the hash rate is measured
+    if results['blocks']:
+        print('Blocks: {}, Average: {:.3f}s, Median: {:.3f}s, Max: {:.3f}s'.format(
+            results['blocks'], results['average_block_time'], results['median_block_time'], results['max_block_time']))
 
 elif args.mode.lower() == 'generate':
     pass_ = input('Enter a Passphrase > ')
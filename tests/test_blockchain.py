@@ -1,16 +1,38 @@
 import asyncio
 import unittest
+import sqlite3
+import shutil
 import os
+from json import loads
+from unittest.mock import patch
 
 try:
-    from asyncoin.cryptocurrency.blockchain import Blockchain
-    from asyncoin.cryptocurrency.keys import KeyPair
+    from asyncoin.cryptocurrency.blockchain import Blockchain, config
+    from asyncoin.cryptocurrency.block import Block
+    from asyncoin.cryptocurrency.transaction import Transaction
+    from asyncoin.cryptocurrency.keys import KeyPair, BatchVerifier
+    from asyncoin.cryptocurrency.mempool import Mempool
+    from asyncoin.cryptocurrency.validation import well_formed_block
+    from asyncoin.cryptocurrency.lightclient import HeaderChain
+    from asyncoin.storage.migrations import SCHEMA_VERSION
+    from asyncoin.storage.sqlite import startup_script
+    from asyncoin.storage.flatfile import HashTable, MappedIndex, HASH_RECORD
+    from asyncoin.storage.snapshot import encode_snapshot, decode_snapshot
 
 except ModuleNotFoundError:
     import sys
     sys.path.append('..')
-    from asyncoin.cryptocurrency.blockchain import Blockchain
-    from asyncoin.cryptocurrency.keys import KeyPair
+    from asyncoin.cryptocurrency.blockchain import Blockchain, config
+    from asyncoin.cryptocurrency.block import Block
+    from asyncoin.cryptocurrency.transaction import Transaction
+    from asyncoin.cryptocurrency.keys import KeyPair, BatchVerifier
+    from asyncoin.cryptocurrency.mempool import Mempool
+    from asyncoin.cryptocurrency.validation import well_formed_block
+    from asyncoin.cryptocurrency.lightclient import HeaderChain
+    from asyncoin.storage.migrations import SCHEMA_VERSION
+    from asyncoin.storage.sqlite import startup_script
+    from asyncoin.storage.flatfile import HashTable, MappedIndex, HASH_RECORD
+    from asyncoin.storage.snapshot import encode_snapshot, decode_snapshot
 
 
 class Test_Blockchain(unittest.TestCase):
@@ -27,6 +49,170 @@ class Test_Blockchain(unittest.TestCase):
 
         self.loop.run_until_complete(mining())
 
+    def test_mining_in_processes(self):
+        self.blockchain.miner.workers = 2
+        self.blockchain.miner.chunk_size = 1000
+
+        async def mining():
+            block = await self.blockchain.mine_block(self.keys.address)
+            self.assertTrue(await self.blockchain.add_block(block))
+
+            # a stale search is abandoned rather than returning a block
+            self.blockchain.miner.cancel()
+            template = await self.blockchain.block_template(self.keys.address)
+            self.assertEqual(await self.blockchain.miner.search(template, 64), (None, 2000))
+
+            stats = self.blockchain.miner.stats()
+            self.assertEqual((stats['blocks'], stats['stale_rounds']), (1, 1))
+            self.assertGreater(stats['hashes'], 0)
+
+        self.loop.run_until_complete(mining())
+
+    def test_verifying_in_batches(self):
+        verifier = BatchVerifier(workers=2, chunk_size=2)
+        friend_address = KeyPair().address
+
+        transactions = [self.keys.Transaction(to=friend_address, amount=1, fee=1, nonce=nonce) for nonce in range(5)]
+        forged = transactions[1].with_signature(transactions[0].signature)
+
+        try:
+            results = self.loop.run_until_complete(verifier.verify(transactions + [forged]))
+
+        finally:
+            verifier.close()
+
+        self.assertEqual(results, [True] * 5 + [False])
+
+    def test_remembering_signatures(self):
+        async def remembering():
+            transaction = self.keys.Transaction(to=KeyPair().address, amount=10, fee=1, nonce=0)
+            await self.blockchain.add_transaction(transaction)
+            self.assertIn(transaction.hash, self.blockchain.signatures)
+
+            # a forgery of the same transaction doesn't pass for it
+            forged = transaction.with_signature(self.keys.sign(self.keys.Transaction(to=KeyPair().address, amount=1, fee=1, nonce=0)))
+            self.assertFalse(self.blockchain.check_signature(forged))
+
+            hits = self.blockchain.signatures.hits
+            self.assertTrue(await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address)))
+            self.assertEqual(self.blockchain.signatures.hits, hits + 1)
+            self.assertNotIn(transaction.hash, self.blockchain.signatures)
+
+        self.loop.run_until_complete(remembering())
+
+    def test_adding_transactions_in_batches(self):
+        async def adding():
+            transactions = [self.keys.Transaction(to=KeyPair().address, amount=10, fee=1, nonce=nonce) for nonce in range(3)]
+            forged = transactions[1].with_signature(self.keys.sign(self.keys.Transaction(to=KeyPair().address, amount=1, fee=1, nonce=5)))
+
+            # fields of the wrong type only fail their own transaction
+            malformed = [Transaction(**dict(transactions[0].to_dict(), **field)) for field in (
+                {'amount': 'x'}, {'to': 5}, {'fee': None}, {'amount': float('nan')})]
+
+            self.assertEqual(await self.blockchain.add_transactions(transactions[:1] + [forged] + malformed + transactions[1:]),
+                             [True, False, False, False, False, False, True, True])
+
+            # nor does a sender that isn't a key, whether added alone or in a batch
+            for from_ in ('x' * 96, '0' * 96):
+                unkeyed = Transaction(**dict(transactions[0].to_dict(), from_=from_))
+                self.assertFalse(await self.blockchain.add_transaction(unkeyed))
+                self.assertEqual(await self.blockchain.add_transactions([unkeyed]), [False])
+            self.assertEqual(len(self.blockchain.pending), 3)
+            self.assertIn(transactions[2].hash, self.blockchain.signatures)
+
+        self.loop.run_until_complete(adding())
+
+    def test_reusing_templates(self):
+        async def building():
+            template, rebuilt = await self.blockchain.templates.get(self.keys.address)
+            self.assertTrue(rebuilt)
+            self.assertEqual(await self.blockchain.templates.get(self.keys.address), (template, False))
+
+            await self.blockchain.add_transaction(self.keys.Transaction(
+                to=KeyPair().address, amount=10, fee=1, nonce=0))
+            template, rebuilt = await self.blockchain.templates.get(self.keys.address)
+            self.assertTrue(rebuilt)
+            self.assertEqual(len(template.data), 2)
+
+            await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+            self.assertEqual(self.blockchain.templates.rebuilds['mempool'], 1)
+            self.assertEqual(self.blockchain.templates.rebuilds['tip'], 0)
+
+            await self.blockchain.templates.get(self.keys.address)
+            self.assertEqual(self.blockchain.templates.rebuilds['tip'], 1)
+
+        self.loop.run_until_complete(building())
+
+    def test_activating_headers(self):
+        activating = Blockchain(self.keys.address, config_=dict(config, HEADER_ACTIVATION=2), db='activating.db')
+
+        async def mining():
+            block = await activating.mine_block(self.keys.address)
+            self.assertEqual(block.version, 1)
+            self.assertTrue(await activating.add_block(block))
+
+            block = await activating.mine_block(self.keys.address)
+            self.assertEqual(block.version, 2)
+            self.assertEqual(block.hash, block.header().hash)
+
+            legacy = Block(index=block.index, nonce=0, data=block.data, previous_hash=block.previous_hash, timestamp=block.timestamp)
+            while not legacy.hash.startswith(activating.difficulty * '1'):
+                legacy = legacy.with_nonce(legacy.nonce + 1)
+
+            self.assertFalse(await activating.add_block(legacy))
+            self.assertTrue(await activating.add_block(Block.from_dict(loads(repr(block)))))
+
+            # headers are served from the stored fields, and only MAX_HEADERS of them at once
+            self.assertEqual(loads((await activating.headers_json(2, 2)).decode()), [loads(repr(block.header()))])
+            self.assertTrue(await activating.add_block(await activating.mine_block(self.keys.address)))
+            with patch('asyncoin.cryptocurrency.blockchain.MAX_HEADERS', 1):
+                self.assertEqual(len(loads((await activating.headers_json(2, 3)).decode())), 1)
+
+            await activating.close()
+
+        self.loop.run_until_complete(mining())
+        os.remove('activating.db')
+
+    def test_proving_transactions(self):
+        async def proving():
+            transactions = [self.keys.Transaction(to=KeyPair().address, amount=1, fee=1, nonce=nonce) for nonce in range(4)]
+            for transaction in transactions:
+                await self.blockchain.add_transaction(transaction)
+
+            await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+            await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+
+            light = HeaderChain(self.blockchain.config_)
+            self.assertEqual(light.add(loads((await self.blockchain.headers_json(0, -1)).decode())), 3)
+
+            proof = await self.blockchain.transaction_proof(transactions[2].hash)
+            self.assertEqual(light.confirmations(transactions[2].hash, proof), 2)
+            self.assertEqual(light.confirmations(transactions[1].hash, proof), 0)
+            self.assertEqual(light.confirmations(transactions[2].hash, dict(proof, signature=transactions[1].signature)), 0)
+
+            # the header commits to the signatures, so swapping one changes the block's hash
+            block = await self.blockchain.block_from_index(1)
+            swapped = Block(index=block.index, nonce=block.nonce, previous_hash=block.previous_hash, timestamp=block.timestamp,
+                            version=block.version, data=block.data[:1] + (block[1].with_signature(block[2].signature),) + block.data[2:])
+            self.assertEqual(swapped[1].hash, block[1].hash)
+            self.assertNotEqual(swapped.hash, block.hash)
+            self.assertIsNone(await self.blockchain.transaction_proof(KeyPair().address[:64]))
+
+        self.loop.run_until_complete(proving())
+
+    def test_finding_transactions(self):
+        async def finding():
+            transaction = self.keys.Transaction(to=KeyPair().address, amount=1, fee=1, nonce=0)
+            await self.blockchain.add_transaction(transaction)
+            self.assertEqual(await self.blockchain.find_transaction(transaction.hash), transaction)
+
+            await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+            self.assertEqual(len(self.blockchain.pending), 0)
+            self.assertEqual(await self.blockchain.find_transaction(transaction.hash), transaction)
+            self.assertIsNone(await self.blockchain.find_transaction(KeyPair().address[:64]))
+
+        self.loop.run_until_complete(finding())
+
     def test_sending(self):
         friend_address = KeyPair().address
         miner_address = KeyPair().address
@@ -44,7 +230,410 @@ class Test_Blockchain(unittest.TestCase):
 
         self.loop.run_until_complete(sending())
 
+    def test_sending_in_sequence(self):
+        friend_address = KeyPair().address
+
+        async def sending():
+            first = self.keys.Transaction(
+                to=friend_address, amount=20, fee=1, nonce=0)
+            second = self.keys.Transaction(
+                to=friend_address, amount=20, fee=1, nonce=1)
+            overspend = self.keys.Transaction(
+                to=friend_address, amount=20, fee=1, nonce=2)
+
+            for transaction in (first, second, overspend):
+                await self.blockchain.add_transaction(transaction)
+
+            block = await self.blockchain.mine_block(self.keys.address)
+            self.assertEqual(block.data[1:], (first, second))
+            self.assertTrue(await self.blockchain.add_block(block))
+
+            self.assertEqual(await self.blockchain.get_balance(friend_address), 40)
+            self.assertEqual(await self.blockchain.get_account_nonce(self.keys.address), 2)
+            self.assertEqual(list(self.blockchain.pending), [overspend])
+
+        self.loop.run_until_complete(sending())
+
+    def test_prioritizing_fees(self):
+        friend_address = KeyPair().address
+        other = KeyPair()
+
+        async def prioritizing():
+            # send the other account enough to pay for one transaction
+            await self.blockchain.add_transaction(self.keys.Transaction(to=other.address, amount=10, fee=1, nonce=0))
+            await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+
+            cheap = self.keys.Transaction(to=friend_address, amount=5, fee=1, nonce=1)
+            following = self.keys.Transaction(to=friend_address, amount=5, fee=1, nonce=2)
+            generous = other.Transaction(to=friend_address, amount=5, fee=5, nonce=0)
+
+            for transaction in (cheap, following, generous):
+                self.assertTrue(await self.blockchain.add_transaction(transaction))
+
+            template = await self.blockchain.block_template(self.keys.address)
+            self.assertEqual(template.data[1:], (generous, cheap, following))
+            self.assertEqual(self.blockchain.pending.select({}), [])
+
+            # a transaction with the same nonce only replaces one that pays less
+            self.assertFalse(await self.blockchain.add_transaction(
+                self.keys.Transaction(to=friend_address, amount=5, fee=1, nonce=1)))
+            replacement = self.keys.Transaction(to=friend_address, amount=5, fee=2, nonce=1)
+            self.assertTrue(await self.blockchain.add_transaction(replacement))
+            self.assertNotIn(cheap, self.blockchain.pending)
+
+            await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+            self.assertEqual(len(self.blockchain.pending), 0)
+
+        self.loop.run_until_complete(prioritizing())
+
+    def test_bounding_mempool(self):
+        pool = Mempool(max_entries=2, max_age=60)
+        first, second = KeyPair(), KeyPair()
+        friend_address = KeyPair().address
+
+        low = first.Transaction(to=friend_address, amount=1, fee=1, nonce=0)
+        following = first.Transaction(to=friend_address, amount=1, fee=9, nonce=1)
+        high = second.Transaction(to=friend_address, amount=1, fee=5, nonce=0)
+
+        for transaction in (low, following):
+            self.assertTrue(pool.add(transaction, now=0))
+
+        # the lowest fee rate goes first, taking the later nonce that depends on it along
+        self.assertTrue(pool.add(high, now=1))
+        self.assertEqual(list(pool), [high])
+        self.assertEqual(pool.stats()['evictions'], 2)
+        self.assertEqual(pool.bytes, Mempool.footprint(high))
+
+        later = first.Transaction(to=friend_address, amount=1, fee=1, nonce=0)
+        self.assertTrue(pool.add(later, now=2))
+
+        pool.expire(now=61.5)
+        self.assertEqual(list(pool), [later])
+        self.assertEqual((pool.bytes, pool.stats()['expirations']), (Mempool.footprint(later), 1))
+
+    def test_rejecting_malformed_blocks(self):
+        async def rejecting():
+            block = loads(repr(await self.blockchain.mine_block(self.keys.address)))
+            self.assertTrue(well_formed_block(Block.from_dict(block)))
+
+            for field in ({'index': '1'}, {'timestamp': None}, {'nonce': 1.5}, {'previous_hash': 5}, {'data': []}):
+                self.assertFalse(well_formed_block(Block.from_dict(dict(block, **field))))
+
+            # so is one with any transaction that isn't, which doesn't get as far as its fee being summed
+            transaction = loads(repr(self.keys.Transaction(to=KeyPair().address, amount=1, fee=1, nonce=0)))
+            mistyped = Block.from_dict(dict(block, data=block['data'] + [dict(transaction, fee='x')]))
+            self.assertFalse(well_formed_block(mistyped))
+            self.assertFalse(await self.blockchain.add_block(mistyped))
+
+        self.loop.run_until_complete(rejecting())
+
+    def test_rejecting_overspending_block(self):
+        friend_address = KeyPair().address
+
+        async def rejecting():
+            transactions = [self.keys.Transaction(to=friend_address, amount=30, fee=1, nonce=nonce) for nonce in range(2)]
+            block = await self.blockchain.mine_block(self.keys.address)
+            block = Block(index=block.index, nonce=0, data=block.data + tuple(transactions),
+                          previous_hash=block.previous_hash, timestamp=block.timestamp, version=block.version)
+
+            while not block.hash.startswith(self.blockchain.difficulty * '1'):
+                block = block.with_nonce(block.nonce + 1)
+
+            self.assertFalse(await self.blockchain.add_block(block))
+            self.assertEqual(await self.blockchain.height(), 1)
+            self.assertEqual(await self.blockchain.get_balance(friend_address), 0)
+
+        self.loop.run_until_complete(rejecting())
+
+    def test_checking_blocks_before_signatures(self):
+        async def checking():
+            transactions = [self.keys.Transaction(to=KeyPair().address, amount=1, fee=1, nonce=nonce) for nonce in range(5)]
+            block = await self.blockchain.mine_block(self.keys.address)
+            unlinked = Block(index=block.index, nonce=0, data=block.data + tuple(transactions),
+                             previous_hash='0' * 64, timestamp=block.timestamp, version=block.version)
+            unmined = Block(index=block.index, nonce=0, data=block.data + tuple(transactions),
+                            previous_hash=block.previous_hash, timestamp=block.timestamp, version=block.version)
+
+            while unmined.hash.startswith(self.blockchain.difficulty * '1'):
+                unmined = unmined.with_nonce(unmined.nonce + 1)
+
+            # neither an unlinked block nor one without proof of work gets as far as its signatures
+            checked = []
+            verify = self.blockchain.verifier.verify
+
+            async def counting(transactions):
+                checked.extend(transactions)
+                return await verify(transactions)
+
+            self.blockchain.verifier.verify = counting
+            self.assertFalse(await self.blockchain.add_block(unlinked))
+            self.assertFalse(await self.blockchain.add_block(unmined))
+            self.assertEqual(checked, [])
+
+            self.assertTrue(await self.blockchain.add_block(block))
+
+        self.loop.run_until_complete(checking())
+
+    def test_adding_blocks(self):
+        shutil.copy('test.db', 'copy.db')
+        copy = Blockchain(db='copy.db')
+
+        async def adding():
+            for _ in range(3):
+                await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+
+            progress = []
+            blocks = await self.blockchain.blocks_from_range(1, 3)
+            self.assertEqual(await copy.add_blocks(blocks, batch_size=2, progress=progress.append), 3)
+
+            self.assertEqual(progress, [2, 3])
+            self.assertEqual(copy.tip, self.blockchain.tip)
+            self.assertEqual(await copy.get_balance(self.keys.address), 200)
+
+            # a run that doesn't follow on from the tip isn't added
+            self.assertEqual(await copy.add_blocks(blocks), 0)
+            await copy.close()
+
+        self.loop.run_until_complete(adding())
+        os.remove('copy.db')
+
+    def test_checking_blocks_in_parallel(self):
+        shutil.copy('test.db', 'copy.db')
+        copy = Blockchain(db='copy.db', verify_workers=2)
+        copy.verifier.chunk_size = 1
+        friend_address = KeyPair().address
+
+        async def checking():
+            for nonce in range(3):
+                await self.blockchain.add_transaction(self.keys.Transaction(to=friend_address, amount=5, fee=1, nonce=nonce))
+                await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+
+            blocks = await self.blockchain.blocks_from_range(1, 3)
+
+            # a forged signature stops the checks at its block
+            forged = blocks[1][1].with_signature(blocks[0][1].signature)
+            tampered = Block(index=2, nonce=blocks[1].nonce, data=(blocks[1][0], forged), previous_hash=blocks[1].previous_hash,
+                             timestamp=blocks[1].timestamp, version=blocks[1].version)
+            self.assertEqual((await copy.check_blocks([blocks[0], tampered, blocks[2]]))[0], 1)
+
+            passed, verified = await copy.check_blocks(blocks)
+            self.assertEqual(passed, 3)
+            self.assertEqual(await copy.add_blocks(blocks, verified=verified), 3)
+            self.assertEqual(await copy.get_balance(friend_address), 15)
+            await copy.close()
+
+        self.loop.run_until_complete(checking())
+        os.remove('copy.db')
+
+    def test_rebuilding_accounts(self):
+        async def rebuilding():
+            block = await self.blockchain.mine_block(self.keys.address)
+            await self.blockchain.add_block(block)
+            await self.blockchain.rebuild_accounts()
+
+            self.assertEqual(await self.blockchain.get_balance(self.keys.address), 100)
+            self.assertEqual(await self.blockchain.get_account_nonce(self.keys.address), 0)
+
+        self.loop.run_until_complete(rebuilding())
+
+    def test_block_cache(self):
+        async def caching():
+            block = await self.blockchain.mine_block(self.keys.address)
+            await self.blockchain.add_block(block)
+
+            self.blockchain.cache_depth = 1
+
+            genesis = await self.blockchain.block_from_index(0)
+            self.assertEqual(await self.blockchain.block_json(0), repr(genesis).encode())
+            self.assertEqual(await self.blockchain.blocks_json(0, 1), '[{}, {}]'.format(genesis, block).encode())
+
+            # the tip is never cached
+            self.assertEqual(len(self.blockchain.block_cache), 1)
+            self.assertEqual(self.blockchain.block_cache.hits, 2)
+
+            # an entry that's only been served as JSON is counted again once it's decoded
+            self.blockchain.block_cache.clear()
+            await self.blockchain.blocks_json(0, 0)
+            serialized = self.blockchain.block_cache.size
+            self.assertEqual(await self.blockchain.block_from_index(0), genesis)
+            self.assertGreater(self.blockchain.block_cache.size, serialized + len(repr(genesis)))
+
+        self.loop.run_until_complete(caching())
+
+    def test_loading_tip(self):
+        async def mining():
+            block = await self.blockchain.mine_block(self.keys.address)
+            await self.blockchain.add_block(block)
+            await self.blockchain.close()
+
+        self.loop.run_until_complete(mining())
+
+        reloaded = Blockchain(db='test.db')
+
+        self.assertEqual(reloaded.chain_height, 2)
+        self.assertEqual(reloaded.tip, self.blockchain.tip)
+        self.assertEqual(list(reloaded.timestamps), list(self.blockchain.timestamps))
+
+    def test_verifying_state(self):
+        Blockchain(db='test.db', verify_state=True)
+
+        conn = sqlite3.connect('test.db')
+        conn.execute('UPDATE CONSENSUS SET DIFFICULTY = DIFFICULTY + 1')
+        conn.commit()
+        conn.close()
+
+        with self.assertRaises(ValueError):
+            Blockchain(db='test.db', verify_state=True)
+
+    def test_migrating(self):
+        original = Blockchain(self.keys.address, config_=dict(config, HEADER_ACTIVATION=None), db='original.db')
+
+        # a copy of the chain in a database from before schema versioning
+        conn = sqlite3.connect('legacy.db')
+        conn.executescript(startup_script)
+        conn.execute("ATTACH DATABASE 'original.db' AS CURRENT")
+        conn.execute('INSERT INTO BLOCKS SELECT NUMBER, HASH, NONCE, PREVIOUSHASH, TIMESTAMP FROM CURRENT.BLOCKS')
+        conn.execute('INSERT INTO TRANSACTIONS SELECT * FROM CURRENT.TRANSACTIONS')
+        conn.execute('INSERT INTO CONFIG SELECT REWARD_HALVING, TIME_TARGET, DIFFICULTY_ADJUSTMENT, INITIAL_REWARD, INITIAL_DIFFICULTY FROM CURRENT.CONFIG')
+        conn.commit()
+        conn.close()
+        os.remove('original.db')
+
+        legacy = Blockchain(db='legacy.db')
+
+        async def migrating():
+            self.assertEqual(await legacy.get_balance(self.keys.address), 50)
+            self.assertEqual(legacy.tip, original.tip)
+            self.assertEqual(legacy.difficulty, original.difficulty)
+            # headers aren't activated on an existing chain without configuring a height
+            self.assertIsNone(legacy.config_['HEADER_ACTIVATION'])
+            self.assertEqual((await legacy.storage.pool.fetchone('SELECT VERSION FROM SCHEMA_VERSION'))[0], SCHEMA_VERSION)
+            self.assertIsNotNone(await legacy.storage.pool.fetchone("SELECT NAME FROM SQLITE_MASTER WHERE TYPE = 'index' AND NAME = 'TRANSACTIONS_SENDER'"))
+            await legacy.close()
+
+        self.loop.run_until_complete(migrating())
+        os.remove('legacy.db')
+
+    def test_flat_file_storage(self):
+        flat = Blockchain(self.keys.address, config_=dict(config, HEADER_ACTIVATION=1), db='flat.db', storage='flatfile')
+
+        async def mining():
+            block = await flat.mine_block(self.keys.address)
+            self.assertTrue(await flat.add_block(block))
+
+            # a reward that's already in the chain can't be claimed again
+            replayed = Block(index=block.index + 1, nonce=0, data=block.data, previous_hash=block.hash,
+                             timestamp=block.timestamp + 1, version=block.version)
+            while not replayed.hash.startswith(flat.difficulty * '1'):
+                replayed = replayed.with_nonce(replayed.nonce + 1)
+
+            self.assertFalse(await flat.add_block(replayed))
+            self.assertEqual(await flat.height(), 2)
+            await flat.close()
+
+            return block
+
+        block = self.loop.run_until_complete(mining())
+
+        reloaded = Blockchain(config_=dict(config, HEADER_ACTIVATION=1), db='flat.db', storage='flatfile', verify_state=True)
+
+        async def reading():
+            self.assertEqual(reloaded.tip, block)
+            self.assertEqual(await reloaded.storage.block_index(block.hash), 1)
+            self.assertEqual(await reloaded.blocks_json(1, 1), '[{}]'.format(block).encode())
+            self.assertEqual(loads((await reloaded.headers_json(1, 1)).decode()), [loads(repr(block.header()))])
+
+            await reloaded.rebuild_accounts()
+            self.assertEqual(await reloaded.get_balance(self.keys.address), 100)
+            await reloaded.close()
+
+        self.loop.run_until_complete(reading())
+
+        os.remove('flat.db')
+        shutil.rmtree('flat.blocks')
+
+    def test_hash_table(self):
+        os.makedirs('table', exist_ok=True)
+        records = [(os.urandom(32), height) for height in range(10000)]
+
+        table = HashTable(os.path.join('table', 'hashes.tbl'))
+        table.open()
+
+        # grows from its smallest size a few times over
+        for start in range(0, len(records), 1000):
+            table.put(records[start:start + 1000])
+
+        self.assertGreaterEqual(table.capacity, 2 * len(records))
+        table.close()
+
+        table.open()
+        self.assertEqual(table.count, len(records))
+        self.assertTrue(all(table.get(key) == height for key, height in records))
+        self.assertIsNone(table.get(os.urandom(32)))
+
+        # refilled from the index it mirrors, e.g. after that's been truncated
+        index = MappedIndex(os.path.join('table', 'hashes.idx'), HASH_RECORD)
+        index.open()
+        index.append(records[:100])
+        table.rebuild(index)
+
+        self.assertEqual(table.count, 100)
+        self.assertEqual(table.get(records[99][0]), 99)
+        self.assertIsNone(table.get(records[100][0]))
+
+        index.close()
+        table.close()
+        shutil.rmtree('table')
+
+    def test_bootstrapping_from_snapshot(self):
+        friend_address = KeyPair().address
+
+        async def exporting():
+            transaction = self.keys.Transaction(
+                to=friend_address, amount=20, fee=1, nonce=0)
+            await self.blockchain.add_transaction(transaction)
+            await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+            await self.blockchain.add_block(await self.blockchain.mine_block(self.keys.address))
+
+            # rolled back to before the transaction, without waiting on writes
+            async with self.blockchain.storage.write():
+                earlier = await asyncio.wait_for(self.blockchain.snapshot(1), 10)
+
+            self.assertEqual(earlier['accounts'], sorted([['Network', -50, 1], [self.keys.address, 50, 0]]))
+
+            return await self.blockchain.snapshot()
+
+        data = encode_snapshot(self.loop.run_until_complete(exporting()))
+
+        with self.assertRaises(ValueError):
+            decode_snapshot(data[:-1] + bytes([data[-1] ^ 1]))
+
+        bootstrapped = Blockchain(db='snapshot.db', snapshot=decode_snapshot(data))
+
+        async def continuing():
+            self.assertEqual(bootstrapped.tip, self.blockchain.tip)
+            self.assertEqual(bootstrapped.difficulty, self.blockchain.difficulty)
+            self.assertEqual(await bootstrapped.get_balance(friend_address), 20)
+
+            # the state before the snapshot isn't known
+            with self.assertRaises(IndexError):
+                await bootstrapped.snapshot(2)
+
+            block = await bootstrapped.mine_block(self.keys.address)
+            self.assertTrue(await bootstrapped.add_block(block))
+
+            await bootstrapped.rebuild_accounts()
+            self.assertEqual(await bootstrapped.get_balance(self.keys.address), 180)
+            await bootstrapped.close()
+
+        self.loop.run_until_complete(continuing())
+
+        Blockchain(db='snapshot.db', verify_state=True)
+        os.remove('snapshot.db')
+
     def tearDown(self):
+        self.loop.run_until_complete(self.blockchain.close())
+        self.loop.close()
         os.remove('test.db')
 
 
@@ -0,0 +1,302 @@
+import asyncio
+import unittest
+import socket
+from json import loads
+
+from aiohttp import web
+
+try:
+    from asyncoin.cryptocurrency.block import Block
+    from asyncoin.cryptocurrency.transaction import Transaction
+    from asyncoin.cryptocurrency.keys import KeyPair
+    from asyncoin.network.downloader import BlockDownloader
+    from asyncoin.network.node import Peers
+
+except ModuleNotFoundError:
+    import sys
+    sys.path.append('..')
+    from asyncoin.cryptocurrency.block import Block
+    from asyncoin.cryptocurrency.transaction import Transaction
+    from asyncoin.cryptocurrency.keys import KeyPair
+    from asyncoin.network.downloader import BlockDownloader
+    from asyncoin.network.node import Peers
+
+
+def make_chain(length):
+    address, previous_hash, chain = KeyPair().address, '0' * 64, []
+
+    for index in range(length):
+        reward = Transaction(to=address, from_='Network', amount=100, fee=0, nonce=index, timestamp=1, signature=None)
+        block = Block(index=index, nonce=0, data=[reward], previous_hash=previous_hash, timestamp=1)
+        chain.append(loads(repr(block)))
+        previous_hash = block.hash
+
+    return chain
+
+
+class StubResponse:
+    def __init__(self, body):
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def json(self):
+        return self.body
+
+    async def text(self):
+        return str(self.body)
+
+
+class StubPeer:
+    """Answers /height and /blockrange from a chain, after a delay, or with whatever 'serve' makes of the range."""
+
+    def __init__(self, chain, delay=0, height=None, serve=None):
+        self.chain = chain
+        self.delay = delay
+        self.height = len(chain) if height is None else height
+        self.serve = serve
+        self.ranges = []
+
+    async def get(self, path):
+        if path == 'height':
+            return self.height
+
+        first, last = (int(part) for part in path.split('/')[1:])
+        self.ranges.append((first, last))
+        await asyncio.sleep(self.delay)
+
+        if self.serve is not None:
+            return self.serve(first, last)
+
+        return self.chain[first:last + 1]
+
+
+class StubSession:
+    def __init__(self, peers):
+        self.peers = peers
+
+    def get(self, url):
+        peer, path = url[len('http://'):].split('/', 1)
+        session = self
+
+        class Request:
+            async def __aenter__(self):
+                if peer not in session.peers:
+                    raise ConnectionRefusedError(peer)
+
+                return StubResponse(await session.peers[peer].get(path))
+
+            async def __aexit__(self, *args):
+                pass
+
+        return Request()
+
+
+class Test_Downloader(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.chain = make_chain(120)
+
+    def download(self, peers, urls=None, **kwargs):
+        """Run a downloader over stub peers, returning it, the windows it handed on, and what it ended with."""
+        kwargs = dict(dict(chunk_size=10, min_chunk=5, max_chunk=20, window_size=25, target_time=0.05), **kwargs)
+        downloader = BlockDownloader(StubSession(peers), list(peers) if urls is None else urls, 1, len(self.chain),
+                                     previous_hash=self.chain[0]['hash'], **kwargs)
+
+        async def downloading():
+            windows = asyncio.Queue(maxsize=2)
+
+            async def check(blocks):
+                return len(blocks)
+
+            task = asyncio.ensure_future(downloader.run(windows, check))
+            handed = []
+
+            while True:
+                window = await windows.get()
+
+                if window is None or isinstance(window, Exception):
+                    await task
+                    return handed, window
+
+                first, blocks, checks = window
+                self.assertEqual(await checks, len(blocks))
+                handed.append((first, blocks))
+
+        handed, last = self.loop.run_until_complete(downloading())
+        return downloader, handed, last
+
+    def assertInOrder(self, handed):
+        blocks = [block for _, blocks in handed for block in blocks]
+        self.assertEqual([block.index for block in blocks], list(range(1, len(self.chain))))
+        self.assertEqual([first for first, _ in handed], [blocks[0].index for _, blocks in handed])
+        self.assertEqual(blocks[-1].hash, self.chain[-1]['hash'])
+
+    def test_downloading_in_order(self):
+        # the faster peer's later ranges arrive first, but are handed on after the earlier ones
+        peers = {'short': StubPeer(self.chain, height=40), 'a': StubPeer(self.chain, delay=0.02),
+                 'b': StubPeer(self.chain, delay=0.001)}
+        downloader, handed, last = self.download(peers)
+
+        self.assertIsNone(last)
+        self.assertInOrder(handed)
+        self.assertTrue(all(size <= 25 + 20 for size in (len(blocks) for _, blocks in handed)))
+
+        # every peer was used, but never asked for blocks it doesn't have
+        self.assertTrue(all(peer.ranges for peer in peers.values()))
+        self.assertTrue(all(last < 40 for _, last in peers['short'].ranges))
+
+    def test_retrying_failed_ranges(self):
+        def mistyped(first, last):
+            # a header block with a nonce of the wrong type can't be hashed
+            return [dict(block, version=2, merkle_root='0' * 64, nonce='x') for block in self.chain[first:last + 1]]
+
+        peers = {'good': StubPeer(self.chain, delay=0.005), 'refusing': StubPeer(self.chain, serve=lambda first, last: {'success': False}),
+                 'mistyped': StubPeer(self.chain, serve=mistyped)}
+        downloader, handed, last = self.download(peers, retries=1)
+
+        self.assertIsNone(last)
+        self.assertInOrder(handed)
+        self.assertGreater(downloader.failures, 0)
+
+        # the failing peers were dropped, and every range they failed was fetched from the good one
+        self.assertEqual([source.url for source in downloader.sources], ['good'])
+        failed = set(peers['refusing'].ranges + peers['mistyped'].ranges)
+        self.assertTrue(failed <= set(peers['good'].ranges))
+
+    def test_skipping_unreachable_peers(self):
+        downloader, handed, last = self.download({'good': StubPeer(self.chain)}, urls=['gone', 'good'])
+        self.assertIsNone(last)
+        self.assertInOrder(handed)
+        self.assertEqual([source.url for source in downloader.sources], ['good'])
+
+        # with no peer to download from, the download ends with the error
+        downloader, handed, last = self.download({}, urls=['gone'])
+        self.assertEqual(handed, [])
+        self.assertIsInstance(last, ValueError)
+
+    def test_hedging_slow_peers(self):
+        # the slow peer takes the first range and would hold everything up for a second
+        peers = {'slow': StubPeer(self.chain, delay=1), 'fast': StubPeer(self.chain)}
+        started = self.loop.time()
+        downloader, handed, last = self.download(peers, per_peer=1, max_ahead=30)
+
+        self.assertIsNone(last)
+        self.assertInOrder(handed)
+        self.assertGreater(downloader.hedged, 0)
+        self.assertIn(peers['slow'].ranges[0], peers['fast'].ranges)
+        self.assertLess(self.loop.time() - started, 1)
+
+    def tearDown(self):
+        self.loop.close()
+
+
+class Test_Peers(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.peers = Peers()
+        self.runners = []
+        self.active = self.most_active = 0
+
+    def serve(self, delay=0, counted=True):
+        """Start a local peer that answers /peers after a delay, returning its url."""
+        async def handler(request):
+            if not counted:
+                await asyncio.sleep(delay)
+                return web.json_response([])
+
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+            await asyncio.sleep(delay)
+            self.active -= 1
+
+            return web.json_response([])
+
+        async def starting():
+            app = web.Application()
+            app.router.add_get('/peers', handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            self.runners.append(runner)
+
+            return '127.0.0.1:{}'.format(site._server.sockets[0].getsockname()[1])
+
+        return self.loop.run_until_complete(starting())
+
+    def test_fanning_out(self):
+        self.peers = Peers(timeout=0.2, concurrency=2)
+        self.peers.peers.update(self.serve(delay=0.05) for _ in range(5))
+
+        # nothing listens on a port that was just let go of
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        refused = '127.0.0.1:{}'.format(closed.getsockname()[1])
+        closed.close()
+
+        # it carries on answering after it's been given up on, so it's left out of the count
+        slow = self.serve(delay=1, counted=False)
+        self.peers.peers.update((refused, slow))
+
+        async def ask(session, peer):
+            async with session.get('http://{}/peers'.format(peer)) as response:
+                return response.status
+
+        # only the peers that answered in time have results
+        self.assertEqual(self.loop.run_until_complete(self.peers.fan_out(ask)), [200] * 5)
+
+        # no more than 'concurrency' requests were in flight at once
+        self.assertEqual(self.most_active, 2)
+
+        # the peer that refused the connection is dropped, the one that timed out is kept
+        self.assertNotIn(refused, self.peers.peers)
+        self.assertIn(slow, self.peers.peers)
+
+    def test_sharing_a_session(self):
+        async def sharing():
+            session = self.peers.client()
+            self.assertIs(self.peers.client(), session)
+
+            task = self.peers.background(asyncio.sleep(10))
+            await self.peers.close_peers()
+
+            self.assertTrue(session.closed)
+            self.assertIsNone(self.peers.session)
+            await asyncio.sleep(0)
+            self.assertTrue(task.cancelled())
+
+            # it's opened again when next needed
+            self.assertFalse(self.peers.client().closed)
+
+        self.loop.run_until_complete(sharing())
+
+    def test_checking_announcers(self):
+        self.peers.peers.add('10.0.0.2:8000')
+
+        # known peers, and the host an announcement came from, are fetched from
+        self.assertTrue(self.peers.announcer('10.0.0.2:8000', '10.0.0.9'))
+        self.assertTrue(self.peers.announcer('10.0.0.9:8001', '10.0.0.9'))
+
+        # anywhere else the caller names isn't
+        self.assertFalse(self.peers.announcer('169.254.169.254:80', '10.0.0.9'))
+        self.assertFalse(self.peers.announcer('10.0.0.9@10.0.0.3:80', '10.0.0.9'))
+        self.assertFalse(self.peers.announcer('10.0.0.3:notaport', None))
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.peers.close_peers())
+
+        for runner in self.runners:
+            self.loop.run_until_complete(runner.cleanup())
+
+        self.loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()